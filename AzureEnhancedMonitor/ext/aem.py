@@ -20,7 +20,9 @@
 import os
 import re
 import sys
+import copy
 import socket
+import threading
 import traceback
 import time
 import datetime
@@ -37,6 +39,7 @@ FAILED_TO_RETRIEVE_MDS_DATA="(03100)Failed to retrieve mds data"
 FAILED_TO_RETRIEVE_LOCAL_DATA="(03101)Failed to retrieve local data"
 FAILED_TO_RETRIEVE_STORAGE_DATA="(03102)Failed to retrieve storage data"
 FAILED_TO_SERIALIZE_PERF_COUNTERS="(03103)Failed to serialize perf counters"
+DATA_SOURCE_TIMEOUT="(03104)Data source timed out"
 
 def timedelta_total_seconds(delta):
 
@@ -381,50 +384,131 @@ def sameList(l1, l2):
             return False
     return True
 
+NetworkCounterFile = os.path.join(LibDir, "NetworkCounters")
+BootIdFile = "/proc/sys/kernel/random/boot_id"
+UptimeFile = "/proc/uptime"
+CounterWrap32 = 1 << 32
+
+def readProcFile(path):
+    try:
+        with open(path) as F:
+            return F.read().strip()
+    except IOError:
+        return None
+
+def getBootId():
+    return readProcFile(BootIdFile)
+
+def getUptime():
+    uptime = readProcFile(UptimeFile)
+    if uptime is None:
+        return None
+    return float(uptime.split()[0])
+
+def getCounterDelta(oldValue, newValue):
+    """
+    The counters of a 32 bit kernel wrap at 2^32. A counter going back from
+    the upper half of that range is taken as wrapped, otherwise it has been
+    reset (the driver was reloaded) and counts from zero again.
+    """
+    if newValue >= oldValue:
+        return newValue - oldValue
+    if oldValue < CounterWrap32 and oldValue >= CounterWrap32 / 2:
+        return newValue + CounterWrap32 - oldValue
+    return newValue
+
+class NetworkCounterStore(object):
+    """
+    Keeps the byte counters of the adapters from the previous cycle on disk,
+    the rates are the deltas over the whole cycle and survive a restart of
+    the daemon.
+
+    File format: the boot id, the timestamp, then "nic bytes_sent bytes_recv"
+    for each adapter.
+    """
+    def getCounters(self):
+        if not os.path.isfile(NetworkCounterFile):
+            return None, None, {}
+        try:
+            lines = waagent.GetFileContents(NetworkCounterFile).split("\n")
+            bootId = lines[0]
+            timestamp = float(lines[1])
+            counters = {}
+            for line in lines[2:]:
+                fields = line.split()
+                if len(fields) == 3:
+                    counters[fields[0]] = (long(fields[1]), long(fields[2]))
+            return bootId, timestamp, counters
+        except (ValueError, IndexError, AttributeError):
+            waagent.Warn("Invalid network counter file, ignored.")
+            return None, None, {}
+
+    def setCounters(self, bootId, timestamp, counters):
+        content = "{0}\n{1}".format(bootId, repr(timestamp))
+        for nicName, values in counters.iteritems():
+            content += "\n{0} {1} {2}".format(nicName, values[0], values[1])
+        return waagent.SetFileContents(NetworkCounterFile, content)
+
+    def update(self, bootId, timestamp, uptime, counters):
+        """
+        Saves counters, {nic: (bytes_sent, bytes_recv)}, and returns
+        {nic: (write rate, read rate)} in bytes per second since the previous
+        update. After a reboot the counters started from zero at boot, so the
+        rate is the average since then. The same goes for the first update.
+        A rate which cannot be told is 0.
+        """
+        oldBootId, oldTimestamp, oldCounters = self.getCounters()
+        rebooted = (oldBootId is None or bootId is None or
+                    oldBootId != bootId)
+        if rebooted:
+            interval = uptime
+            oldCounters = {}
+        else:
+            interval = timestamp - oldTimestamp
+        rates = {}
+        for nicName, values in counters.iteritems():
+            if interval is None or interval <= 0:
+                rates[nicName] = (0, 0)
+            elif not rebooted and nicName not in oldCounters:
+                #A new adapter, it has no previous counters yet
+                rates[nicName] = (0, 0)
+            else:
+                oldValues = oldCounters.get(nicName, (0, 0))
+                rates[nicName] = tuple(
+                        getCounterDelta(oldValues[i], values[i]) / interval
+                        for i in range(0, 2))
+        if self.setCounters(bootId, timestamp, counters) is None:
+            waagent.Warn("Failed to save network counters.")
+        return rates
+
 class NetworkInfo(object):
     def __init__(self):
         self.nics = psutil.net_io_counters(pernic=True)
+        self.timestamp = time.time()
         self.nicNames = []
         for nicName, stat in self.nics.iteritems():
             if nicName != 'lo':
                 self.nicNames.append(nicName)
+        counters = {}
+        for nicName, stat in self.nics.iteritems():
+            counters[nicName] = (stat[0], stat[1])
+        self.rates = NetworkCounterStore().update(getBootId(),
+                                                  self.timestamp,
+                                                  getUptime(),
+                                                  counters)
 
     def getAdapterIds(self):
         return self.nicNames
 
     def getNetworkReadBytes(self, adapterId):
-        net = psutil.net_io_counters(pernic=True)
-        if net[adapterId] != None:
-            bytes_recv1 = net[adapterId][1]
-            time1 = time.time()
-            
-            time.sleep(0.2)
-            
-            net = psutil.net_io_counters(pernic=True)
-            bytes_recv2 = net[adapterId][1]
-            time2 = time.time()
-            
-            interval = (time2 - time1)
-            
-            return (bytes_recv2 - bytes_recv1) / interval
+        if adapterId in self.rates:
+            return self.rates[adapterId][1]
         else:
             return 0
 
     def getNetworkWriteBytes(self, adapterId):
-        net = psutil.net_io_counters(pernic=True)
-        if net[adapterId] != None:
-            bytes_sent1 = net[adapterId][0]
-            time1 = time.time()
-            
-            time.sleep(0.2)
-            
-            net = psutil.net_io_counters(pernic=True)
-            bytes_sent2 = net[adapterId][0]
-            time2 = time.time()
-            
-            interval = (time2 - time1)
-            
-            return (bytes_sent2 - bytes_sent1) / interval
+        if adapterId in self.rates:
+            return self.rates[adapterId][0]
         else:
             return 0
 
@@ -816,17 +900,79 @@ def getStorageTableKeyRange():
     startTime = endTime - MonitoringInterval
     return getStorageTimestamp(startTime), getStorageTimestamp(endTime)
 
-def getStorageMetrics(account, key, hostBase, table, startKey, endKey):
-    try:
-        waagent.Log("Retrieve storage metrics data.")
-        tableService = TableService(account_name = account, 
-                                    account_key = key,
-                                    host_base = hostBase)
+def getContinuationKey(result, name):
+    #The continuation headers are stored in lower case
+    name = name.lower()
+    continuation = getattr(result, "x_ms_continuation", None)
+    if continuation is None or name not in continuation:
+        return None
+    return continuation[name]
+
+class StorageMetricsFetcher(object):
+    """
+    Fetches the minute metrics of one storage account with one table client.
+    The last ingested partition key is remembered, a minute which has been
+    read already is not queried again and only the new minute rows are
+    requested, following the continuation of the query.
+    """
+    def __init__(self, account, key, hostBase):
+        self.account = account
+        self.key = key
+        self.hostBase = hostBase
+        self.tableService = TableService(account_name = account, 
+                                         account_key = key,
+                                         host_base = hostBase)
+        self.table = None
+        self.lastPartitionKey = None
+        self.metrics = None
+
+    def isFor(self, key, hostBase):
+        return self.key == key and self.hostBase == hostBase
+
+    def fetch(self, table, startKey, endKey):
+        if (self.table == table and self.lastPartitionKey is not None and 
+                self.lastPartitionKey >= startKey):
+            waagent.Log(("Storage metrics up to {0} have been retrieved."
+                         "").format(self.lastPartitionKey))
+            return filter(lambda x : x.PartitionKey >= startKey and
+                                     x.PartitionKey < endKey,
+                          self.metrics)
         ofilter = ("PartitionKey ge '{0}' and PartitionKey lt '{1}'"
                    "").format(startKey, endKey)
         oselect = ("TotalRequests,TotalIngress,TotalEgress,AverageE2ELatency,"
-                   "AverageServerLatency,RowKey")
-        metrics = tableService.query_entities(table, ofilter, oselect)
+                   "AverageServerLatency,PartitionKey,RowKey")
+        metrics = []
+        nextPartitionKey = None
+        nextRowKey = None
+        while True:
+            result = self.tableService.query_entities(
+                    table, ofilter, oselect,
+                    next_partition_key = nextPartitionKey,
+                    next_row_key = nextRowKey)
+            metrics.extend(result)
+            nextPartitionKey = getContinuationKey(result, "NextPartitionKey")
+            nextRowKey = getContinuationKey(result, "NextRowKey")
+            if nextPartitionKey is None and nextRowKey is None:
+                break
+        #The rows of a minute appear at once, an empty minute is queried
+        #again next time.
+        if len(metrics) != 0:
+            self.table = table
+            self.lastPartitionKey = max(map(lambda x : x.PartitionKey, 
+                                            metrics))
+            self.metrics = metrics
+        return metrics
+
+StorageMetricsFetchers = {}
+
+def getStorageMetrics(account, key, hostBase, table, startKey, endKey):
+    try:
+        waagent.Log("Retrieve storage metrics data.")
+        fetcher = StorageMetricsFetchers.get(account)
+        if fetcher is None or not fetcher.isFor(key, hostBase):
+            fetcher = StorageMetricsFetcher(account, key, hostBase)
+            StorageMetricsFetchers[account] = fetcher
+        metrics = fetcher.fetch(table, startKey, endKey)
         waagent.Log("{0} records returned.".format(len(metrics)))
         return metrics
     except Exception as e:
@@ -1285,7 +1431,8 @@ class PerfCounter(object):
                  instance="",
                  unit="none",
                  timestamp = None,
-                 refreshInterval=0):
+                 refreshInterval=0,
+                 isError=False):
         self.counterType = counterType
         self.category = category
         self.name = name
@@ -1293,6 +1440,7 @@ class PerfCounter(object):
         self.value = value
         self.unit = unit
         self.refreshInterval = refreshInterval
+        self.isError = isError
         if(timestamp):
             self.timestamp = timestamp
         else:
@@ -1305,7 +1453,7 @@ class PerfCounter(object):
                             self.category,
                             self.name,
                             self.instance,
-                            0 if self.value is not None else 1,
+                            1 if self.isError or self.value is None else 0,
                             self.value if self.value is not None else "",
                             self.unit,
                             self.refreshInterval,
@@ -1314,21 +1462,106 @@ class PerfCounter(object):
 
     __repr__ = __str__
 
+#The sources run concurrently, a source which is not done by its timeout
+#reports the counters of its last good collection, flagged as error.
+VMDataSourceTimeout = 20
+StorageDataSourceTimeout = 40
+StaticDataSourceTimeout = 10
+
+class DataSourceCollector(object):
+    def __init__(self, dataSource, timeout):
+        self.dataSource = dataSource
+        self.timeout = timeout
+        self.name = dataSource.__class__.__name__
+        self.lock = threading.Lock()
+        self.thread = None
+        self.counters = None
+        self.excInfo = None
+        self.lastCounters = []
+
+    def start(self):
+        if self.thread is not None and self.thread.isAlive():
+            #The collection of the previous cycle is still running
+            waagent.Warn("{0} is still running.".format(self.name))
+            return
+        self.counters = None
+        self.excInfo = None
+        self.thread = threading.Thread(target=self.collect)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def collect(self):
+        try:
+            counters = self.dataSource.collect()
+            with self.lock:
+                self.counters = counters
+                self.lastCounters = counters
+        except Exception:
+            with self.lock:
+                self.excInfo = sys.exc_info()
+
+    def wait(self, startTime):
+        """
+        Returns the counters of this cycle, or the last good ones flagged as
+        error if the source did not finish within its timeout. An exception
+        raised by the source is raised again here.
+        """
+        self.thread.join(max(0, startTime + self.timeout - time.time()))
+        with self.lock:
+            if self.excInfo is not None:
+                excInfo = self.excInfo
+                self.excInfo = None
+                raise excInfo[0], excInfo[1], excInfo[2]
+            if self.counters is not None and not self.thread.isAlive():
+                return self.counters, False
+            lastCounters = self.lastCounters
+        waagent.Error(("{0} did not finish in {1} seconds, report {2} "
+                       "previous counters.").format(self.name,
+                                                    self.timeout,
+                                                    len(lastCounters)))
+        counters = []
+        for counter in lastCounters:
+            counter = copy.copy(counter)
+            counter.isError = True
+            counters.append(counter)
+        return counters, True
+
 class EnhancedMonitor(object):
     def __init__(self, config):
-        self.dataSources = []
-        self.dataSources.append(VMDataSource(config))
-        self.dataSources.append(StorageDataSource(config))
-        self.dataSources.append(StaticDataSource(config))
+        self.collectors = []
+        self.collectors.append(DataSourceCollector(VMDataSource(config),
+                                                   VMDataSourceTimeout))
+        self.collectors.append(DataSourceCollector(StorageDataSource(config),
+                                                   StorageDataSourceTimeout))
+        self.collectors.append(DataSourceCollector(StaticDataSource(config),
+                                                   StaticDataSourceTimeout))
         self.writer = PerfCounterWriter()
 
     def run(self):
+        startTime = time.time()
+        for collector in self.collectors:
+            collector.start()
         counters = []
-        for dataSource in self.dataSources:
-            counters.extend(dataSource.collect())
+        timedOut = False
+        for collector in self.collectors:
+            sourceCounters, sourceTimedOut = collector.wait(startTime)
+            counters.extend(sourceCounters)
+            timedOut = timedOut or sourceTimedOut
         clearLastErrorRecord()
+        if timedOut:
+            updateLatestErrorRecord(DATA_SOURCE_TIMEOUT)
+            AddExtensionEvent(message=DATA_SOURCE_TIMEOUT)
+        counters.append(self.createCounterCollectionDuration(time.time() -
+                                                             startTime))
         self.writer.write(counters)
 
+    def createCounterCollectionDuration(self, duration):
+        return PerfCounter(counterType = PerfCounterType.COUNTER_TYPE_DOUBLE,
+                           category = "config",
+                           name = "Collection Duration",
+                           value = round(duration, 3),
+                           unit = "sec")
+
 EventFile=os.path.join(LibDir, "PerfCounters")
 class PerfCounterWriter(object):
     def write(self, counters, maxRetry = 3, eventFile=EventFile):
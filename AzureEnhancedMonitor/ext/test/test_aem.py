@@ -23,6 +23,7 @@ import unittest
 import env
 import os
 import json
+import time
 import datetime
 from Utils.WAAgentUtil import waagent
 import aem
@@ -187,8 +188,8 @@ class TestAEM(unittest.TestCase):
         self.assertNotEquals(0, len(adapterIds))
         adapterId = adapterIds[0]
         self.assertNotEquals(None, aem.getMacAddress(adapterId))
-        self.assertNotEquals(None, netinfo.getNetworkReadBytes())
-        self.assertNotEquals(None, netinfo.getNetworkWriteBytes())
+        self.assertNotEquals(None, netinfo.getNetworkReadBytes(adapterId))
+        self.assertNotEquals(None, netinfo.getNetworkWriteBytes(adapterId))
         self.assertNotEquals(None, netinfo.getNetworkPacketRetransmitted())
 
     def test_hwchangeinfo(self):
@@ -211,7 +212,41 @@ class TestAEM(unittest.TestCase):
         hwChangeInfo = aem.HardwareChangeInfo(netinfo)
         self.assertNotEquals(None, hwChangeInfo.getLastHardwareChange())
 
-        
+    def test_network_counter_store(self):
+        testNetworkCounterFile = "/tmp/NetworkCounters"
+        aem.NetworkCounterFile = testNetworkCounterFile
+        if os.path.isfile(testNetworkCounterFile):
+            os.remove(testNetworkCounterFile)
+        store = aem.NetworkCounterStore()
+
+        #First cycle, average since boot
+        rates = store.update("boot1", 1000.0, 100.0, {"eth0" : (1000, 2000)})
+        self.assertEquals((10, 20), rates["eth0"])
+        self.assertTrue(os.path.isfile(testNetworkCounterFile))
+
+        rates = store.update("boot1", 1060.0, 160.0, {"eth0" : (7000, 2600)})
+        self.assertEquals((100, 10), rates["eth0"])
+
+        #32 bit counter wrapped
+        high = aem.CounterWrap32 - 600
+        store.update("boot1", 1120.0, 220.0, {"eth0" : (high, high)})
+        rates = store.update("boot1", 1180.0, 280.0, {"eth0" : (600, 0)})
+        self.assertEquals((20, 10), rates["eth0"])
+
+        #Counter reset, counts from zero again
+        rates = store.update("boot1", 1240.0, 340.0, {"eth0" : (300, 60)})
+        self.assertEquals((5, 1), rates["eth0"])
+
+        #New adapter
+        rates = store.update("boot1", 1300.0, 400.0, {"eth0" : (300, 60),
+                                                      "eth1" : (100, 100)})
+        self.assertEquals((0, 0), rates["eth0"])
+        self.assertEquals((0, 0), rates["eth1"])
+
+        #Reboot
+        rates = store.update("boot2", 1500.0, 50.0, {"eth0" : (500, 1000)})
+        self.assertEquals((10, 20), rates["eth0"])
+
     def test_linux_metric(self):
         config = self.test_config()
         metric = aem.LinuxMetric(config)
@@ -302,6 +337,32 @@ class TestAEM(unittest.TestCase):
         self.assertNotEquals(None, stat.getWriteOpServerLatency())
         self.assertNotEquals(None, stat.getWriteOpThroughput())
 
+    def test_storage_metrics_fetcher(self):
+        tableService = aem.TableService
+        aem.TableService = MockTableService
+        try:
+            fetcher = aem.StorageMetricsFetcher("account", "key", "hostbase")
+            metrics = fetcher.fetch("table", "20150126T0354", "20150126T0355")
+            self.assertEquals(3, len(metrics))
+            self.assertEquals(2, len(MockTableService.queries))
+            self.assertEquals(("20150126T0354", "user;GetBlob"), 
+                              MockTableService.queries[1][1:])
+            self.assertEquals("20150126T0354", fetcher.lastPartitionKey)
+
+            #The same minute is not queried again
+            metrics = fetcher.fetch("table", "20150126T0354", "20150126T0355")
+            self.assertEquals(3, len(metrics))
+            self.assertEquals(2, len(MockTableService.queries))
+
+            #Only the new minute is queried
+            metrics = fetcher.fetch("table", "20150126T0355", "20150126T0356")
+            self.assertEquals(3, len(MockTableService.queries))
+            self.assertTrue("ge '20150126T0355'" in 
+                            MockTableService.queries[2][0])
+            self.assertEquals(1, MockTableService.instances)
+        finally:
+            aem.TableService = tableService
+
     def test_disk_info(self):
         config = self.test_config()
         mapping = aem.DiskInfo(config).getDiskMapping()
@@ -345,6 +406,32 @@ class TestAEM(unittest.TestCase):
             self.assertNotEquals(None, counter)
             self.assertNotEquals(None, counter.value)
 
+    def test_datasource_collector(self):
+        dataSource = MockDataSource()
+        collector = aem.DataSourceCollector(dataSource, 0.5)
+        collector.start()
+        counters, timedOut = collector.wait(time.time())
+        self.assertFalse(timedOut)
+        self.assertEquals(1, len(counters))
+        self.assertTrue(str(counters[0]).split(";")[4] == "0")
+
+        #Timed out, the last good counters are flagged as error
+        dataSource.delay = 1
+        collector.start()
+        counters, timedOut = collector.wait(time.time())
+        self.assertTrue(timedOut)
+        self.assertEquals(1, len(counters))
+        self.assertEquals(1, counters[0].value)
+        self.assertTrue(str(counters[0]).split(";")[4] == "1")
+
+        #Still running, no new collection is started
+        collector.timeout = 2
+        collector.start()
+        counters, timedOut = collector.wait(time.time())
+        self.assertFalse(timedOut)
+        self.assertEquals(2, counters[0].value)
+        self.assertEquals(2, dataSource.calls)
+
     def test_writer(self):
         testEventFile = "/tmp/Event"
         if os.path.isfile(testEventFile):
@@ -396,6 +483,51 @@ class TestAEM(unittest.TestCase):
         storageTimestamp = aem.getStorageTimestamp(unixTimestamp)
         self.assertEquals("20150126T0354", storageTimestamp)
 
+class MockDataSource(object):
+    def __init__(self):
+        self.delay = 0
+        self.calls = 0
+
+    def collect(self):
+        self.calls = self.calls + 1
+        time.sleep(self.delay)
+        return [aem.PerfCounter(counterType = aem.PerfCounterType.COUNTER_TYPE_INT,
+                                category = "test",
+                                name = "Calls",
+                                value = self.calls)]
+
+class MockTableService(object):
+    instances = 0
+    queries = []
+
+    def __init__(self, account_name, account_key, host_base):
+        MockTableService.instances = MockTableService.instances + 1
+        MockTableService.queries = []
+
+    def query_entities(self, table, filter, select, 
+                       next_partition_key=None, next_row_key=None):
+        MockTableService.queries.append((filter, next_partition_key, 
+                                         next_row_key))
+        class Metric(object):
+            def __init__(self, partitionKey, rowKey):
+                self.PartitionKey = partitionKey
+                self.RowKey = rowKey
+        class Result(list):
+            pass
+        partitionKey = filter.split("'")[1]
+        result = Result()
+        if next_row_key is None:
+            result.append(Metric(partitionKey, "system;All"))
+            result.append(Metric(partitionKey, "user;All"))
+            if partitionKey == "20150126T0354":
+                result.x_ms_continuation = {
+                    "nextpartitionkey" : partitionKey,
+                    "nextrowkey" : "user;GetBlob"
+                }
+        else:
+            result.append(Metric(next_partition_key, next_row_key))
+        return result
+
 def mock_getStorageMetrics(*args, **kwargs):
         with open(os.path.join(env.test_dir, "storage_metrics")) as F:
             test_data = F.read()
@@ -20,17 +20,88 @@
 #
 import time
 import datetime
+import errno
 import traceback
 import urlparse
 import httplib
+import select
 import shlex
+import socket
+import ssl
 import subprocess
+import threading
 from common import CommonVariables
 from subprocess import *
 from Utils.WAAgentUtil import waagent
 
+class HttpConnectionPool(object):
+    """
+    keeps the https connections to the storage hosts alive between the calls,
+    so the snapshots and the blob writes do not pay the tcp and tls handshake every time.
+    the connections are keyed by the proxy and the target host, a connection is
+    only used by one caller at a time.
+    """
+    def __init__(self, max_idle_per_host = CommonVariables.snapshot_max_workers, idle_timeout = CommonVariables.http_idle_timeout):
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.idle_connections = {}
+
+    def get_connection(self, key, create_connection, timeout):
+        """
+        returns (connection, reused), a healthy idle connection is preferred over a new one.
+        """
+        connection = None
+        with self.lock:
+            idle_list = self.idle_connections.get(key, [])
+            while len(idle_list) > 0:
+                idle_connection, last_used = idle_list.pop()
+                if(self.is_healthy(idle_connection, last_used)):
+                    connection = idle_connection
+                    break
+                else:
+                    idle_connection.close()
+        reused = connection is not None
+        if(not reused):
+            connection = create_connection()
+        connection.timeout = timeout
+        if(connection.sock is not None):
+            connection.sock.settimeout(timeout)
+        return connection, reused
+
+    def put_connection(self, key, connection):
+        with self.lock:
+            idle_list = self.idle_connections.setdefault(key, [])
+            if(connection.sock is not None and len(idle_list) < self.max_idle_per_host):
+                idle_list.append((connection, time.time()))
+                connection = None
+        if(connection is not None):
+            connection.close()
+
+    def is_healthy(self, connection, last_used):
+        if(connection.sock is None):
+            return False
+        if(time.time() - last_used > self.idle_timeout):
+            return False
+        try:
+            # an idle keep-alive connection should have nothing to read,
+            # readable means the server closed it or sent something unexpected.
+            readable, writable, errored = select.select([connection.sock], [], [connection.sock], 0)
+            return len(readable) == 0 and len(errored) == 0
+        except Exception:
+            return False
+
+    def close_all(self):
+        with self.lock:
+            for key in self.idle_connections.keys():
+                for connection, last_used in self.idle_connections[key]:
+                    connection.close()
+            self.idle_connections = {}
+
 class HttpUtil(object):
     """description of class"""
+    connection_pool = HttpConnectionPool()
+
     def __init__(self, hutil):
         try:
             waagent.MyDistro = waagent.GetMyDistro()
@@ -50,13 +121,13 @@ class HttpUtil(object):
     def CallUsingCurl(self,method,sasuri_obj,data,headers):
         header_str = ""
         for key, value in headers.iteritems():
-            header_str = header_str + '-H ' + '"' + str(key) + ':' + str(value) + '"'
+            header_str = header_str + '-H ' + '"' + str(key) + ':' + str(value) + '" '
 
         if(self.proxyHost == None or self.proxyPort == None):
-            commandToExecute = 'curl --request PUT --data-binary @-' + ' ' + header_str + ' "' + sasuri_obj.scheme + '://' + sasuri_obj.hostname + sasuri_obj.path + '?' + sasuri_obj.query + '"' + ' -v'
+            commandToExecute = 'curl --fail --request PUT --data-binary @-' + ' ' + header_str + ' "' + sasuri_obj.scheme + '://' + sasuri_obj.netloc + sasuri_obj.path + '?' + sasuri_obj.query + '"' + ' -v'
         else:
-            commandToExecute = 'curl --request PUT --data-binary @-' + ' ' + header_str + ' "' + sasuri_obj.scheme + '://' + sasuri_obj.hostname + sasuri_obj.path + '?' + sasuri_obj.query + '"'\
-                + '--proxy ' + self.proxyHost + ':' + self.proxyPort + ' -v'
+            commandToExecute = 'curl --fail --request PUT --data-binary @-' + ' ' + header_str + ' "' + sasuri_obj.scheme + '://' + sasuri_obj.netloc + sasuri_obj.path + '?' + sasuri_obj.query + '"'\
+                + ' --proxy ' + self.proxyHost + ':' + self.proxyPort + ' -v'
         args = shlex.split(commandToExecute)
         proc = Popen(args,stdin=subprocess.PIPE,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
         proc.stdin.write(data)
@@ -64,42 +135,119 @@ class HttpUtil(object):
         returnCode = proc.wait()
         self.logger.log("curl error is: " + str(err))
         self.logger.log("curl return code is : " + str(returnCode))
-        # what if the curl is returned successfully, but the http response is
-        # 403
+        # --fail makes curl return an error for an http error status too, a
+        # block taken as written would not be sent again.
         if(returnCode == 0):
             return CommonVariables.success
         else:
             return CommonVariables.error_http_failure
 
-    def Call(self, method, sasuri_obj, data, headers, fallback_to_curl = False):
+    def create_connection(self, sasuri_obj, timeout):
+        if(self.proxyHost == None or self.proxyPort == None):
+            connection = httplib.HTTPSConnection(sasuri_obj.hostname, sasuri_obj.port, timeout = timeout)
+        else:
+            connection = httplib.HTTPSConnection(self.proxyHost, self.proxyPort, timeout = timeout)
+            connection.set_tunnel(sasuri_obj.hostname, 443)
+        return connection
+
+    def connection_key(self, sasuri_obj):
+        return (self.proxyHost, self.proxyPort, sasuri_obj.hostname, sasuri_obj.port)
+
+    def warmup(self, sasuri_obj, timeout = CommonVariables.http_timeout):
+        """
+        resolve the host and finish the tcp and tls handshake now, the connection
+        is kept in the pool for the calls made later.
+        """
+        connection = self.create_connection(sasuri_obj, timeout)
         try:
-            if(self.proxyHost == None or self.proxyPort == None):
-                connection = httplib.HTTPSConnection(sasuri_obj.hostname, timeout = 10)
-                connection.request(method=method, url=(sasuri_obj.path + '?' + sasuri_obj.query), body=data, headers = headers)
+            connection.connect()
+        except Exception as e:
+            self.logger.log("Failed to warm up the connection to " + str(sasuri_obj.hostname) + " with error: " + str(e))
+            connection.close()
+            return CommonVariables.error_http_failure
+        HttpUtil.connection_pool.put_connection(self.connection_key(sasuri_obj), connection)
+        return CommonVariables.success
+
+    @staticmethod
+    def is_stale_connection_error(e):
+        """
+        whether getresponse failed because the server had closed the kept
+        alive connection before our request got to it, no status line or a
+        reset instead of it.
+        """
+        if(isinstance(e, httplib.BadStatusLine)):
+            line = str(e.line).strip("'\"")
+            return line == "" or line.startswith("No status line received")
+        if(isinstance(e, ssl.SSLError)):
+            # the tls connection was closed without a close_notify.
+            return e.errno == ssl.SSL_ERROR_EOF or 'eof' in str(e).lower()
+        if(isinstance(e, socket.error) and not isinstance(e, socket.timeout)):
+            return e.errno in [errno.ECONNRESET, errno.EPIPE]
+        return False
+
+    def request(self, method, sasuri_obj, data, headers, timeout):
+        """
+        send the request on a pooled connection. a reused connection may have
+        been closed by the server, the request is sent once more on a new
+        connection when it failed before the server could have got it: while
+        it was written, or when the server closed without any response. a
+        failure later on, say while reading the response, is not retried, the
+        request may have been done, a snapshot would be taken twice.
+        """
+        if(self.proxyHost == None or self.proxyPort == None):
+            path = sasuri_obj.path + '?' + sasuri_obj.query
+        else:
+            # If proxy is used, full url is needed.
+            path = "https://{0}:{1}{2}".format(sasuri_obj.hostname, 443, (sasuri_obj.path + '?' + sasuri_obj.query))
+        key = self.connection_key(sasuri_obj)
+        for attempt in range(0, 2):
+            connection, reused = HttpUtil.connection_pool.get_connection(key, lambda: self.create_connection(sasuri_obj, timeout), timeout)
+            sent = False
+            try:
+                connection.request(method=method, url=path, body=data, headers=headers)
+                sent = True
                 resp = connection.getresponse()
+            except (httplib.HTTPException, socket.error) as e:
+                connection.close()
+                retriable = not isinstance(e, socket.timeout) and (not sent or HttpUtil.is_stale_connection_error(e))
+                if(reused and attempt == 0 and retriable):
+                    self.logger.log("the kept alive connection failed with: " + str(e) + ", retrying with a new connection")
+                    continue
+                raise
+            try:
+                responseBody = resp.read()
+            except (httplib.HTTPException, socket.error) as e:
+                connection.close()
+                raise
+            if(resp.will_close):
+                connection.close()
             else:
-                connection = httplib.HTTPSConnection(self.proxyHost, self.proxyPort, timeout = 10)
-                connection.set_tunnel(sasuri_obj.hostname, 443)
-                # If proxy is used, full url is needed.
-                path = "https://{0}:{1}{2}".format(sasuri_obj.hostname, 443, (sasuri_obj.path + '?' + sasuri_obj.query))
-                connection.request(method=method, url=(path), body=data, headers=headers)
-                resp = connection.getresponse()
+                HttpUtil.connection_pool.put_connection(key, connection)
+            return resp, responseBody
 
+    def Call(self, method, sasuri_obj, data, headers, fallback_to_curl = False, timeout = CommonVariables.http_timeout):
+        result, http_status = self.CallWithStatus(method, sasuri_obj, data, headers, fallback_to_curl, timeout)
+        return result
+
+    def CallWithStatus(self, method, sasuri_obj, data, headers, fallback_to_curl = False, timeout = CommonVariables.http_timeout):
+        """
+        returns the result code and the http status, the status is None if no response was received.
+        """
+        try:
+            resp, responseBody = self.request(method, sasuri_obj, data, headers, timeout)
             if(resp != None):
                 self.logger.log(str(resp.getheaders()))
-            responseBody = resp.read()
-            connection.close()
             if(resp.status == 200 or resp.status == 201):
-                return CommonVariables.success
+                return CommonVariables.success, resp.status
             else:
                 self.logger.log("resp status: " + str(resp.status))
                 if(responseBody is not None):
                     self.logger.log("responseBody: " + (responseBody).decode('utf-8-sig'))
-                return CommonVariables.error_http_failure
+                return CommonVariables.error_http_failure, resp.status
         except Exception as e:
             errorMsg = "Failed to call http with error: %s, stack trace: %s" % (str(e), traceback.format_exc())
             self.logger.log(errorMsg)
             if(fallback_to_curl):
-                return self.CallUsingCurl(method,sasuri_obj,data,headers)
+                return self.CallUsingCurl(method,sasuri_obj,data,headers), None
             else:
-                return CommonVariables.error_http_failure
\ No newline at end of file
+                return CommonVariables.error_http_failure, None
@@ -18,21 +18,33 @@
 #
 # Requires Python 2.7+
 #
+import collections
 import datetime
+import gzip
 import httplib
 import os
 import string
+import threading
 import time
 import traceback
 import urlparse
+from StringIO import StringIO
 from blobwriter import BlobWriter
+from common import CommonVariables
 from Utils.WAAgentUtil import waagent
 
 class Backuplogger(object):
-    def __init__(self, hutil):
-        self.msg = ''
+    def __init__(self, hutil, max_bytes = CommonVariables.log_max_bytes):
+        # the log lines are kept in a ring buffer, the oldest ones are dropped
+        # once there are more than max_bytes of them.
+        self.lines = collections.deque()
+        self.size = 0
+        self.max_bytes = max_bytes
+        self.dropped_lines = 0
         self.con_path = '/dev/console'
         self.hutil = hutil
+        # the snapshots are taken from several threads.
+        self.lock = threading.Lock()
 
     """description of class"""
     def log(self, msg, local=False, level='Info'):
@@ -41,7 +53,19 @@ class Backuplogger(object):
         if(local):
             self.hutil.log(log_msg)
         else:
-            self.msg += log_msg
+            with self.lock:
+                self.lines.append(log_msg)
+                self.size += len(log_msg)
+                while(self.size > self.max_bytes and len(self.lines) > 1):
+                    self.size -= len(self.lines.popleft())
+                    self.dropped_lines += 1
+
+    def get_msg(self):
+        with self.lock:
+            msg = ''.join(self.lines)
+            if(self.dropped_lines > 0):
+                msg = str(self.dropped_lines) + " older log lines were dropped\n" + msg
+        return msg
 
     def log_to_con(self, msg):
         try:
@@ -51,9 +75,17 @@ class Backuplogger(object):
         except IOError as e:
             pass
 
+    def compress(self, msg):
+        compressed = StringIO()
+        gzip_file = gzip.GzipFile(fileobj = compressed, mode = 'wb')
+        gzip_file.write(msg)
+        gzip_file.close()
+        return compressed.getvalue()
+
     def commit(self, logbloburi):
         #commit to local file system first, then commit to the network.
-        self.hutil.log(self.msg)
+        msg = self.get_msg()
+        self.hutil.log(msg)
         blobWriter = BlobWriter(self.hutil)
         # append the wala log at the end.
         try:
@@ -64,8 +96,8 @@ class Backuplogger(object):
                     distro_str = self.hutil.patching.distro_info[0] + " " + self.hutil.patching.distro_info[1]
                 else:
                     distro_str = self.hutil.patching.distro_info[0]
-                self.msg = "Distro Info:" + distro_str + "\n" + self.msg
-            self.msg = "Guest Agent Version is :" + waagent.GuestAgentVersion + "\n" + self.msg
+                msg = "Distro Info:" + distro_str + "\n" + msg
+            msg = "Guest Agent Version is :" + waagent.GuestAgentVersion + "\n" + msg
             with open("/var/log/waagent.log", 'rb') as file:
                 file.seek(0, os.SEEK_END)
                 length = file.tell()
@@ -74,11 +106,16 @@ class Backuplogger(object):
                     seek_len_abs = length
                 file.seek(0 - seek_len_abs, os.SEEK_END)
                 tail_wala_log = file.read()
-                self.msg = self.msg + "Tail of WALA Log:" + tail_wala_log
+                msg = msg + "Tail of WALA Log:" + tail_wala_log
         except Exception as e:
             errMsg = 'Failed to get the waagent log with error: %s, stack trace: %s' % (str(e), traceback.format_exc())
             self.hutil.log(errMsg)
-        blobWriter.WriteBlob(self.msg, logbloburi)
+        if(isinstance(msg, unicode)):
+            msg = msg.encode('utf-8')
+        blobWriter.WriteBlockBlob(self.compress(msg), logbloburi, content_encoding = 'gzip')
+
+    def log_timings(self, timing_recorder):
+        self.log("timing summary:\n" + timing_recorder.summary())
 
     def commit_to_local(self):
-        self.hutil.log(self.msg)
\ No newline at end of file
+        self.hutil.log(self.get_msg())
@@ -19,8 +19,10 @@
 # Requires Python 2.7+
 #
 import time
+import base64
 import datetime
 import traceback
+import urllib
 import urlparse
 import httplib
 from common import CommonVariables
@@ -56,4 +58,75 @@ class BlobWriter(object):
             except Exception as e:
                 self.hutil.log("Failed to committing the log with error: %s, stack trace: %s" % (str(e), traceback.format_exc()))
             self.hutil.log("retry times is " + str(retry_times))
-            retry_times = retry_times - 1
\ No newline at end of file
+            retry_times = retry_times - 1
+
+    def PutOnce(self, http_util, uri, data, headers):
+        """
+        one put attempt, an exception, say curl missing for the fallback,
+        is logged and counted as a failed attempt like WriteBlob does.
+        """
+        try:
+            return http_util.Call(method = 'PUT', sasuri_obj = urlparse.urlparse(uri), data = data, headers = headers, fallback_to_curl = True)
+        except Exception as e:
+            self.hutil.log("Failed to put the blob with error: %s, stack trace: %s" % (str(e), traceback.format_exc()))
+            return CommonVariables.error_http_failure
+
+    def WriteBlockBlob(self, data, blobUri, content_encoding = None, block_size = CommonVariables.log_block_size):
+        """
+        data up to block_size is written with one put blob, larger data is put
+        block by block then committed with a put block list. on a retry only
+        the blocks not uploaded yet are sent again.
+        """
+        if(blobUri is None):
+            self.hutil.log("logbloburi is None")
+            return CommonVariables.error
+        try:
+            http_util = HttpUtil(self.hutil)
+        except Exception as e:
+            self.hutil.log("Failed to create the http util with error: %s, stack trace: %s" % (str(e), traceback.format_exc()))
+            return CommonVariables.error_http_failure
+        if(len(data) <= block_size):
+            headers = {}
+            headers["x-ms-blob-type"] = 'BlockBlob'
+            if(content_encoding is not None):
+                headers["Content-Encoding"] = content_encoding
+            for retry in range(0, CommonVariables.blob_retry_times):
+                result = self.PutOnce(http_util, blobUri, data, headers)
+                if(result == CommonVariables.success):
+                    self.hutil.log("blob written succesfully to:"+str(blobUri))
+                    return result
+                self.hutil.log("blob failed to write, retry " + str(retry))
+            return CommonVariables.error_http_failure
+
+        block_ids = []
+        for i in range(0, (len(data) + block_size - 1) / block_size):
+            # all the block ids of a blob must have the same length.
+            block_ids.append(base64.b64encode('block-%08d' % i))
+        uploaded_blocks = set()
+        for retry in range(0, CommonVariables.blob_retry_times):
+            for i in range(0, len(block_ids)):
+                if(i in uploaded_blocks):
+                    continue
+                block_uri = blobUri + '&comp=block&blockid=' + urllib.quote(block_ids[i], safe = '')
+                result = self.PutOnce(http_util, block_uri, data[i * block_size:(i + 1) * block_size], {})
+                if(result == CommonVariables.success):
+                    uploaded_blocks.add(i)
+                else:
+                    self.hutil.log("block " + str(i) + " failed to write")
+                    break
+            if(len(uploaded_blocks) < len(block_ids)):
+                self.hutil.log(str(len(uploaded_blocks)) + " of " + str(len(block_ids)) + " blocks written, retry " + str(retry))
+                continue
+            block_list = '<?xml version="1.0" encoding="utf-8"?><BlockList>'
+            for block_id in block_ids:
+                block_list += '<Latest>' + block_id + '</Latest>'
+            block_list += '</BlockList>'
+            headers = {}
+            if(content_encoding is not None):
+                headers["x-ms-blob-content-encoding"] = content_encoding
+            result = self.PutOnce(http_util, blobUri + '&comp=blocklist', block_list, headers)
+            if(result == CommonVariables.success):
+                self.hutil.log("blob written succesfully in " + str(len(block_ids)) + " blocks to:" + str(blobUri))
+                return result
+            self.hutil.log("block list failed to write, retry " + str(retry))
+        return CommonVariables.error_http_failure
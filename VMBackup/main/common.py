@@ -37,6 +37,29 @@ class CommonVariables:
     iaas_install_command = 'install'
     locale = 'locale'
 
+    """
+    snapshot settings
+    """
+    http_timeout = 10
+    http_idle_timeout = 60
+    snapshot_max_workers = 8
+    snapshot_timeout = 30
+    snapshot_max_per_account = 4
+    snapshot_retry_max_attempts = 5
+    snapshot_retry_base_backoff = 0.5
+    snapshot_retry_max_backoff = 8.0
+    # a 500 can come back after the snapshot was taken, retrying it could leave a second snapshot.
+    snapshot_retry_http_status = [503]
+
+    """
+    log upload settings
+    """
+    log_max_bytes = 1024 * 1024
+    log_block_size = 256 * 1024
+    blob_retry_times = 3
+    freeze_timeout = 300
+    freeze_max_workers = 8
+
     """
     error code definitions
     """
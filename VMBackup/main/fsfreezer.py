@@ -18,8 +18,21 @@
 #
 # Requires Python 2.7+
 #
+import errno
+import fcntl
+import os
 import subprocess
+import time
 from mounts import Mounts
+from common import CommonVariables
+from workerpool import WorkerPool
+from timingrecorder import TimingRecorder
+
+"""
+_IOWR('X', 119, int) and _IOWR('X', 120, int) from linux/fs.h
+"""
+FIFREEZE = 0xC0045877
+FITHAW = 0xC0045878
 
 class FreezeError(object):
     def __init__(self):
@@ -39,7 +52,7 @@ class FreezeResult(object):
         return error_str
 
 class FsFreezer:
-    def __init__(self, patching, logger):
+    def __init__(self, patching, logger, timing_recorder = None):
         """
         """
         self.patching = patching
@@ -47,10 +60,64 @@ class FsFreezer:
         self.mounts = Mounts(patching = self.patching, logger = self.logger)
         self.frozen_items = set()
         self.unfrozen_items = set()
+        # the file descriptors of the frozen mount points, the thaw is issued on them.
+        self.mount_fds = {}
+        if(timing_recorder is None):
+            timing_recorder = TimingRecorder()
+        self.timing_recorder = timing_recorder
+
+    def ioctl_unsupported(self, e):
+        return e.errno in (errno.ENOTTY, errno.EOPNOTSUPP, errno.ENOSYS)
+
+    def freeze_path(self, path):
+        """
+        issue the FIFREEZE on the mount point, fall back to fsfreeze if the
+        kernel or the file system does not support it.
+        returns the return code and the method used.
+        """
+        fd = None
+        try:
+            fd = os.open(path, os.O_RDONLY)
+            fcntl.ioctl(fd, FIFREEZE, 0)
+            self.mount_fds[path] = fd
+            return 0, 'ioctl'
+        except (IOError, OSError) as e:
+            if(fd is not None):
+                os.close(fd)
+            if(not self.ioctl_unsupported(e)):
+                self.logger.log('FIFREEZE failed on ' + str(path) + ' with error: ' + str(e))
+                return e.errno, 'ioctl'
+            self.logger.log('FIFREEZE is not supported on ' + str(path) + ', falling back to fsfreeze')
+        return subprocess.call(['fsfreeze', '-f', path]), 'fsfreeze'
+
+    def unfreeze_path(self, path):
+        """
+        issue the FITHAW on the fd kept from the freeze, so no path lookup is
+        done on a frozen file system, fall back to fsfreeze -u if not supported.
+        """
+        fd = self.mount_fds.pop(path, None)
+        try:
+            if(fd is None):
+                fd = os.open(path, os.O_RDONLY)
+            fcntl.ioctl(fd, FITHAW, 0)
+            return 0, 'ioctl'
+        except (IOError, OSError) as e:
+            if(not self.ioctl_unsupported(e)):
+                self.logger.log('FITHAW failed on ' + str(path) + ' with error: ' + str(e))
+                return e.errno, 'ioctl'
+            self.logger.log('FITHAW is not supported on ' + str(path) + ', falling back to fsfreeze')
+        finally:
+            if(fd is not None):
+                os.close(fd)
+        return subprocess.call(['fsfreeze', '-u', path]), 'fsfreeze'
+
+    def record_timing(self, operation, mount, method, return_code, elapsed):
+        self.timing_recorder.record(operation, mount.mount_point, elapsed, fstype = mount.fstype, method = method, errorcode = return_code)
+        self.logger.log(operation + ' of ' + str(mount.mount_point) + ' with ' + method + ' took ' + str(elapsed) + ' seconds')
 
     def freeze(self, mount):
         """
-        for xfs we should use the xfs_freeze, or we just use fsfreeze
+        FIFREEZE works for ext3, ext4, xfs and btrfs, fsfreeze is the fallback.
         """
         freeze_error = FreezeError()
         path = mount.mount_point
@@ -65,7 +132,9 @@ class FsFreezer:
                 self.logger.log('skip for the unknown file systems')
             else:
                 self.frozen_items.add(path)
-                freeze_return_code = subprocess.call(['fsfreeze', '-f', path])
+                start_time = time.time()
+                freeze_return_code, method = self.freeze_path(path)
+                self.record_timing('freeze', mount, method, freeze_return_code, time.time() - start_time)
             self.logger.log('freeze_result...' + str(freeze_return_code))
         freeze_error.errorcode = freeze_return_code
 
@@ -75,7 +144,7 @@ class FsFreezer:
 
     def unfreeze(self, mount):
         """
-        for xfs we should use the xfs_freeze -u, or we just use fsfreeze -u
+        FITHAW for the mounts frozen by us, fsfreeze -u is the fallback.
         """
         freeze_error = FreezeError()
         path = mount.mount_point
@@ -85,9 +154,10 @@ class FsFreezer:
             self.logger.log('skip for the type ')
         else:
             if(not path in self.unfrozen_items):
-                freeze_return_code = 0
                 self.unfrozen_items.add(path)
-                unfreeze_return_code = subprocess.call(['fsfreeze', '-u', path])
+                start_time = time.time()
+                unfreeze_return_code, method = self.unfreeze_path(path)
+                self.record_timing('unfreeze', mount, method, unfreeze_return_code, time.time() - start_time)
             else:
                 self.logger.log('the item is already unfreezed, so skip it')
         self.logger.log('unfreeze_result...' + str(unfreeze_return_code))
@@ -102,50 +172,54 @@ class FsFreezer:
         else:
             return True
 
+    def call_safely(self, func, mount):
+        try:
+            return func(mount)
+        except Exception, e:
+            freezeError = FreezeError()
+            freezeError.errorcode = -1
+            freezeError.path = mount.mount_point
+            self.logger.log(str(e))
+            return freezeError
+
     def freezeall(self):
+        """
+        the non root mounts are frozen at the same time, the root is frozen last.
+        """
         self.root_seen = False
         freeze_result = FreezeResult()
+        non_root_mounts = []
         for mount in self.mounts.mounts:
             if(mount.mount_point == '/'):
                 self.root_seen = True
                 self.root_mount = mount
             elif(mount.mount_point):
-                try:
-                    freezeError = self.freeze(mount)
-                    if(freezeError.errorcode != 0):
-                        freeze_result.errors.append(freezeError)
-                except Exception, e:
-                    freezeError = FreezeError()
-                    freezeError.errorcode = -1
-                    freezeError.path = mount.mount_point
-                    freeze_result.errors.append(freezeError)
-                    self.logger.log(str(e))
+                non_root_mounts.append(mount)
+
+        worker_pool = WorkerPool(self.logger, CommonVariables.freeze_max_workers)
+        freeze_errors = worker_pool.map(lambda mount: self.call_safely(self.freeze, mount), non_root_mounts)
+        for freezeError in freeze_errors:
+            if(freezeError.errorcode != 0):
+                freeze_result.errors.append(freezeError)
 
         if(self.root_seen):
-            freezeError = self.freeze(self.root_mount)
+            freezeError = self.call_safely(self.freeze, self.root_mount)
             if(freezeError.errorcode != 0):
                 freeze_result.errors.append(freezeError)
         return freeze_result
 
     def unfreezeall(self):
-        self.root_seen = False
+        """
+        all the mounts are thawed at the same time.
+        """
         unfreeze_result = FreezeResult()
+        mounts = []
         for mount in self.mounts.mounts:
-            if(mount.mount_point == '/'):
-                self.root_seen = True
-                self.root_mount = mount
-            elif(mount.mount_point):
-                try:
-                    freezeError = self.unfreeze(mount)
-                    if(freezeError.errorcode != 0):
-                        unfreeze_result.errors.append(freezeError)
-                except Exception,e:
-                    freezeError = FreezeError()
-                    freezeError.errorcode = -1
-                    freezeError.path = mount.mount_point
-                    unfreeze_result.errors.append(freezeError)
-        if(self.root_seen):
-            freezeError = self.unfreeze(self.root_mount)
+            if(mount.mount_point):
+                mounts.append(mount)
+        worker_pool = WorkerPool(self.logger, CommonVariables.freeze_max_workers)
+        unfreeze_errors = worker_pool.map(lambda mount: self.call_safely(self.unfreeze, mount), mounts)
+        for freezeError in unfreeze_errors:
             if(freezeError.errorcode != 0):
                 unfreeze_result.errors.append(freezeError)
         return unfreeze_result
\ No newline at end of file
@@ -36,6 +36,7 @@ import httplib
 import xml.parsers.expat
 import datetime
 from threading import Thread
+from threading import Event
 from time import sleep
 from os.path import join
 from mounts import Mounts
@@ -49,14 +50,19 @@ from urlparse import urlparse
 from snapshotter import Snapshotter
 from backuplogger import Backuplogger
 from blobwriter import BlobWriter
+from HttpUtil import HttpUtil
 from taskidentity import TaskIdentity
 from MachineIdentity import MachineIdentity
+from timingrecorder import TimingRecorder
 
 #Main function is the only entrence to this extension handler
 
 def main():
-    global MyPatching,backup_logger,hutil,run_result,run_status,error_msg,freezer,freeze_result,unfreeze_result,snapshot_result,snapshot_done
-    snapshot_done = False
+    global MyPatching,backup_logger,hutil,run_result,run_status,error_msg,freezer,freeze_result,unfreeze_result,snapshot_result,snapshot_done,freeze_start_time,freeze_hold_time,timing_recorder
+    snapshot_done = Event()
+    timing_recorder = TimingRecorder()
+    freeze_start_time = None
+    freeze_hold_time = None
     run_result = CommonVariables.success
     run_status = 'success'
     error_msg = ''
@@ -95,7 +101,7 @@ def timedelta_total_seconds(delta):
     else:
         return delta.total_seconds()
 
-def do_backup_status_report(operation, status, status_code, message, taskId, commandStartTimeUTCTicks, blobUri):
+def do_backup_status_report(operation, status, status_code, message, taskId, commandStartTimeUTCTicks, blobUri, sub_status = None):
     global backup_logger,hutil
     backup_logger.log(msg="{0},{1},{2},{3}".format(operation, status, status_code, message),local=True)
     time_delta = datetime.datetime.utcnow() - datetime.datetime(1970, 1, 1)
@@ -118,12 +124,25 @@ def do_backup_status_report(operation, status, status_code, message, taskId, com
             }
         }
     }]
+    if(sub_status is not None and len(sub_status) > 0):
+        stat[0]["status"]["substatus"] = sub_status
     status_report_msg = json.dumps(stat)
     status_report_msg = status_report_msg.replace(date_place_holder,date_string)
     blobWriter = BlobWriter(hutil)
     blobWriter.WriteBlob(status_report_msg,blobUri)
     return status_report_msg
 
+def get_sub_status(name, message):
+    return {
+        "name" : name,
+        "status" : "success",
+        "code" : str(CommonVariables.success),
+        "formattedMessage" : {
+            "lang" : "en-US",
+            "message" : message
+        }
+    }
+
 def exit_with_commit_log(error_msg, para_parser):
     global backup_logger
     backup_logger.log(error_msg, True, 'Error')
@@ -136,8 +155,10 @@ def convert_time(utcTicks):
 
 def snapshot():
     try:
-        global backup_logger,run_result,run_status,error_msg,freezer,freeze_result,snapshot_result,snapshot_done,para_parser
+        global backup_logger,run_result,run_status,error_msg,freezer,freeze_result,snapshot_result,snapshot_done,para_parser,freeze_start_time,timing_recorder
+        freeze_start_time = time.time()
         freeze_result = freezer.freezeall()
+        timing_recorder.record('phase', 'freezeall', time.time() - freeze_start_time)
         backup_logger.log('T:S freeze result ' + str(freeze_result))
 
         # check whether we freeze succeed first?
@@ -148,8 +169,10 @@ def snapshot():
             backup_logger.log(error_msg, False, 'Warning')
         else:
             backup_logger.log('T:S doing snapshot now...')
-            snap_shotter = Snapshotter(backup_logger)
+            snap_shotter = Snapshotter(backup_logger, timing_recorder = timing_recorder, deadline = freeze_start_time + CommonVariables.freeze_timeout)
+            snapshot_start_time = time.time()
             snapshot_result = snap_shotter.snapshotall(para_parser)
+            timing_recorder.record('phase', 'snapshotall', time.time() - snapshot_start_time)
             backup_logger.log('T:S snapshotall ends...')
             if(snapshot_result is not None and len(snapshot_result.errors) > 0):
                 error_msg = 'T:S snapshot result: ' + str(snapshot_result)
@@ -164,19 +187,24 @@ def snapshot():
     except Exception as e:
         errMsg = 'Failed to do the snapshot with error: %s, stack trace: %s' % (str(e), traceback.format_exc())
         backup_logger.log(errMsg, False, 'Error')
-    snapshot_done = True
+    finally:
+        # wake up the freeze watcher, so the unfreeze happens right away.
+        snapshot_done.set()
 
 
 def freeze_watcher():
-    global backup_logger,run_status,error_msg,snapshot_done
-    #wait 5 minutes before the snapshoting.
+    global backup_logger,run_result,run_status,error_msg,snapshot_done
+    #wait until the snapshot is done, or at most freeze_timeout seconds.
     try:
-        for i in range(0, 50):
-            if(snapshot_done):
-                backup_logger.log('T:W snapshot is done', False)
-                break;
-            sleep(6)
-        if not snapshot_done:
+        deadline = time.time() + CommonVariables.freeze_timeout
+        while not snapshot_done.is_set():
+            remaining = deadline - time.time()
+            if(remaining <= 0):
+                break
+            snapshot_done.wait(remaining)
+        if(snapshot_done.is_set()):
+            backup_logger.log('T:W snapshot is done', False)
+        else:
             run_result = CommonVariables.error
             run_status = 'error'
             error_msg = 'T:W Snapshot timeout'
@@ -184,11 +212,13 @@ def freeze_watcher():
     except Exception as e:
         errMsg = 'Failed to do  the snapshot because of exception in freeze watcher'
         backup_logger.log(errMsg, False, 'Error')
+
 def daemon():
-    global MyPatching,backup_logger,hutil,run_result,run_status,error_msg,freezer,para_parser
+    global MyPatching,backup_logger,hutil,run_result,run_status,error_msg,freezer,para_parser,freeze_start_time,freeze_hold_time,timing_recorder
     #this is using the most recent file timestamp.
     hutil.do_parse_context('Executing')
-    freezer = FsFreezer(patching= MyPatching, logger = backup_logger)
+    Mounts.invalidate_cache()
+    freezer = FsFreezer(patching= MyPatching, logger = backup_logger, timing_recorder = timing_recorder)
     global_error_result = None
     # precheck
     freeze_called = False
@@ -256,6 +286,14 @@ def daemon():
             else:
                 backup_logger.log('commandToExecute is ' + commandToExecute, True)
                 """
+                resolve and connect to the storage hosts before the freeze.
+                """
+                warmup_start_time = time.time()
+                Snapshotter(backup_logger).warmup(para_parser)
+                warmup_time = time.time() - warmup_start_time
+                timing_recorder.record('phase', 'warmup', warmup_time)
+                backup_logger.log('warm up took ' + str(warmup_time) + ' seconds', True)
+                """
                 make sure the log is not doing when the file system is freezed.
                 """
                 freeze_watcher_tread = Thread(target = freeze_watcher)
@@ -265,6 +303,7 @@ def daemon():
                 snapshot_thread.start()
                 freeze_watcher_tread.join()
                 
+                unfreeze_start_time = time.time()
                 for i in range(0,3):
                     unfreeze_result = freezer.unfreezeall()
                     backup_logger.log('unfreeze result ' + str(unfreeze_result), True)
@@ -276,6 +315,11 @@ def daemon():
                             backup_logger.log('unfreeze result is None')
                             break;
                 backup_logger.log('unfreeze ends...')
+                timing_recorder.record('phase', 'unfreezeall', time.time() - unfreeze_start_time)
+                if(freeze_start_time is not None):
+                    freeze_hold_time = time.time() - freeze_start_time
+                    timing_recorder.record('phase', 'frozen', freeze_hold_time)
+                    backup_logger.log('warm up took ' + str(warmup_time) + ' seconds, the file systems were frozen for ' + str(freeze_hold_time) + ' seconds', True)
                 
         else:
             run_status = 'error'
@@ -300,13 +344,20 @@ def daemon():
         run_status = 'error'
         error_msg  += ('Enable failed.' + str(global_error_result))
     status_report_msg = None
+    sub_status = []
+    if(freeze_hold_time is not None):
+        sub_status.append(get_sub_status("FreezeHoldDuration", str(freeze_hold_time)))
+    if(len(timing_recorder.get_records()) > 0):
+        backup_logger.log_timings(timing_recorder)
+        sub_status.append(get_sub_status("TimingRecords", timing_recorder.to_json()))
     if(para_parser is not None and para_parser.statusBlobUri is not None and para_parser.statusBlobUri != ""):
         status_report_msg = do_backup_status_report(operation='Enable',status=run_status,\
                                 status_code=str(run_result),\
                                 message=error_msg,\
                                 taskId=para_parser.taskId,\
                                 commandStartTimeUTCTicks=para_parser.commandStartTimeUTCTicks,\
-                                blobUri=para_parser.statusBlobUri)
+                                blobUri=para_parser.statusBlobUri,\
+                                sub_status=sub_status)
     if(status_report_msg is not None):
         backup_logger.log("status report message:")
         backup_logger.log(status_report_msg)
@@ -317,6 +368,7 @@ def daemon():
     else:
         backup_logger.log("the logs blob uri is not there, so do not upload log.")
         backup_logger.commit_to_local()
+    HttpUtil.connection_pool.close_all()
 
     hutil.do_exit(0, 'Enable', run_status, str(run_result), error_msg)
 
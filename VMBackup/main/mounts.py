@@ -21,6 +21,7 @@
 
 from os.path import *
 
+import os
 import re
 import sys
 import subprocess
@@ -40,10 +41,122 @@ class Mount:
         self.mount_point = mount_point
 
 class Mounts:
+    mountinfo_path = '/proc/self/mountinfo'
+    sys_block_path = '/sys/class/block'
+    sys_dev_block_path = '/sys/dev/block'
+    # the mounts are discovered once and reused for the rest of the backup run.
+    cached_mounts = None
+
     def __init__(self,patching,logger):
-        self.mounts = []
+        if(Mounts.cached_mounts is None):
+            Mounts.cached_mounts = self.discover_mounts(patching, logger)
+        self.mounts = list(Mounts.cached_mounts)
+
+    @staticmethod
+    def invalidate_cache():
+        # called when a backup run starts, the mounts may have changed since the last one.
+        Mounts.cached_mounts = None
+
+    def discover_mounts(self, patching, logger):
+        if(os.path.exists(Mounts.mountinfo_path)):
+            try:
+                return self.get_mounts_from_mountinfo()
+            except Exception as e:
+                logger.log("Failed to parse " + Mounts.mountinfo_path + " with error: " + str(e) + ", falling back to lsblk")
+        return self.get_mounts_from_lsblk(patching, logger)
+
+    def get_mounts_from_lsblk(self, patching, logger):
+        mounts = []
         disk_util = DiskUtil(patching,logger)
         device_items = disk_util.get_device_items(None);
         for device_item in device_items:
             mount = Mount(device_item.name, device_item.type, device_item.file_system, device_item.mount_point)
-            self.mounts.append(mount)
+            mounts.append(mount)
+        return mounts
+
+    def unescape(self, field):
+        # the spaces, tabs, newlines and backslashes are escaped as \ooo in mountinfo.
+        return re.sub(r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)), field)
+
+    def read_sys_block(self, name, relative_path):
+        sys_file_path = os.path.join(Mounts.sys_block_path, name, relative_path)
+        if(os.path.exists(sys_file_path)):
+            with open(sys_file_path, 'r') as f:
+                return f.read().strip()
+        return None
+
+    def get_device_type(self, kernel_name):
+        """
+        the same types lsblk reports, from sysfs.
+        """
+        if(os.path.exists(os.path.join(Mounts.sys_block_path, kernel_name, 'partition'))):
+            return 'part'
+        if(kernel_name.startswith('loop')):
+            return 'loop'
+        if(kernel_name.startswith('dm-')):
+            dm_uuid = self.read_sys_block(kernel_name, 'dm/uuid')
+            if(dm_uuid is not None):
+                if(dm_uuid.startswith('LVM-')):
+                    return 'lvm'
+                if(dm_uuid.startswith('CRYPT-')):
+                    return 'crypt'
+                if(dm_uuid.startswith('mpath-')):
+                    return 'mpath'
+            return 'dm'
+        if(kernel_name.startswith('md')):
+            md_level = self.read_sys_block(kernel_name, 'md/level')
+            if(md_level is not None):
+                return md_level
+        return 'disk'
+
+    def get_kernel_name(self, major_minor, source):
+        major = major_minor.split(':')[0]
+        if(major != '0'):
+            dev_link = os.path.join(Mounts.sys_dev_block_path, major_minor)
+            if(os.path.islink(dev_link)):
+                return os.path.basename(os.readlink(dev_link))
+        # btrfs reports an anonymous device number, use the mount source.
+        if(source.startswith('/dev/')):
+            return os.path.basename(os.path.realpath(source))
+        return None
+
+    def get_mounts_from_mountinfo(self):
+        """
+        one pass over /proc/self/mountinfo and sysfs, no subprocess.
+        a file system mounted several times (bind mounts) is listed once,
+        with the root mount point if it is one of them, so it is frozen once.
+        """
+        mounts = []
+        mount_of_device = {}
+        with open(Mounts.mountinfo_path, 'r') as f:
+            mountinfo_lines = f.read().splitlines()
+        for mountinfo_line in mountinfo_lines:
+            fields = mountinfo_line.split()
+            if(len(fields) < 10 or '-' not in fields):
+                continue
+            separator_index = fields.index('-')
+            major_minor = fields[2]
+            root = self.unescape(fields[3])
+            mount_point = self.unescape(fields[4])
+            fstype = fields[separator_index + 1]
+            source = self.unescape(fields[separator_index + 2])
+            kernel_name = self.get_kernel_name(major_minor, source)
+            if(kernel_name is None):
+                continue
+            device_key = major_minor
+            if(major_minor.startswith('0:')):
+                device_key = kernel_name
+            existing_mount = mount_of_device.get(device_key)
+            if(existing_mount is not None):
+                if(mount_point == '/' and root == '/'):
+                    existing_mount.mount_point = mount_point
+                continue
+            name = kernel_name
+            if(kernel_name.startswith('dm-')):
+                dm_name = self.read_sys_block(kernel_name, 'dm/name')
+                if(dm_name is not None):
+                    name = dm_name
+            mount = Mount(name, self.get_device_type(kernel_name), fstype, mount_point)
+            mount_of_device[device_key] = mount
+            mounts.append(mount)
+        return mounts
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#
+# VM Backup extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+import random
+import threading
+import time
+import traceback
+import urlparse
+from threading import Thread
+from common import CommonVariables
+
+class ScheduledSnapshot(object):
+    def __init__(self, index, blob, account):
+        self.index = index
+        self.blob = blob
+        self.account = account
+        self.attempt = 0
+        self.not_before = 0
+
+class SnapshotScheduler(object):
+    """
+    takes the snapshots grouped by storage account, with at most
+    max_per_account requests in flight to the same account and at most
+    max_workers in total. a throttled snapshot (503 server busy) is
+    retried with a jittered exponential backoff as long as the retry can
+    start before the deadline. a 500 is not retried, the snapshot may
+    have been taken already.
+    """
+    def __init__(self, logger, snapshot_func, max_workers, max_per_account, deadline):
+        self.logger = logger
+        self.snapshot_func = snapshot_func
+        self.max_workers = max_workers
+        self.max_per_account = max_per_account
+        self.deadline = deadline
+        self.condition = threading.Condition()
+        self.pending = []
+        self.in_flight = {}
+        self.results = []
+
+    def get_account(self, blob):
+        try:
+            return urlparse.urlparse(blob).netloc.lower()
+        except Exception:
+            return None
+
+    def get_backoff(self, attempt):
+        backoff = min(CommonVariables.snapshot_retry_max_backoff, CommonVariables.snapshot_retry_base_backoff * (2 ** attempt))
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+    def is_throttled(self, snapshot_error):
+        return snapshot_error is not None and snapshot_error.errorcode != CommonVariables.success and snapshot_error.http_status in CommonVariables.snapshot_retry_http_status
+
+    def next_snapshot(self):
+        """
+        blocks until a snapshot can be started, None when all are done.
+        """
+        with self.condition:
+            while True:
+                if(len(self.pending) == 0 and sum(self.in_flight.values()) == 0):
+                    return None
+                now = time.time()
+                wait_time = None
+                for scheduled in self.pending:
+                    if(self.in_flight.get(scheduled.account, 0) >= self.max_per_account):
+                        continue
+                    if(scheduled.not_before > now):
+                        if(wait_time is None or scheduled.not_before - now < wait_time):
+                            wait_time = scheduled.not_before - now
+                        continue
+                    self.pending.remove(scheduled)
+                    self.in_flight[scheduled.account] = self.in_flight.get(scheduled.account, 0) + 1
+                    return scheduled
+                self.condition.wait(wait_time)
+
+    def snapshot_finished(self, scheduled, snapshot_error):
+        with self.condition:
+            self.in_flight[scheduled.account] -= 1
+            if(self.is_throttled(snapshot_error) and scheduled.attempt + 1 < CommonVariables.snapshot_retry_max_attempts):
+                backoff = self.get_backoff(scheduled.attempt)
+                if(time.time() + backoff < self.deadline):
+                    self.logger.log("snapshot throttled with http status " + str(snapshot_error.http_status) + ", retrying in " + str(backoff) + " seconds")
+                    scheduled.attempt += 1
+                    scheduled.not_before = time.time() + backoff
+                    self.pending.append(scheduled)
+                    self.condition.notify_all()
+                    return
+                self.logger.log("snapshot throttled, no time left before the deadline to retry it", False, 'Warning')
+            self.results[scheduled.index] = snapshot_error
+            self.condition.notify_all()
+
+    def worker(self):
+        while True:
+            scheduled = self.next_snapshot()
+            if(scheduled is None):
+                return
+            snapshot_error = None
+            try:
+                snapshot_error = self.snapshot_func(scheduled.blob)
+            except Exception as e:
+                errMsg = "snapshot failed with error: %s, stack trace: %s" % (str(e), traceback.format_exc())
+                self.logger.log(errMsg, False, 'Error')
+            self.snapshot_finished(scheduled, snapshot_error)
+
+    def run(self, blobs):
+        """
+        returns the SnapshotError of every blob in the order of the blobs,
+        None for a blob whose snapshot_func raised.
+        """
+        self.results = [None] * len(blobs)
+        self.pending = []
+        self.in_flight = {}
+        for index in range(0, len(blobs)):
+            self.pending.append(ScheduledSnapshot(index, blobs[index], self.get_account(blobs[index])))
+        worker_count = min(max(self.max_workers, 1), len(blobs))
+        workers = []
+        for i in range(0, worker_count):
+            worker_thread = Thread(target = self.worker)
+            worker_thread.daemon = True
+            worker_thread.start()
+            workers.append(worker_thread)
+        for worker_thread in workers:
+            worker_thread.join()
+        return self.results
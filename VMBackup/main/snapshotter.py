@@ -20,16 +20,21 @@
 #
 import urlparse
 import httplib
+import time
 import traceback
 from common import CommonVariables
 from HttpUtil import HttpUtil
+from workerpool import WorkerPool
+from snapshotscheduler import SnapshotScheduler
+from timingrecorder import TimingRecorder
 
 class SnapshotError(object):
     def __init__(self):
         self.errorcode = CommonVariables.success
         self.sasuri = None
+        self.http_status = None
     def __str__(self):
-        return 'errorcode: ' + str(self.errorcode) + ' sasuri: ' + str(self.sasuri)
+        return 'errorcode: ' + str(self.errorcode) + ' sasuri: ' + str(self.sasuri) + ' http_status: ' + str(self.http_status)
 
 class SnapshotResult(object):
     def __init__(self):
@@ -43,8 +48,18 @@ class SnapshotResult(object):
 
 class Snapshotter(object):
     """description of class"""
-    def __init__(self, logger):
+    def __init__(self, logger, max_workers = CommonVariables.snapshot_max_workers, timeout = CommonVariables.snapshot_timeout, timing_recorder = None,\
+                 max_per_account = CommonVariables.snapshot_max_per_account, deadline = None):
         self.logger = logger
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_per_account = max_per_account
+        if(deadline is None):
+            deadline = time.time() + CommonVariables.freeze_timeout
+        self.deadline = deadline
+        if(timing_recorder is None):
+            timing_recorder = TimingRecorder()
+        self.timing_recorder = timing_recorder
 
     def snapshot(self, sasuri, meta_data):
         result = None
@@ -71,11 +86,15 @@ class Snapshotter(object):
                 http_util = HttpUtil(self.logger)
                 sasuri_obj = urlparse.urlparse(sasuri + '&comp=snapshot')
                 self.logger.log("start calling the snapshot rest api")
-                result = http_util.Call('PUT',sasuri_obj, body_content, headers = headers)
-                self.logger.log("snapshot api returned: {0}".format(result))
+                start_time = time.time()
+                result, http_status = http_util.CallWithStatus('PUT',sasuri_obj, body_content, headers = headers, timeout = self.timeout)
+                # the sas token is not recorded, only the host and the blob path.
+                self.timing_recorder.record('snapshot', sasuri_obj.hostname + sasuri_obj.path, time.time() - start_time, http_status = http_status, result = result)
+                self.logger.log("snapshot api returned: {0} with http status {1}".format(result, http_status))
                 if(result != CommonVariables.success):
                     snapshot_error.errorcode = result
                     snapshot_error.sasuri = sasuri
+                    snapshot_error.http_status = http_status
         except Exception as e:
             errorMsg = "Failed to do the snapshot with error: %s, stack trace: %s" % (str(e), traceback.format_exc())
             self.logger.log(errorMsg, False, 'Error')
@@ -83,16 +102,51 @@ class Snapshotter(object):
             snapshot_error.sasuri = sasuri
         return snapshot_error
 
+    def warmup(self, paras):
+        """
+        open the connections to every storage host before the freeze, one per
+        blob up to max_workers per host, so the frozen window only pays for the
+        snapshot requests themselves.
+        """
+        blobs = paras.blobs
+        if blobs is None:
+            return
+        blob_count_per_host = {}
+        host_uri = {}
+        for blob in blobs:
+            if(blob is None):
+                continue
+            sasuri_obj = urlparse.urlparse(blob)
+            if(sasuri_obj is None or sasuri_obj.hostname is None):
+                continue
+            host = (sasuri_obj.hostname, sasuri_obj.port)
+            blob_count_per_host[host] = blob_count_per_host.get(host, 0) + 1
+            host_uri[host] = sasuri_obj
+        warmup_uris = []
+        for host in blob_count_per_host.keys():
+            for i in range(0, min(blob_count_per_host[host], max(self.max_workers, 1))):
+                warmup_uris.append(host_uri[host])
+        self.logger.log("warming up " + str(len(warmup_uris)) + " connections to " + str(len(blob_count_per_host)) + " hosts")
+        worker_pool = WorkerPool(self.logger, self.max_workers)
+        worker_pool.map(lambda sasuri_obj: HttpUtil(self.logger).warmup(sasuri_obj, self.timeout), warmup_uris)
+
     def snapshotall(self, paras):
         self.logger.log("doing snapshotall now...")
         snapshot_result = SnapshotResult()
         blobs = paras.blobs
         if blobs is not None:
-            for blob in blobs:
-                snapshotError = self.snapshot(blob, paras.backup_metadata)
+            self.logger.log("taking " + str(len(blobs)) + " snapshots with " + str(self.max_workers) + " workers, " + str(self.max_per_account) + " per storage account")
+            snapshot_scheduler = SnapshotScheduler(self.logger, lambda blob: self.snapshot(blob, paras.backup_metadata), self.max_workers, self.max_per_account, self.deadline)
+            snapshot_errors = snapshot_scheduler.run(blobs)
+            for i in range(0, len(blobs)):
+                snapshotError = snapshot_errors[i]
+                if(snapshotError is None):
+                    snapshotError = SnapshotError()
+                    snapshotError.errorcode = CommonVariables.error
+                    snapshotError.sasuri = blobs[i]
                 if(snapshotError.errorcode != CommonVariables.success):
                     snapshot_result.errors.append(snapshotError)
             return snapshot_result
         else:
             self.logger.log("the blobs are None")
-            return snapshot_result
\ No newline at end of file
+            return snapshot_result
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+#
+# VM Backup extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+import json
+import threading
+
+class TimingRecord(object):
+    def __init__(self, category, name, elapsed, attributes):
+        self.category = category
+        self.name = name
+        self.elapsed = elapsed
+        self.attributes = attributes
+
+    def to_dict(self):
+        record = {'category' : self.category, 'name' : self.name, 'elapsed' : round(self.elapsed, 6)}
+        record.update(self.attributes)
+        return record
+
+    def __str__(self):
+        return "category:" + str(self.category) + " name:" + str(self.name) + " elapsed:" + str(self.elapsed) + " " + str(self.attributes)
+
+class TimingRecorder(object):
+    """
+    collects where the time of a backup goes, per mount freeze/unfreeze,
+    per blob snapshot, and the phases of the daemon.
+    records are added from the freeze and snapshot worker threads.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = []
+
+    def record(self, category, name, elapsed, **attributes):
+        timing_record = TimingRecord(category, name, elapsed, attributes)
+        with self.lock:
+            self.records.append(timing_record)
+        return timing_record
+
+    def get_records(self, category = None):
+        with self.lock:
+            records = list(self.records)
+        if(category is None):
+            return records
+        return [timing_record for timing_record in records if timing_record.category == category]
+
+    def to_json(self):
+        return json.dumps([timing_record.to_dict() for timing_record in self.get_records()])
+
+    def summary(self):
+        """
+        one line per category: the count, the total and the max elapsed seconds.
+        """
+        categories = []
+        elapsed_per_category = {}
+        for timing_record in self.get_records():
+            if(timing_record.category not in elapsed_per_category):
+                categories.append(timing_record.category)
+                elapsed_per_category[timing_record.category] = []
+            elapsed_per_category[timing_record.category].append(timing_record.elapsed)
+        summary_lines = []
+        for category in categories:
+            elapsed_list = elapsed_per_category[category]
+            summary_lines.append("{0}: count {1}, total {2:.3f}s, max {3:.3f}s".format(category, len(elapsed_list), sum(elapsed_list), max(elapsed_list)))
+        return "\n".join(summary_lines)
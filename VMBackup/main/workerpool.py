@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+#
+# VM Backup extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+import Queue
+import traceback
+from threading import Thread
+
+class WorkerPool(object):
+    """
+    a bounded pool of threads, used to fan out the per disk/per mount work.
+    """
+    def __init__(self, logger, max_workers):
+        self.logger = logger
+        self.max_workers = max_workers
+
+    def map(self, func, items):
+        """
+        call func on every item with at most max_workers threads, the results
+        are in the same order as the items. an item whose func raised gets None.
+        """
+        items = list(items)
+        results = [None] * len(items)
+        if(len(items) == 0):
+            return results
+        work_queue = Queue.Queue()
+        for index in range(0, len(items)):
+            work_queue.put(index)
+
+        def worker():
+            while True:
+                try:
+                    index = work_queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    results[index] = func(items[index])
+                except Exception as e:
+                    errMsg = "worker failed with error: %s, stack trace: %s" % (str(e), traceback.format_exc())
+                    self.logger.log(errMsg, False, 'Error')
+
+        worker_count = min(max(self.max_workers, 1), len(items))
+        workers = []
+        for i in range(0, worker_count):
+            worker_thread = Thread(target = worker)
+            worker_thread.daemon = True
+            worker_thread.start()
+            workers.append(worker_thread)
+        for worker_thread in workers:
+            worker_thread.join()
+        return results
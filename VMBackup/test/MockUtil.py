@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+#
+# VM Backup extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+import ssl
+from Utils.WAAgentUtil import waagent
+
+class MockLogger(object):
+    def __init__(self, verbose = False):
+        self.verbose = verbose
+
+    def log(self, msg, local = False, level = 'Info'):
+        if(self.verbose):
+            print msg
+
+class MockConfigurationProvider(object):
+    """
+    no /etc/waagent.conf is needed, and no proxy is configured.
+    """
+    def __init__(self, *args):
+        pass
+
+    def get(self, key):
+        return None
+
+class MockEnvironment(object):
+    """
+    lets HttpUtil talk to the local fake storage with its self signed certificate.
+    """
+    def __init__(self):
+        self.configuration_provider = waagent.ConfigurationProvider
+        self.https_context = ssl._create_default_https_context
+
+    def set_up(self):
+        waagent.ConfigurationProvider = MockConfigurationProvider
+        ssl._create_default_https_context = ssl._create_unverified_context
+
+    def tear_down(self):
+        waagent.ConfigurationProvider = self.configuration_provider
+        ssl._create_default_https_context = self.https_context
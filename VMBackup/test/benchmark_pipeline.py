@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+#
+# VM Backup extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+#
+# Drives handle.daemon through FsFreezer, Snapshotter, BlobWriter and
+# Backuplogger against the local fake blob storage, with mocked FIFREEZE and
+# FITHAW ioctls, and reports the freeze duration, the snapshot throughput and
+# the total runtime as the disk and mount counts grow.
+#
+# Usage (waagent must be on PYTHONPATH):
+#     python benchmark_pipeline.py --disks 1,4,16 --mounts 1,4,8 --latency 0.05
+#
+import env
+import argparse
+import base64
+import datetime
+import imp
+import json
+import os
+import shutil
+import tempfile
+import time
+from threading import Event
+from MockUtil import MockEnvironment
+from fakeblobstorage import FakeBlobStorage
+from common import CommonVariables
+from mounts import Mount
+from mounts import Mounts
+from backuplogger import Backuplogger
+from timingrecorder import TimingRecorder
+import fsfreezer
+
+# test/handle.py shadows the extension handler in this directory.
+handle = imp.load_source('vmbackup_handle', os.path.join(env.root, 'main', 'handle.py'))
+
+class BenchmarkContext(object):
+    def __init__(self, config):
+        self._config = config
+        self._version = CommonVariables.extension_version
+        self._name = CommonVariables.extension_name
+
+class BenchmarkHandlerUtility(object):
+    """
+    stands in for HandlerUtility, the settings are given and do_exit does not exit.
+    """
+    def __init__(self, public_settings, protected_settings):
+        self._context = BenchmarkContext({'runtimeSettings' : [{'handlerSettings' : {'publicSettings' : public_settings, 'protectedSettings' : protected_settings}}]})
+        self.patching = None
+        self.exit_status = None
+
+    def log(self, message):
+        pass
+
+    def error(self, message):
+        pass
+
+    def do_parse_context(self, operation):
+        pass
+
+    def exit_if_same_seq(self):
+        pass
+
+    def save_seq(self):
+        pass
+
+    def set_last_seq(self, seq):
+        pass
+
+    def do_exit(self, exit_code, operation, status, code, message):
+        self.exit_status = (status, code, message)
+
+class BenchmarkMachineIdentity(object):
+    def stored_identity(self):
+        return 'benchmark'
+
+    def current_identity(self):
+        return 'benchmark'
+
+    def save_identity(self):
+        pass
+
+def mocked_ioctl(ioctl_latency):
+    def ioctl(fd, request, arg):
+        time.sleep(ioctl_latency)
+        return 0
+    return ioctl
+
+def utc_ticks_now():
+    time_delta = datetime.datetime.utcnow() - datetime.datetime(1, 1, 1)
+    return str(long(handle.timedelta_total_seconds(time_delta) * 10 * 1000 * 1000))
+
+def encode_object(obj):
+    return base64.standard_b64encode(json.dumps(obj))
+
+def run_pipeline(storage, disk_count, mount_count, work_dir):
+    blobs = [storage.blob_uri('disk' + str(i) + '.vhd') for i in range(0, disk_count)]
+    public_settings = {
+        CommonVariables.command_to_execute : CommonVariables.iaas_vmbackup_command,
+        CommonVariables.task_id : 'benchmark',
+        CommonVariables.status_blob_uri : storage.blob_uri('status.txt'),
+        CommonVariables.logs_blob_uri : storage.blob_uri('log.txt'),
+        CommonVariables.commandStartTimeUTCTicks : utc_ticks_now(),
+        CommonVariables.object_str : encode_object({'backupMetadata' : [{'Key' : 'backupId', 'Value' : 'benchmark'}]})
+    }
+    protected_settings = {CommonVariables.object_str : encode_object({'blobSASUri' : blobs})}
+
+    # the mount points are directories, the ioctls on them are mocked.
+    mounts = [Mount('sda1', 'part', 'ext4', '/')]
+    for i in range(1, mount_count):
+        mount_point = os.path.join(work_dir, 'mount' + str(i))
+        os.mkdir(mount_point)
+        mounts.append(Mount('sd' + chr(ord('b') + i) + '1', 'part', 'ext4', mount_point))
+    Mounts.cached_mounts = mounts
+
+    handle.hutil = BenchmarkHandlerUtility(public_settings, protected_settings)
+    handle.backup_logger = Backuplogger(handle.hutil)
+    handle.MyPatching = None
+    handle.run_result = CommonVariables.success
+    handle.run_status = 'success'
+    handle.error_msg = ''
+    handle.snapshot_done = Event()
+    handle.freeze_start_time = None
+    handle.freeze_hold_time = None
+    handle.timing_recorder = TimingRecorder()
+    handle.para_parser = None
+
+    start_time = time.time()
+    handle.daemon()
+    total_time = time.time() - start_time
+
+    snapshot_time = sum([timing_record.elapsed for timing_record in handle.timing_recorder.get_records('phase') if timing_record.name == 'snapshotall'])
+    return {
+        'status' : handle.hutil.exit_status[0],
+        'freeze' : handle.freeze_hold_time,
+        'snapshot_throughput' : disk_count / snapshot_time if snapshot_time > 0 else 0,
+        'total' : total_time
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description = 'VMBackup freeze/snapshot pipeline benchmark')
+    parser.add_argument('--disks', default = '1,4,16', help = 'comma separated disk counts')
+    parser.add_argument('--mounts', default = '1,4,8', help = 'comma separated mount counts')
+    parser.add_argument('--latency', type = float, default = 0.05, help = 'storage latency per request in seconds')
+    parser.add_argument('--error-rate', type = float, default = 0, help = 'ratio of requests answered with 500')
+    parser.add_argument('--throttle-count', type = int, default = 0, help = '503 answers per blob before success')
+    parser.add_argument('--ioctl-latency', type = float, default = 0.01, help = 'latency of the mocked freeze/thaw ioctls in seconds')
+    args = parser.parse_args()
+
+    environment = MockEnvironment()
+    environment.set_up()
+    handle.MachineIdentity = BenchmarkMachineIdentity
+    fsfreezer.fcntl.ioctl = mocked_ioctl(args.ioctl_latency)
+    cwd = os.getcwd()
+    try:
+        print '{0:>6} {1:>6} {2:>8} {3:>10} {4:>16} {5:>10}'.format('disks', 'mounts', 'status', 'freeze(s)', 'snapshots/s', 'total(s)')
+        for disk_count in [int(count) for count in args.disks.split(',')]:
+            for mount_count in [int(count) for count in args.mounts.split(',')]:
+                storage = FakeBlobStorage(latency = args.latency, throttle_count = args.throttle_count, error_rate = args.error_rate)
+                if(not storage.start()):
+                    print 'openssl is needed for the fake storage certificate'
+                    return
+                work_dir = tempfile.mkdtemp()
+                # the identity files of the extension are written to the current directory.
+                os.chdir(work_dir)
+                try:
+                    result = run_pipeline(storage, disk_count, mount_count, work_dir)
+                finally:
+                    os.chdir(cwd)
+                    shutil.rmtree(work_dir, ignore_errors = True)
+                    storage.stop()
+                print '{0:>6} {1:>6} {2:>8} {3:>10.3f} {4:>16.1f} {5:>10.3f}'.format(disk_count, mount_count, result['status'], result['freeze'], result['snapshot_throughput'], result['total'])
+    finally:
+        environment.tear_down()
+
+if __name__ == '__main__':
+    main()
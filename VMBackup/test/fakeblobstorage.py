@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+#
+# VM Backup extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+import os
+import random
+import re
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from SocketServer import ThreadingMixIn
+from threading import Thread
+
+def create_certificate(directory):
+    """
+    a self signed certificate for the fake storage, None if openssl is not there.
+    """
+    cert_file = os.path.join(directory, 'fakeblobstorage.crt')
+    key_file = os.path.join(directory, 'fakeblobstorage.key')
+    try:
+        devnull = open(os.devnull, 'w')
+        return_code = subprocess.call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',\
+                                       '-subj', '/CN=localhost', '-keyout', key_file, '-out', cert_file], stdout = devnull, stderr = devnull)
+    except OSError:
+        return None
+    if(return_code != 0):
+        return None
+    return cert_file, key_file
+
+class FakeBlobStorageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_PUT(self):
+        content_length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(content_length)
+        disconnect = self.server.storage.take_disconnect(self.path)
+        if(disconnect == 'before'):
+            # as a kept alive connection the server closed, no response at all.
+            self.close_connection = 1
+            return
+        status = self.server.storage.handle_put(self.path, self.headers, body)
+        self.send_response(status)
+        if(disconnect == 'after'):
+            # the request is done, but the response is cut in the middle of its body.
+            self.send_header('Content-Length', '10')
+            self.end_headers()
+            self.close_connection = 1
+            return
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeBlobStorageServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        # the clients close their kept alive connections at any time.
+        pass
+
+class FakeBlobStorage(object):
+    """
+    a local https stand-in for one storage account. it answers the put blob,
+    put block, put block list and snapshot requests, with an injected
+    latency, a number of 503 server busy answers per blob before it
+    succeeds, a random 500 error rate, and injected errors and disconnects
+    per request kind.
+    """
+    def __init__(self, latency = 0, throttle_count = 0, error_rate = 0):
+        self.latency = latency
+        self.throttle_count = throttle_count
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.throttled = {}
+        self.snapshots = {}
+        self.blobs = {}
+        self.blob_headers = {}
+        self.blocks = {}
+        self.injected_errors = {}
+        self.injected_disconnects = {}
+        self.comp_count = {}
+        self.request_count = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.server = None
+        self.cert_dir = None
+
+    def start(self):
+        """
+        returns False if the fake storage can not be started.
+        """
+        self.cert_dir = tempfile.mkdtemp()
+        certificate = create_certificate(self.cert_dir)
+        if(certificate is None):
+            return False
+        self.server = FakeBlobStorageServer(('127.0.0.1', 0), FakeBlobStorageHandler)
+        self.server.storage = self
+        self.server.socket = ssl.wrap_socket(self.server.socket, certfile = certificate[0], keyfile = certificate[1], server_side = True)
+        server_thread = Thread(target = self.server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        return True
+
+    def stop(self):
+        if(self.server is not None):
+            self.server.shutdown()
+            self.server.server_close()
+        if(self.cert_dir is not None):
+            shutil.rmtree(self.cert_dir, ignore_errors = True)
+
+    def blob_uri(self, blob_name):
+        return 'https://127.0.0.1:{0}/vhds/{1}?sv=2014-02-14&sig=fake'.format(self.server.server_address[1], blob_name)
+
+    def inject_errors(self, comp, count, status = 500):
+        """
+        the next count requests of this kind (snapshot, block, blocklist, or None for put blob) fail.
+        """
+        with self.lock:
+            self.injected_errors[comp] = (count, status)
+
+    def inject_disconnects(self, comp, count, when):
+        """
+        the connection of the next count requests of this kind is closed,
+        'before' the request is handled or 'after' it, in the response.
+        """
+        with self.lock:
+            self.injected_disconnects[comp] = (count, when)
+
+    def take_disconnect(self, path):
+        comp = urlparse.parse_qs(urlparse.urlparse(path).query).get('comp', [None])[0]
+        with self.lock:
+            count, when = self.injected_disconnects.get(comp, (0, None))
+            if(count <= 0):
+                return None
+            self.injected_disconnects[comp] = (count - 1, when)
+            return when
+
+    def handle_put(self, path, headers, body):
+        with self.lock:
+            self.request_count += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if(self.latency > 0):
+                time.sleep(self.latency)
+            return self.put(path, headers, body)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def put(self, path, headers, body):
+        path_obj = urlparse.urlparse(path)
+        query = urlparse.parse_qs(path_obj.query)
+        comp = query.get('comp', [None])[0]
+        blob_path = path_obj.path
+        with self.lock:
+            self.comp_count[comp] = self.comp_count.get(comp, 0) + 1
+            count, status = self.injected_errors.get(comp, (0, None))
+            if(count > 0):
+                self.injected_errors[comp] = (count - 1, status)
+                return status
+            throttled = self.throttled.get(blob_path, 0)
+            if(throttled < self.throttle_count):
+                self.throttled[blob_path] = throttled + 1
+                return 503
+        if(self.error_rate > 0 and random.random() < self.error_rate):
+            return 500
+        with self.lock:
+            if(comp == 'snapshot'):
+                self.snapshots[blob_path] = self.snapshots.get(blob_path, 0) + 1
+            elif(comp == 'block'):
+                self.blocks[(blob_path, query['blockid'][0])] = body
+            elif(comp == 'blocklist'):
+                block_ids = re.findall('<Latest>([^<]*)</Latest>', body)
+                self.blobs[blob_path] = ''.join([self.blocks[(blob_path, block_id)] for block_id in block_ids])
+                self.blob_headers[blob_path] = dict(headers)
+            else:
+                self.blobs[blob_path] = body
+                self.blob_headers[blob_path] = dict(headers)
+        return 201
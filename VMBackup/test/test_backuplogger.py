@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+#
+# VM Backup extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+import unittest
+import env
+import gzip
+import socket
+from StringIO import StringIO
+from MockUtil import MockLogger
+from MockUtil import MockEnvironment
+from fakeblobstorage import FakeBlobStorage
+from common import CommonVariables
+from HttpUtil import HttpUtil
+from backuplogger import Backuplogger
+from blobwriter import BlobWriter
+
+class MockHandlerUtility(MockLogger):
+    def __init__(self):
+        MockLogger.__init__(self)
+        self.patching = None
+
+def decompress(data):
+    return gzip.GzipFile(fileobj = StringIO(data)).read()
+
+class TestBackuplogger(unittest.TestCase):
+    def setUp(self):
+        self.environment = MockEnvironment()
+        self.environment.set_up()
+        self.storage = FakeBlobStorage()
+        if(not self.storage.start()):
+            self.skipTest('openssl is needed for the fake storage certificate')
+
+    def tearDown(self):
+        self.storage.stop()
+        HttpUtil.connection_pool.close_all()
+        self.environment.tear_down()
+
+    def test_log_is_bounded(self):
+        backup_logger = Backuplogger(MockHandlerUtility(), max_bytes = 1024)
+        for i in range(0, 1000):
+            backup_logger.log('line ' + str(i))
+        msg = backup_logger.get_msg()
+        self.assertTrue(len(msg) < 1024 + 100)
+        self.assertTrue('line 999' in msg)
+        self.assertFalse('line 0 ' in msg)
+        self.assertTrue('older log lines were dropped' in msg)
+
+    def test_small_log_is_one_put_blob(self):
+        backup_logger = Backuplogger(MockHandlerUtility())
+        backup_logger.log('snapshot done')
+        backup_logger.commit(self.storage.blob_uri('log.txt'))
+        self.assertEqual(1, self.storage.comp_count.get(None))
+        self.assertEqual(None, self.storage.comp_count.get('block'))
+        self.assertTrue('snapshot done' in decompress(self.storage.blobs['/vhds/log.txt']))
+        self.assertEqual('gzip', self.storage.blob_headers['/vhds/log.txt']['content-encoding'])
+
+    def test_large_blob_resumes_from_the_failed_block(self):
+        data = ''.join([chr(i % 256) for i in range(0, 10 * 1000)])
+        self.storage.inject_errors('block', 1)
+        result = BlobWriter(MockHandlerUtility()).WriteBlockBlob(data, self.storage.blob_uri('log.txt'), content_encoding = 'gzip', block_size = 1000)
+        self.assertEqual(CommonVariables.success, result)
+        # the failed block is sent twice, the other ones once.
+        self.assertEqual(11, self.storage.comp_count['block'])
+        self.assertEqual(1, self.storage.comp_count['blocklist'])
+        self.assertEqual(data, self.storage.blobs['/vhds/log.txt'])
+        self.assertEqual('gzip', self.storage.blob_headers['/vhds/log.txt']['x-ms-blob-content-encoding'])
+
+    def test_block_upload_falls_back_to_curl(self):
+        curl_calls = []
+        def fail_request(http_util, method, sasuri_obj, data, headers, timeout):
+            raise socket.error('connection refused')
+        def call_using_curl(http_util, method, sasuri_obj, data, headers):
+            curl_calls.append((sasuri_obj.query, data))
+            return CommonVariables.success
+        request = HttpUtil.request
+        call_using_curl_method = HttpUtil.CallUsingCurl
+        HttpUtil.request = fail_request
+        HttpUtil.CallUsingCurl = call_using_curl
+        try:
+            data = ''.join([chr(i % 256) for i in range(0, 2500)])
+            result = BlobWriter(MockHandlerUtility()).WriteBlockBlob(data, self.storage.blob_uri('log.txt'), content_encoding = 'gzip', block_size = 1000)
+        finally:
+            HttpUtil.request = request
+            HttpUtil.CallUsingCurl = call_using_curl_method
+        self.assertEqual(CommonVariables.success, result)
+        self.assertEqual(4, len(curl_calls))
+        self.assertEqual(data, ''.join([call_data for (query, call_data) in curl_calls[:3]]))
+        self.assertTrue('comp=blocklist' in curl_calls[3][0])
+
+    def test_curl_error_is_a_failed_attempt(self):
+        curl_calls = []
+        def fail_request(http_util, method, sasuri_obj, data, headers, timeout):
+            raise socket.error('connection refused')
+        def call_using_curl(http_util, method, sasuri_obj, data, headers):
+            curl_calls.append(sasuri_obj.query)
+            raise OSError(2, 'No such file or directory')
+        request = HttpUtil.request
+        call_using_curl_method = HttpUtil.CallUsingCurl
+        HttpUtil.request = fail_request
+        HttpUtil.CallUsingCurl = call_using_curl
+        try:
+            blob_writer = BlobWriter(MockHandlerUtility())
+            small_result = blob_writer.WriteBlockBlob('log', self.storage.blob_uri('small.txt'))
+            block_result = blob_writer.WriteBlockBlob('x' * 2500, self.storage.blob_uri('log.txt'), block_size = 1000)
+        finally:
+            HttpUtil.request = request
+            HttpUtil.CallUsingCurl = call_using_curl_method
+        self.assertEqual(CommonVariables.error_http_failure, small_result)
+        self.assertEqual(CommonVariables.error_http_failure, block_result)
+        self.assertEqual(2 * CommonVariables.blob_retry_times, len(curl_calls))
+
+if __name__ == '__main__':
+    unittest.main()
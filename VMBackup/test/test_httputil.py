@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#
+# VM Backup extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+import unittest
+import env
+import urlparse
+import HttpUtil as http_util_module
+from MockUtil import MockLogger
+from MockUtil import MockEnvironment
+from fakeblobstorage import FakeBlobStorage
+from common import CommonVariables
+from HttpUtil import HttpUtil
+
+class TestHttpUtil(unittest.TestCase):
+    def setUp(self):
+        self.environment = MockEnvironment()
+        self.environment.set_up()
+        self.storage = FakeBlobStorage()
+        if(not self.storage.start()):
+            self.skipTest('openssl is needed for the fake storage certificate')
+
+    def tearDown(self):
+        self.storage.stop()
+        HttpUtil.connection_pool.close_all()
+        self.environment.tear_down()
+
+    def snapshot(self, blob_name):
+        sasuri_obj = urlparse.urlparse(self.storage.blob_uri(blob_name) + '&comp=snapshot')
+        return HttpUtil(MockLogger()).CallWithStatus('PUT', sasuri_obj, '', {'Content-Length': '0'})
+
+    def test_closed_kept_alive_connection_is_retried(self):
+        self.assertEqual((CommonVariables.success, 201), self.snapshot('disk0.vhd'))
+        # the kept alive connection is closed without a response, the request never got through.
+        self.storage.inject_disconnects('snapshot', 1, 'before')
+        self.assertEqual((CommonVariables.success, 201), self.snapshot('disk1.vhd'))
+        # the dropped request is not counted, only the one sent again.
+        self.assertEqual(1, self.storage.snapshots['/vhds/disk1.vhd'])
+        self.assertEqual(2, self.storage.comp_count['snapshot'])
+
+    def test_failure_after_the_request_is_not_retried(self):
+        self.assertEqual((CommonVariables.success, 201), self.snapshot('disk0.vhd'))
+        # the snapshot is taken, the response is lost, sending it again would take a second one.
+        self.storage.inject_disconnects('snapshot', 1, 'after')
+        self.assertEqual((CommonVariables.error_http_failure, None), self.snapshot('disk1.vhd'))
+        self.assertEqual(1, self.storage.snapshots['/vhds/disk1.vhd'])
+        self.assertEqual(2, self.storage.comp_count['snapshot'])
+
+    def test_curl_keeps_the_port(self):
+        curl_args = []
+        class FakeProcess(object):
+            def __init__(self, args, **kwargs):
+                curl_args.append(args)
+                self.stdin = self
+                self.returncode = 0
+            def write(self, data):
+                pass
+            def communicate(self):
+                return ('', '')
+            def wait(self):
+                return self.returncode
+        sasuri_obj = urlparse.urlparse(self.storage.blob_uri('log.txt'))
+        popen = http_util_module.Popen
+        http_util_module.Popen = FakeProcess
+        try:
+            http_util = HttpUtil(MockLogger())
+            self.assertEqual(CommonVariables.success, http_util.CallUsingCurl('PUT', sasuri_obj, 'log', {}))
+            http_util.proxyHost = 'proxy'
+            http_util.proxyPort = '3128'
+            self.assertEqual(CommonVariables.success, http_util.CallUsingCurl('PUT', sasuri_obj, 'log', {}))
+        finally:
+            http_util_module.Popen = popen
+        self.assertNotEqual(None, sasuri_obj.port)
+        for args in curl_args:
+            self.assertTrue(self.storage.blob_uri('log.txt') in args)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#
+# VM Backup extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+import unittest
+import env
+import os
+import os.path
+import shutil
+import tempfile
+from MockUtil import MockLogger
+from mounts import Mounts
+
+# sda1 is bind mounted before it is mounted at /, rootvg-lv has a space in
+# its mount point, the btrfs subvolume reports the anonymous major 0 and
+# proc, tmpfs and nfs have no device under /dev.
+mountinfo = r"""21 1 8:1 /var/www /srv/www rw,relatime shared:1 - ext4 /dev/sda1 rw
+22 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw,data=ordered
+23 22 0:22 / /proc rw,nosuid,nodev,noexec,relatime shared:5 - proc proc rw
+24 22 0:23 / /run rw,nosuid,nodev shared:6 - tmpfs tmpfs rw,mode=755
+25 22 253:0 / /mnt/data\040dir rw,relatime - xfs /dev/mapper/rootvg-lv rw
+26 22 0:45 / /btrfs rw,relatime - btrfs /dev/sdc rw,space_cache
+27 22 0:45 /sub /btrfs/sub rw,relatime - btrfs /dev/sdc rw,space_cache
+28 22 0:50 / /mnt/share rw,relatime - nfs server:/export rw
+"""
+
+class TestMounts(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.paths = (Mounts.mountinfo_path, Mounts.sys_block_path, Mounts.sys_dev_block_path)
+        Mounts.mountinfo_path = os.path.join(self.work_dir, 'mountinfo')
+        Mounts.sys_block_path = os.path.join(self.work_dir, 'class', 'block')
+        Mounts.sys_dev_block_path = os.path.join(self.work_dir, 'dev', 'block')
+        os.makedirs(os.path.join(Mounts.sys_block_path, 'sda1', 'partition'))
+        os.makedirs(os.path.join(Mounts.sys_block_path, 'dm-0', 'dm'))
+        self.write_file(os.path.join(Mounts.sys_block_path, 'dm-0', 'dm', 'name'), 'rootvg-lv\n')
+        self.write_file(os.path.join(Mounts.sys_block_path, 'dm-0', 'dm', 'uuid'), 'LVM-abc\n')
+        os.makedirs(Mounts.sys_dev_block_path)
+        os.symlink('../../devices/pci0000:00/host0/block/sda/sda1', os.path.join(Mounts.sys_dev_block_path, '8:1'))
+        os.symlink('../../devices/virtual/block/dm-0', os.path.join(Mounts.sys_dev_block_path, '253:0'))
+        self.write_file(Mounts.mountinfo_path, mountinfo)
+        Mounts.invalidate_cache()
+
+    def tearDown(self):
+        Mounts.mountinfo_path, Mounts.sys_block_path, Mounts.sys_dev_block_path = self.paths
+        Mounts.invalidate_cache()
+        shutil.rmtree(self.work_dir)
+
+    def write_file(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def get_mounts(self):
+        return [(mount.name, mount.type, mount.fstype, mount.mount_point) for mount in Mounts(None, MockLogger()).mounts]
+
+    def test_mounts_from_mountinfo(self):
+        self.assertEqual([('sda1', 'part', 'ext4', '/'),
+                          ('rootvg-lv', 'lvm', 'xfs', '/mnt/data dir'),
+                          ('sdc', 'disk', 'btrfs', '/btrfs')], self.get_mounts())
+
+    def test_invalidate_cache(self):
+        self.get_mounts()
+        self.write_file(Mounts.mountinfo_path, mountinfo.splitlines()[1] + '\n')
+        self.assertEqual(3, len(self.get_mounts()))
+        Mounts.invalidate_cache()
+        self.assertEqual([('sda1', 'part', 'ext4', '/')], self.get_mounts())
+
+if __name__ == '__main__':
+    unittest.main()
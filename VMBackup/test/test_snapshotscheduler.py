@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+#
+# VM Backup extension
+#
+# Copyright 2014 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+import unittest
+import env
+import time
+from MockUtil import MockLogger
+from MockUtil import MockEnvironment
+from fakeblobstorage import FakeBlobStorage
+from common import CommonVariables
+from HttpUtil import HttpUtil
+from snapshotter import Snapshotter
+
+class Paras(object):
+    def __init__(self, blobs):
+        self.blobs = blobs
+        self.backup_metadata = [{'Key' : 'backupId', 'Value' : 'test'}]
+
+class TestSnapshotScheduler(unittest.TestCase):
+    def setUp(self):
+        self.environment = MockEnvironment()
+        self.environment.set_up()
+        self.storages = []
+
+    def tearDown(self):
+        for storage in self.storages:
+            storage.stop()
+        HttpUtil.connection_pool.close_all()
+        self.environment.tear_down()
+
+    def start_storage(self, **kwargs):
+        storage = FakeBlobStorage(**kwargs)
+        self.storages.append(storage)
+        if(not storage.start()):
+            self.skipTest('openssl is needed for the fake storage certificate')
+        return storage
+
+    def test_throttled_snapshots_are_retried(self):
+        storage = self.start_storage(throttle_count = 2)
+        blobs = [storage.blob_uri('disk' + str(i) + '.vhd') for i in range(0, 6)]
+        snapshotter = Snapshotter(MockLogger(), max_workers = 8, max_per_account = 2)
+        snapshot_result = snapshotter.snapshotall(Paras(blobs))
+        self.assertEqual(0, len(snapshot_result.errors))
+        self.assertEqual(6, len(storage.snapshots))
+        self.assertEqual(6 * 3, storage.request_count)
+
+    def test_in_flight_requests_are_capped_per_account(self):
+        storages = [self.start_storage(latency = 0.2), self.start_storage(latency = 0.2)]
+        blobs = []
+        for storage in storages:
+            blobs.extend([storage.blob_uri('disk' + str(i) + '.vhd') for i in range(0, 6)])
+        snapshotter = Snapshotter(MockLogger(), max_workers = 8, max_per_account = 2)
+        snapshot_result = snapshotter.snapshotall(Paras(blobs))
+        self.assertEqual(0, len(snapshot_result.errors))
+        for storage in storages:
+            self.assertEqual(6, len(storage.snapshots))
+            self.assertTrue(storage.max_in_flight <= 2)
+
+    def test_throttled_snapshots_stop_at_the_deadline(self):
+        storage = self.start_storage(throttle_count = 100)
+        blobs = [storage.blob_uri('disk' + str(i) + '.vhd') for i in range(0, 3)]
+        snapshotter = Snapshotter(MockLogger(), max_workers = 8, deadline = time.time() + 1)
+        start_time = time.time()
+        snapshot_result = snapshotter.snapshotall(Paras(blobs))
+        self.assertTrue(time.time() - start_time < 5)
+        self.assertEqual(3, len(snapshot_result.errors))
+        for snapshot_error in snapshot_result.errors:
+            self.assertEqual(CommonVariables.error_http_failure, snapshot_error.errorcode)
+            self.assertEqual(503, snapshot_error.http_status)
+
+    def test_internal_errors_are_not_retried(self):
+        storage = self.start_storage()
+        storage.inject_errors('snapshot', 3, status = 500)
+        blobs = [storage.blob_uri('disk' + str(i) + '.vhd') for i in range(0, 3)]
+        snapshotter = Snapshotter(MockLogger(), max_workers = 8)
+        snapshot_result = snapshotter.snapshotall(Paras(blobs))
+        self.assertEqual(3, len(snapshot_result.errors))
+        self.assertEqual(3, storage.comp_count['snapshot'])
+        for snapshot_error in snapshot_result.errors:
+            self.assertEqual(500, snapshot_error.http_status)
+
+if __name__ == '__main__':
+    unittest.main()
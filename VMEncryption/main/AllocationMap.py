@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+import os
+import os.path
+import re
+import struct
+from Common import CommonVariables
+
+class ExtSuperBlock(object):
+    """
+    the fields of the ext2/3/4 super block we need to locate the block bitmaps.
+    """
+    magic = 0xEF53
+    feature_compat_sparse_super2 = 0x200
+    feature_incompat_meta_bg = 0x10
+    feature_incompat_64bit = 0x80
+    # filetype, extents, 64bit, mmp, flex_bg, ea_inode, dirdata, csum_seed,
+    # largedir, inline_data, encrypt and casefold leave the block bitmaps as
+    # we read them. compression, a journal needing recovery, an external
+    # journal device and meta_bg do not.
+    feature_incompat_supported = 0x2 | 0x40 | 0x80 | 0x100 | 0x200 | 0x400 | 0x1000 | 0x2000 | 0x4000 | 0x8000 | 0x10000 | 0x20000
+    feature_ro_compat_sparse_super = 0x1
+    feature_ro_compat_gdt_csum = 0x10
+    feature_ro_compat_bigalloc = 0x200
+    feature_ro_compat_metadata_csum = 0x400
+
+    def __init__(self, data):
+        (self.inodes_count, self.blocks_count_lo) = struct.unpack_from('<II', data, 0x0)
+        (self.first_data_block, self.log_block_size) = struct.unpack_from('<II', data, 0x14)
+        (self.blocks_per_group,) = struct.unpack_from('<I', data, 0x20)
+        (self.inodes_per_group,) = struct.unpack_from('<I', data, 0x28)
+        (self.s_magic,) = struct.unpack_from('<H', data, 0x38)
+        (self.rev_level,) = struct.unpack_from('<I', data, 0x4C)
+        (self.inode_size,) = struct.unpack_from('<H', data, 0x58)
+        (self.feature_compat, self.feature_incompat, self.feature_ro_compat) = struct.unpack_from('<III', data, 0x5C)
+        (self.reserved_gdt_blocks,) = struct.unpack_from('<H', data, 0xCE)
+        (self.desc_size,) = struct.unpack_from('<H', data, 0xFE)
+        (self.blocks_count_hi,) = struct.unpack_from('<I', data, 0x150)
+        self.backup_bgs = struct.unpack_from('<II', data, 0x24C)
+
+        if(self.rev_level == 0):
+            self.inode_size = 128
+        self.block_size = 1024 << self.log_block_size
+        self.blocks_count = self.blocks_count_lo
+        if(self.feature_incompat & self.feature_incompat_64bit):
+            self.blocks_count |= (self.blocks_count_hi << 32)
+        else:
+            self.desc_size = 32
+        self.group_count = (self.blocks_count - self.first_data_block + self.blocks_per_group - 1) / self.blocks_per_group
+
+    def is_valid(self):
+        return self.s_magic == self.magic and self.blocks_per_group > 0 and self.log_block_size <= 6
+
+    def block_uninit_supported(self):
+        return (self.feature_ro_compat & (self.feature_ro_compat_gdt_csum | self.feature_ro_compat_metadata_csum)) != 0
+
+    def has_super_block_backup(self, group):
+        if(group == 0):
+            return True
+        if(self.feature_compat & self.feature_compat_sparse_super2):
+            return group in self.backup_bgs
+        if(not (self.feature_ro_compat & self.feature_ro_compat_sparse_super)):
+            return True
+        if(group == 1):
+            return True
+        for base in [3, 5, 7]:
+            power = base
+            while(power < group):
+                power *= base
+            if(power == group):
+                return True
+        return False
+
+class AllocationMap(object):
+    """
+    a map of the device in chunks of chunk_size bytes, a chunk is allocated
+    when any file system block inside it is in use.
+    the chunks which are not allocated do not need to be copied, the file
+    system treats their content as garbage anyway.
+    """
+    block_uninit_flag = 0x2
+
+    def __init__(self, device_size, chunk_size=CommonVariables.allocation_map_chunk_size, chunks=None):
+        self.device_size = device_size
+        self.chunk_size = chunk_size
+        chunk_count = (device_size + chunk_size - 1) / chunk_size
+        if(chunks is None):
+            chunks = bytearray(chunk_count)
+        self.chunks = chunks
+
+    def mark_allocated(self, offset, length):
+        if(length <= 0):
+            return
+        first_chunk = max(offset, 0) / self.chunk_size
+        last_chunk = min((offset + length - 1) / self.chunk_size, len(self.chunks) - 1)
+        for chunk_index in range(first_chunk, last_chunk + 1):
+            self.chunks[chunk_index] = 1
+
+    def get_allocated_size(self):
+        return self.chunks.count(b"\x01") * self.chunk_size
+
+    def get_allocated_extents(self, offset, length):
+        """
+        returns the merged (offset, length) ranges inside [offset, offset + length) which must be copied.
+        """
+        extents = []
+        end = offset + length
+        chunk_index = offset / self.chunk_size
+        while(chunk_index * self.chunk_size < end):
+            if(chunk_index >= len(self.chunks) or self.chunks[chunk_index]):
+                extent_start = max(chunk_index * self.chunk_size, offset)
+                extent_end = min((chunk_index + 1) * self.chunk_size, end)
+                if(len(extents) > 0 and extents[-1][0] + extents[-1][1] == extent_start):
+                    extents[-1] = (extents[-1][0], extent_end - extents[-1][0])
+                else:
+                    extents.append((extent_start, extent_end - extent_start))
+            chunk_index += 1
+        return extents
+
+    def save(self, file_path):
+        with open(file_path, 'wb') as f:
+            f.write(struct.pack('<QQ', self.device_size, self.chunk_size))
+            f.write(self.chunks)
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def load(file_path):
+        with open(file_path, 'rb') as f:
+            (device_size, chunk_size) = struct.unpack('<QQ', f.read(16))
+            chunks = bytearray(f.read())
+        allocation_map = AllocationMap(device_size, chunk_size)
+        if(len(chunks) != len(allocation_map.chunks)):
+            raise ValueError("allocation map {0} is truncated".format(file_path))
+        allocation_map.chunks = chunks
+        return allocation_map
+
+    @staticmethod
+    def create_reader(dev_path, overlay_file_path=None):
+        """
+        returns read_at(offset, length) for dev_path, the beginning of the
+        device is served from overlay_file_path when it is given, that is
+        where the header slice is kept once the luks header overwrote it.
+        """
+        overlay_size = 0
+        if(overlay_file_path is not None):
+            overlay_size = os.path.getsize(overlay_file_path)
+
+        def read_at(offset, length):
+            if(offset + length <= overlay_size):
+                path = overlay_file_path
+            else:
+                path = dev_path
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(length)
+            if(len(data) != length):
+                raise IOError("short read from {0} at {1}".format(path, offset))
+            return data
+        return read_at
+
+    @staticmethod
+    def from_ext_file_system(read_at, device_size, logger, chunk_size=CommonVariables.allocation_map_chunk_size):
+        """
+        builds the map from the block bitmaps of an ext2/3/4 file system.
+        returns None when the file system layout is not one we understand,
+        the caller should copy the whole device then.
+        """
+        super_block = ExtSuperBlock(read_at(1024, 1024))
+        if(not super_block.is_valid()):
+            logger.log(msg="no ext file system super block found", level=CommonVariables.WarningLevel)
+            return None
+        unsupported_incompat = super_block.feature_incompat & ~ExtSuperBlock.feature_incompat_supported
+        if(unsupported_incompat != 0):
+            logger.log(msg="incompat features {0:#x} are not supported for the allocation map".format(unsupported_incompat), level=CommonVariables.WarningLevel)
+            return None
+        if(super_block.feature_ro_compat & ExtSuperBlock.feature_ro_compat_bigalloc):
+            # a bitmap bit is a cluster then, not a block.
+            logger.log(msg="bigalloc file systems are not supported for the allocation map", level=CommonVariables.WarningLevel)
+            return None
+
+        block_size = super_block.block_size
+        allocation_map = AllocationMap(device_size, chunk_size)
+        file_system_size = super_block.blocks_count * block_size
+        if(file_system_size > device_size):
+            logger.log(msg="file system size {0} is bigger than the device size {1}".format(file_system_size, device_size), level=CommonVariables.WarningLevel)
+            return None
+
+        # everything after the file system, and the boot area before the first group, is copied as is.
+        allocation_map.mark_allocated(file_system_size, device_size - file_system_size)
+        allocation_map.mark_allocated(0, (super_block.first_data_block + 1) * block_size)
+
+        gdt_blocks = (super_block.group_count * super_block.desc_size + block_size - 1) / block_size
+        inode_table_blocks = (super_block.inodes_per_group * super_block.inode_size + block_size - 1) / block_size
+        gdt_offset = (super_block.first_data_block + 1) * block_size
+        gdt = read_at(gdt_offset, gdt_blocks * block_size)
+        honor_block_uninit = super_block.block_uninit_supported()
+        non_zero_bytes = re.compile('[^\x00]+')
+
+        for group in range(0, super_block.group_count):
+            descriptor_offset = group * super_block.desc_size
+            (block_bitmap, inode_bitmap, inode_table) = struct.unpack_from('<III', gdt, descriptor_offset)
+            (bg_flags,) = struct.unpack_from('<H', gdt, descriptor_offset + 0x12)
+            if(super_block.desc_size >= 64):
+                (block_bitmap_hi, inode_bitmap_hi, inode_table_hi) = struct.unpack_from('<III', gdt, descriptor_offset + 0x20)
+                block_bitmap |= (block_bitmap_hi << 32)
+                inode_bitmap |= (inode_bitmap_hi << 32)
+                inode_table |= (inode_table_hi << 32)
+
+            group_first_block = super_block.first_data_block + group * super_block.blocks_per_group
+            group_blocks = min(super_block.blocks_per_group, super_block.blocks_count - group_first_block)
+
+            # the group metadata is always copied, whatever the bitmap says.
+            if(super_block.has_super_block_backup(group)):
+                allocation_map.mark_allocated(group_first_block * block_size, (1 + gdt_blocks + super_block.reserved_gdt_blocks) * block_size)
+            allocation_map.mark_allocated(block_bitmap * block_size, block_size)
+            allocation_map.mark_allocated(inode_bitmap * block_size, block_size)
+            allocation_map.mark_allocated(inode_table * block_size, inode_table_blocks * block_size)
+
+            if(honor_block_uninit and (bg_flags & AllocationMap.block_uninit_flag)):
+                continue
+
+            bitmap = read_at(block_bitmap * block_size, block_size)
+            for used_bytes in non_zero_bytes.finditer(bitmap):
+                first_block = used_bytes.start() * 8
+                if(first_block >= group_blocks):
+                    break
+                last_block = min(used_bytes.end() * 8, group_blocks)
+                allocation_map.mark_allocated((group_first_block + first_block) * block_size, (last_block - first_block) * block_size)
+
+        logger.log("allocation map of {0} bytes device has {1} bytes allocated".format(device_size, allocation_map.get_allocated_size()))
+        return allocation_map
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+import os
+import os.path
+import re
+
+class BlockDeviceInventory(object):
+    """
+    a snapshot of the block devices, built from the device items of one lsblk
+    call, the parents and the scsi ids are read from sysfs.
+    the snapshot is not refreshed, it has to be built again after anything
+    changes the devices, say a mount, an umount or a luksOpen.
+    """
+    scsi_id_pattern = re.compile(r'^\d+:\d+:\d+:\d+$')
+
+    def __init__(self, device_items, sys_block_root='/sys/class/block'):
+        self.sys_block_root = sys_block_root
+        # the device items in the lsblk order, a device with several parents is listed once.
+        self.device_items = []
+        self.items_by_name = {}
+        self.items_by_uuid = {}
+        for device_item in device_items:
+            if(device_item.name in self.items_by_name):
+                continue
+            self.device_items.append(device_item)
+            self.items_by_name[device_item.name] = device_item
+            if(device_item.uuid is not None and device_item.uuid != ""):
+                self.items_by_uuid.setdefault(device_item.uuid.lower(), device_item)
+
+        # lsblk names the device mapper devices by their mapper name, sysfs by the kernel name.
+        self.names_by_kernel_name = {}
+        self.kernel_names_by_name = {}
+        self.parents = {}
+        self.children = {}
+        self.items_by_scsi_id = {}
+        if(os.path.isdir(self.sys_block_root)):
+            kernel_names = os.listdir(self.sys_block_root)
+        else:
+            kernel_names = []
+        for kernel_name in kernel_names:
+            name = self.read_sys_file(kernel_name, 'dm/name')
+            if(name is None or name == ""):
+                name = kernel_name
+            self.names_by_kernel_name[kernel_name] = name
+            self.kernel_names_by_name[name] = kernel_name
+        for kernel_name in kernel_names:
+            name = self.names_by_kernel_name[kernel_name]
+            for parent_name in self.read_parent_names(kernel_name):
+                self.parents.setdefault(name, []).append(parent_name)
+                self.children.setdefault(parent_name, []).append(name)
+            scsi_id = self.read_scsi_id(kernel_name)
+            if(scsi_id is not None and name in self.items_by_name):
+                self.items_by_scsi_id[scsi_id] = self.items_by_name[name]
+
+    def read_sys_file(self, kernel_name, relative_path):
+        try:
+            with open(os.path.join(self.sys_block_root, kernel_name, relative_path), 'r') as f:
+                return f.read().strip()
+        except IOError:
+            return None
+
+    def read_parent_names(self, kernel_name):
+        """
+        a partition has the whole disk as its parent, a device mapper or a raid device has its slaves.
+        """
+        sys_block_path = os.path.join(self.sys_block_root, kernel_name)
+        slaves_path = os.path.join(sys_block_path, 'slaves')
+        if(os.path.isdir(slaves_path)):
+            slaves = os.listdir(slaves_path)
+            if(len(slaves) > 0):
+                return [self.names_by_kernel_name.get(slave, slave) for slave in sorted(slaves)]
+        if(os.path.exists(os.path.join(sys_block_path, 'partition'))):
+            disk_kernel_name = os.path.basename(os.path.dirname(os.path.realpath(sys_block_path)))
+            return [self.names_by_kernel_name.get(disk_kernel_name, disk_kernel_name)]
+        return []
+
+    def read_scsi_id(self, kernel_name):
+        """
+        the device link of a scsi disk points to its host:channel:target:lun directory.
+        """
+        device_path = os.path.join(self.sys_block_root, kernel_name, 'device')
+        if(not os.path.exists(device_path)):
+            return None
+        scsi_id = os.path.basename(os.path.realpath(device_path))
+        if(self.scsi_id_pattern.match(scsi_id)):
+            return scsi_id
+        return None
+
+    def resolve_name(self, dev_path):
+        """
+        returns the lsblk name of a device name or a path under /dev, the
+        symlinks like /dev/disk/by-uuid are followed.
+        """
+        if(dev_path in self.items_by_name):
+            return dev_path
+        for candidate_path in [dev_path, os.path.join('/dev', dev_path), os.path.join('/dev/mapper', dev_path)]:
+            if(os.path.exists(candidate_path)):
+                kernel_name = os.path.basename(os.path.realpath(candidate_path))
+                return self.names_by_kernel_name.get(kernel_name, kernel_name)
+        return os.path.basename(dev_path)
+
+    def get_item(self, dev_path):
+        return self.items_by_name.get(self.resolve_name(dev_path))
+
+    def get_item_by_uuid(self, uuid):
+        if(uuid is None):
+            return None
+        return self.items_by_uuid.get(uuid.lower())
+
+    def get_item_by_scsi_id(self, scsi_id):
+        """
+        scsi_id is host:channel:target:lun, the brackets lsscsi prints are accepted too.
+        """
+        return self.items_by_scsi_id.get(scsi_id.strip().strip('[]'))
+
+    def get_parents(self, dev_path):
+        return [self.items_by_name[name] for name in self.parents.get(self.resolve_name(dev_path), []) if name in self.items_by_name]
+
+    def get_children(self, dev_path):
+        return [self.items_by_name[name] for name in self.children.get(self.resolve_name(dev_path), []) if name in self.items_by_name]
+
+    def get_items(self, dev_path=None):
+        """
+        the same as lsblk on dev_path, the device followed by all the devices
+        on top of it, or all the devices when dev_path is None.
+        """
+        if(dev_path is None):
+            return list(self.device_items)
+        name = self.resolve_name(dev_path)
+        if(name not in self.items_by_name):
+            return []
+        names = set([name])
+        pending_names = [name]
+        while(len(pending_names) > 0):
+            for child_name in self.children.get(pending_names.pop(), []):
+                if(child_name not in names):
+                    names.add(child_name)
+                    pending_names.append(child_name)
+        return [device_item for device_item in self.device_items if device_item.name in names]
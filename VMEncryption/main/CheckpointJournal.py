@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+import json
+import os
+import os.path
+import zlib
+from Common import CommonVariables
+
+class CheckpointJournal(object):
+    """
+    an append only journal of key value changes.
+    every record is one line "<crc32> <json of the changed keys>", the state
+    is the replay of all the records, the first record after a compaction
+    holds the whole state.
+    a torn or corrupted record ends the replay, so after a crash we get the
+    state of the last record which was completely written.
+    """
+    def __init__(self, file_path, logger, fsync=True, compact_threshold=CommonVariables.ongoing_item_journal_compact_records):
+        self.file_path = file_path
+        self.logger = logger
+        self.fsync = fsync
+        self.compact_threshold = compact_threshold
+        self.state = None
+        self.record_count = 0
+        self.valid_length = 0
+
+    def exists(self):
+        return os.path.exists(self.file_path)
+
+    @staticmethod
+    def encode_record(values):
+        payload = json.dumps(values, sort_keys=True, separators=(',', ':'))
+        return "{0:08x} {1}\n".format(zlib.crc32(payload) & 0xffffffff, payload)
+
+    @staticmethod
+    def decode_record(line):
+        if(not line.endswith("\n") or len(line) < 10 or line[8] != ' '):
+            return None
+        payload = line[9:-1]
+        try:
+            if(int(line[:8], 16) != (zlib.crc32(payload) & 0xffffffff)):
+                return None
+            values = json.loads(payload)
+        except ValueError:
+            return None
+        if(not isinstance(values, dict)):
+            return None
+        return values
+
+    def load(self):
+        """
+        returns the state dict of the last valid record, an empty dict when there is no journal.
+        """
+        if(self.state is not None):
+            return self.state
+        self.state = {}
+        self.record_count = 0
+        self.valid_length = 0
+        if(not self.exists()):
+            return self.state
+        with open(self.file_path, 'rb') as journal_file:
+            for line in journal_file:
+                values = CheckpointJournal.decode_record(line)
+                if(values is None):
+                    self.logger.log(msg="the journal {0} has an invalid record at {1}, dropping the rest.".format(self.file_path, self.valid_length), level=CommonVariables.WarningLevel)
+                    break
+                self.state.update(values)
+                self.record_count += 1
+                self.valid_length += len(line)
+        return self.state
+
+    def append(self, values):
+        """
+        values are the keys which changed, only the difference to the current state is written.
+        """
+        state = self.load()
+        changes = dict((key, value) for (key, value) in values.items() if state.get(key) != value)
+        if(len(changes) == 0):
+            return
+        if(self.record_count == 0 or self.record_count >= self.compact_threshold):
+            # the first record must carry the whole state, it may have been loaded from elsewhere.
+            state.update(changes)
+            self.compact()
+            return
+        record = CheckpointJournal.encode_record(changes)
+        with open(self.file_path, 'ab') as journal_file:
+            if(journal_file.tell() != self.valid_length):
+                # cut the torn record, otherwise the new one would be glued to it.
+                journal_file.truncate(self.valid_length)
+                journal_file.seek(self.valid_length)
+            journal_file.write(record)
+            journal_file.flush()
+            if(self.fsync):
+                os.fsync(journal_file.fileno())
+        state.update(changes)
+        self.record_count += 1
+        self.valid_length += len(record)
+
+    def compact(self):
+        """
+        rewrite the journal as one record with the whole state, the rename makes it atomic.
+        """
+        state = self.load()
+        record = CheckpointJournal.encode_record(state)
+        temp_file_path = self.file_path + ".tmp"
+        with open(temp_file_path, 'wb') as journal_file:
+            journal_file.write(record)
+            journal_file.flush()
+            if(self.fsync):
+                os.fsync(journal_file.fileno())
+        os.rename(temp_file_path, self.file_path)
+        if(self.fsync):
+            directory_fd = os.open(os.path.dirname(self.file_path) or '.', os.O_RDONLY)
+            try:
+                os.fsync(directory_fd)
+            finally:
+                os.close(directory_fd)
+        self.record_count = 1
+        self.valid_length = len(record)
+
+    def reset(self):
+        """
+        forget the cached state, the next load reads the file again.
+        """
+        self.state = None
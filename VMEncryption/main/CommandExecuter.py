@@ -19,21 +19,140 @@
 # Requires Python 2.7+
 #
 
+import errno
 import subprocess
 import os
 import os.path
 import shlex
+import signal
 import sys
+import threading
+import time
 from subprocess import *
+from Common import CommonVariables
+
+class CommandResult(object):
+    """
+    the outcome of one external command, the times are in seconds and
+    max_rss is in kilobytes, stdout and stderr are None unless captured.
+    """
+    def __init__(self, command):
+        self.command = command
+        self.return_code = None
+        self.stdout = None
+        self.stderr = None
+        self.wall_time = 0.0
+        self.user_time = 0.0
+        self.system_time = 0.0
+        self.max_rss = 0
+        self.timed_out = False
+
+    def __str__(self):
+        return "{0} returned {1}{2} in {3:.2f}s, user {4:.2f}s, sys {5:.2f}s, max rss {6}KB"\
+                .format(self.command, self.return_code, " (timed out)" if self.timed_out else "", self.wall_time, self.user_time, self.system_time, self.max_rss)
 
 class CommandExecuter(object):
-    """description of class"""
+    """
+    runs the external commands, every command is timed and its resource
+    usage is taken from wait4, so it is only the one of that command even
+    when the devices are encrypted in parallel threads.
+    the commands are also recorded in the PhaseTimeline set for the thread,
+    the timeline is shared by all the executers running in that thread.
+    """
+    local = threading.local()
+
     def __init__(self,logger):
         self.logger = logger
 
-    def Execute(self,command_to_execute):
+    def set_timeline(self, timeline):
+        CommandExecuter.local.timeline = timeline
+
+    def get_timeline(self):
+        return getattr(CommandExecuter.local, 'timeline', None)
+
+    def Execute(self,command_to_execute,timeout=None):
         self.logger.log("Executing: {0}".format(command_to_execute))
         args = shlex.split(command_to_execute)
-        proc = Popen(args)
-        returnCode = proc.wait()
-        return returnCode
+        return self.Run(args, timeout=timeout).return_code
+
+    def Run(self, args, timeout=None, capture_output=False, stdin=None, shell=False):
+        """
+        args is the argument list, or the command line when shell is True.
+        a command still running after timeout seconds is killed, None waits forever.
+        a shell command runs in its own session, so the commands it started are killed with it.
+        returns a CommandResult.
+        """
+        if(shell):
+            result = CommandResult(args)
+        else:
+            result = CommandResult(" ".join(args))
+        output_pipe = None
+        if(capture_output):
+            output_pipe = subprocess.PIPE
+        start_time = time.time()
+        preexec_fn = None
+        if(shell):
+            preexec_fn = os.setsid
+        proc = Popen(args, stdin=stdin, stdout=output_pipe, stderr=output_pipe, shell=shell, preexec_fn=preexec_fn)
+
+        outputs = {}
+        def read_output(name, stream):
+            outputs[name] = stream.read()
+
+        readers = []
+        if(capture_output):
+            for (name, stream) in [('stdout', proc.stdout), ('stderr', proc.stderr)]:
+                reader = threading.Thread(target=read_output, args=(name, stream))
+                reader.daemon = True
+                reader.start()
+                readers.append(reader)
+
+        wait_results = []
+        def wait():
+            while(True):
+                try:
+                    wait_results.append(os.wait4(proc.pid, 0))
+                    return
+                except OSError as e:
+                    if(e.errno != errno.EINTR):
+                        return
+
+        waiter = threading.Thread(target=wait)
+        waiter.daemon = True
+        waiter.start()
+        waiter.join(timeout)
+        if(waiter.is_alive()):
+            result.timed_out = True
+            self.logger.log(msg="{0} did not finish in {1}s, killing it.".format(result.command, timeout), level=CommonVariables.WarningLevel)
+            try:
+                if(shell):
+                    os.killpg(proc.pid, signal.SIGKILL)
+                else:
+                    proc.kill()
+            except OSError:
+                pass
+            waiter.join()
+        for reader in readers:
+            reader.join()
+        result.wall_time = time.time() - start_time
+
+        if(len(wait_results) > 0):
+            (pid, status, rusage) = wait_results[0]
+            if(os.WIFSIGNALED(status)):
+                proc.returncode = -os.WTERMSIG(status)
+            else:
+                proc.returncode = os.WEXITSTATUS(status)
+            result.user_time = rusage.ru_utime
+            result.system_time = rusage.ru_stime
+            result.max_rss = rusage.ru_maxrss
+        else:
+            proc.wait()
+        result.return_code = proc.returncode
+        result.stdout = outputs.get('stdout')
+        result.stderr = outputs.get('stderr')
+
+        self.logger.log(str(result))
+        timeline = self.get_timeline()
+        if(timeline is not None):
+            timeline.add_command(result)
+        return result
@@ -33,6 +33,36 @@ class CommonVariables:
     sector_size = 512
     luks_header_size = 4096 * 512
     default_block_size = 52428800
+    copy_use_direct_io = True
+    copy_pipeline_depth = 2
+    slice_copier_cached_buffers = 2
+    allocation_map_chunk_size = 1048576
+    # the in-place copy is not idempotent, a checkpoint must be durable before the slice backup is dropped.
+    ongoing_item_journal_fsync = True
+    ongoing_item_journal_compact_records = 1024
+    adaptive_slice_min_size = 8388608
+    adaptive_slice_max_size = 536870912
+    adaptive_slice_samples_per_step = 3
+    adaptive_slice_improvement = 0.05
+    adaptive_slice_hold_steps = 8
+    adaptive_slice_memory_fraction = 4
+    copy_throttle_io_size = 524288
+    copy_throttle_sample_interval = 1.0
+    copy_throttle_latency_ratio = 3.0
+    copy_throttle_min_latency = 5.0
+    copy_throttle_backoff = 0.5
+    copy_throttle_recovery = 1.1
+    copy_throttle_min_bandwidth = 1048576
+    progress_report_interval = 30
+    progress_average_window = 300
+    max_parallel_devices = 4
+    # the seconds an external command could run before it is killed, None never kills it.
+    # checking and resizing a big file system could take hours and must not be interrupted.
+    mount_command_timeout = 300
+    cryptsetup_command_timeout = 600
+    filesystem_command_timeout = None
+    # the crc32 of every sub block of the backup slice is checkpointed, resume verifies the backup and the destination with them.
+    slice_checksum_block_size = 4194304
     min_filesystem_size_support = 52428800 * 3
     #TODO for the sles 11, we should use the ext3
     default_file_system = 'ext4'
@@ -52,6 +82,11 @@ class CommonVariables:
     DiskFormatQuerykey = "DiskFormatQuery"
     PassphraseKey = 'Passphrase'
     BekVolumeFileSystemKey = "BekVolumeFileSystem"
+    SkipUnallocatedBlocksKey = 'SkipUnallocatedBlocks'
+    CopyBandwidthLimitKey = 'CopyBandwidthLimitMBps'
+    CopyIopsLimitKey = 'CopyIopsLimit'
+    AdaptiveCopyThrottleKey = 'AdaptiveCopyThrottle'
+    MaxParallelDevicesKey = 'MaxParallelDevices'
 
     """
     value for VolumeType could be OS or Data
@@ -74,6 +109,11 @@ class CommonVariables:
     EncryptionDecryptionOperationKey = 'DecryptionOperation'
     EncryptionVolumeTypeKey = 'VolumeType'
     EncryptionDiskFormatQueryKey = 'DiskFormatQuery'
+    EncryptionSkipUnallocatedBlocksKey = 'SkipUnallocatedBlocks'
+    EncryptionCopyBandwidthLimitKey = 'CopyBandwidthLimitMBps'
+    EncryptionCopyIopsLimitKey = 'CopyIopsLimit'
+    EncryptionAdaptiveCopyThrottleKey = 'AdaptiveCopyThrottle'
+    EncryptionMaxParallelDevicesKey = 'MaxParallelDevices'
 
     """
     crypt ongoing item config keys
@@ -94,6 +134,12 @@ class CommonVariables:
     OngoingItemCurrentLuksHeaderFilePathKey = 'CurrentLuksHeaderFilePath'
     OngoingItemCurrentSourcePathKey = 'CurrentSourcePath'
     OngoingItemCurrentBlockSizeKey = 'CurrentBlockSize'
+    OngoingItemAllocationMapFilePathKey = 'AllocationMapFilePath'
+    OngoingItemCopiedSizeKey = 'CopiedSize'
+    OngoingItemBackupSliceOffsetKey = 'BackupSliceOffset'
+    OngoingItemBackupSliceSizeKey = 'BackupSliceSize'
+    OngoingItemAdaptiveBlockSizeKey = 'AdaptiveBlockSize'
+    OngoingItemBackupSliceChecksumsKey = 'BackupSliceChecksums'
 
     """
     encryption phase devinitions
@@ -122,6 +168,7 @@ class CommonVariables:
     """
     extension_success_status = 'success'
     extension_error_status = 'error'
+    extension_transitioning_status = 'transitioning'
     process_success = 0
     success = 0
     os_not_supported = 1
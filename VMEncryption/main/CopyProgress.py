@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+import threading
+import time
+from collections import deque
+from Common import CommonVariables
+
+class CopyProgress(object):
+    """
+    the progress of the copy of one device.
+    the current throughput is the one since the previous update, the average
+    is over the last average_window seconds, the eta is based on the average.
+    """
+    def __init__(self, device, total_size, copied_size=0, average_window=CommonVariables.progress_average_window):
+        self.device = device
+        self.total_size = total_size
+        self.copied_size = copied_size
+        self.average_window = average_window
+        now = time.time()
+        self.samples = deque([(now, copied_size)])
+        self.current_throughput = None
+
+    def update(self, copied_size):
+        now = time.time()
+        (last_time, last_copied_size) = self.samples[-1]
+        if(now > last_time):
+            self.current_throughput = (copied_size - last_copied_size) / (now - last_time)
+        self.copied_size = copied_size
+        self.samples.append((now, copied_size))
+        while(len(self.samples) > 2 and self.samples[1][0] <= now - self.average_window):
+            self.samples.popleft()
+        return self
+
+    def get_average_throughput(self):
+        (first_time, first_copied_size) = self.samples[0]
+        (last_time, last_copied_size) = self.samples[-1]
+        if(last_time <= first_time):
+            return None
+        return (last_copied_size - first_copied_size) / (last_time - first_time)
+
+    def get_eta(self):
+        """
+        returns the seconds left, None when we could not tell yet.
+        """
+        average_throughput = self.get_average_throughput()
+        if(average_throughput is None or average_throughput <= 0):
+            return None
+        return (self.total_size - self.copied_size) / average_throughput
+
+    def is_done(self):
+        return self.copied_size >= self.total_size
+
+    def __str__(self):
+        def format_throughput(throughput):
+            if(throughput is None):
+                return "-"
+            return "{0:.1f}MB/s".format(throughput / 1048576.0)
+
+        eta = self.get_eta()
+        if(eta is None):
+            eta_str = "-"
+        else:
+            eta_str = "{0}:{1:02d}:{2:02d}".format(int(eta) / 3600, int(eta) / 60 % 60, int(eta) % 60)
+        percent = 100.0
+        if(self.total_size > 0):
+            percent = self.copied_size * 100.0 / self.total_size
+        return "{0} copied {1} of {2} bytes ({3:.1f}%), current {4}, average {5}, eta {6}"\
+                .format(self.device, self.copied_size, self.total_size, percent, format_throughput(self.current_throughput), format_throughput(self.get_average_throughput()), eta_str)
+
+class ProgressReporter(object):
+    """
+    reports the progress of the devices being copied as the transitioning
+    status of operation, at most once every interval seconds.
+    the phase timelines of the devices which are done follow the progress.
+    """
+    def __init__(self, hutil, logger, operation, interval=CommonVariables.progress_report_interval):
+        self.hutil = hutil
+        self.logger = logger
+        self.operation = operation
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.devices = {}
+        self.timelines = []
+        self.last_report_time = None
+
+    def update(self, progress):
+        """
+        a device is dropped from the report once its copy is done, that is
+        always reported so the status never stays on a finished device.
+        """
+        with self.lock:
+            now = time.time()
+            force = progress.is_done()
+            if(force):
+                self.devices.pop(progress.device, None)
+            else:
+                self.devices[progress.device] = progress
+            if(not force and self.last_report_time is not None and now - self.last_report_time < self.interval):
+                return
+            messages = [str(self.devices[device]) for device in sorted(self.devices.keys())]
+            if(force):
+                messages.insert(0, str(progress))
+            self.report(now, messages)
+
+    def add_timeline(self, timeline):
+        """
+        timeline is the PhaseTimeline of a device which is done, it is reported right away.
+        """
+        with self.lock:
+            self.timelines.append(str(timeline))
+            self.report(time.time(), [str(self.devices[device]) for device in sorted(self.devices.keys())])
+
+    def get_timelines_message(self):
+        with self.lock:
+            return "; ".join(self.timelines)
+
+    def report(self, now, messages):
+        """
+        called with the lock held.
+        """
+        self.last_report_time = now
+        message = "; ".join(messages + self.timelines)
+        try:
+            self.hutil.do_status_report(self.operation, CommonVariables.extension_transitioning_status, str(CommonVariables.success), message)
+        except Exception as e:
+            self.logger.log(msg="failed to report the copy progress: {0}".format(e), level=CommonVariables.WarningLevel)
@@ -30,6 +30,9 @@ class DecryptionMarkConfig(object):
         self.encryption_environment = encryption_environment
         self.command = None
         self.volume_type = None
+        self.copy_bandwidth_limit = None
+        self.copy_iops_limit = None
+        self.adaptive_copy_throttle = None
         self.decryption_mark_config = ConfigUtil(self.encryption_environment.azure_decrypt_request_queue_path,
                                                  'decryption_request_queue',
                                                  self.logger)
@@ -37,6 +40,15 @@ class DecryptionMarkConfig(object):
     def get_current_command(self):
         return self.decryption_mark_config.get_config(CommonVariables.EncryptionEncryptionOperationKey)
 
+    def get_copy_bandwidth_limit(self):
+        return self.decryption_mark_config.get_config(CommonVariables.EncryptionCopyBandwidthLimitKey)
+
+    def get_copy_iops_limit(self):
+        return self.decryption_mark_config.get_config(CommonVariables.EncryptionCopyIopsLimitKey)
+
+    def get_adaptive_copy_throttle(self):
+        return self.decryption_mark_config.get_config(CommonVariables.EncryptionAdaptiveCopyThrottleKey)
+
     def config_file_exists(self):
         return self.decryption_mark_config.config_file_exists()
     
@@ -49,6 +61,13 @@ class DecryptionMarkConfig(object):
         volume_type = ConfigKeyValuePair(CommonVariables.EncryptionVolumeTypeKey, self.volume_type)
         key_value_pairs.append(volume_type)
 
+        copy_bandwidth_limit = ConfigKeyValuePair(CommonVariables.EncryptionCopyBandwidthLimitKey, self.copy_bandwidth_limit)
+        key_value_pairs.append(copy_bandwidth_limit)
+        copy_iops_limit = ConfigKeyValuePair(CommonVariables.EncryptionCopyIopsLimitKey, self.copy_iops_limit)
+        key_value_pairs.append(copy_iops_limit)
+        adaptive_copy_throttle = ConfigKeyValuePair(CommonVariables.EncryptionAdaptiveCopyThrottleKey, self.adaptive_copy_throttle)
+        key_value_pairs.append(adaptive_copy_throttle)
+
         self.decryption_mark_config.save_configs(key_value_pairs)
 
     def clear_config(self):
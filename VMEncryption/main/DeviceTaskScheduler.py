@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+import threading
+import traceback
+from Common import CommonVariables
+
+class DeviceTask(object):
+    def __init__(self, name, disks, func):
+        """
+        disks are the physical disks the task does io on, tasks sharing a disk never run together.
+        """
+        self.name = name
+        self.disks = set(disks)
+        self.func = func
+        self.result = None
+        self.started = False
+
+class DeviceTaskScheduler(object):
+    """
+    runs the tasks of independent devices concurrently, at most max_concurrency at a time.
+    the tasks start in the order they were added, a task waits while an
+    earlier one on the same disk is running.
+    """
+    def __init__(self, logger, max_concurrency):
+        self.logger = logger
+        self.max_concurrency = max(1, max_concurrency)
+        self.tasks = []
+        self.condition = threading.Condition()
+
+    def add_task(self, name, disks, func):
+        self.tasks.append(DeviceTask(name, disks, func))
+
+    def run(self, succeeded):
+        """
+        succeeded(result) tells whether a task worked, after a failure no new task
+        is started, the running ones are waited for.
+        returns the tasks which were started, with their result.
+        an exception in a task is logged and becomes its result.
+        """
+        pending = list(self.tasks)
+        running = []
+        failed = [False]
+
+        def run_task(task):
+            try:
+                task.result = task.func()
+            except Exception as e:
+                self.logger.log(msg="the task of {0} failed with error: {1}, stack trace: {2}".format(task.name, e, traceback.format_exc()), level=CommonVariables.ErrorLevel)
+                task.result = e
+            with self.condition:
+                running.remove(task)
+                if(isinstance(task.result, Exception) or not succeeded(task.result)):
+                    failed[0] = True
+                self.condition.notify()
+
+        with self.condition:
+            while(len(running) > 0 or (len(pending) > 0 and not failed[0])):
+                next_task = None
+                if(not failed[0] and len(running) < self.max_concurrency):
+                    busy_disks = set()
+                    for task in running:
+                        busy_disks |= task.disks
+                    for task in pending:
+                        if(len(task.disks & busy_disks) == 0):
+                            next_task = task
+                            break
+                        # keep the order on a disk, a later task must not overtake this one.
+                        busy_disks |= task.disks
+                if(next_task is None):
+                    self.condition.wait()
+                    continue
+                pending.remove(next_task)
+                running.append(next_task)
+                next_task.started = True
+                self.logger.log("starting the task of {0} on {1}, {2} running".format(next_task.name, sorted(next_task.disks), len(running)))
+                task_thread = threading.Thread(target=run_task, args=(next_task,))
+                task_thread.daemon = True
+                task_thread.start()
+        return [task for task in self.tasks if task.started]
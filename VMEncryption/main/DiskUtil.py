@@ -28,7 +28,10 @@ from subprocess import *
 import shutil
 import uuid
 import glob
+import threading
+from CommandExecuter import CommandExecuter
 from TransactionalCopyTask import TransactionalCopyTask
+from BlockDeviceInventory import BlockDeviceInventory
 from Common import *
 
 class DiskUtil(object):
@@ -39,18 +42,26 @@ class DiskUtil(object):
         self.logger = logger
         self.ide_class_id = "{32412632-86cb-44a2-9b5c-50d1417354f5}"
         self.vmbus_sys_path = '/sys/bus/vmbus/devices'
-
-    def copy(self, ongoing_item_config):
-        copy_task = TransactionalCopyTask(logger = self.logger, disk_util = self, ongoing_item_config = ongoing_item_config, patching=self.patching, encryption_environment = self.encryption_environment)
+        # runs the external commands, and records them in the PhaseTimeline of the calling thread.
+        self.command_executer = CommandExecuter(logger)
+        # the devices could be encrypted in parallel, the crypt mount config and fstab are shared.
+        self.config_lock = threading.RLock()
+        # an IORateLimiter shared by all the copies, None copies at full speed.
+        self.copy_rate_limiter = None
+        # a ProgressReporter which the copies publish their progress to.
+        self.copy_progress_reporter = None
+        # the BlockDeviceInventory snapshot and the ide device names, built on first use.
+        self.device_inventory_lock = threading.Lock()
+        self.device_inventory = None
+        self.ide_devices = None
+
+    def copy(self, ongoing_item_config, pipelined=False, allocation_map=None):
+        copy_task = TransactionalCopyTask(logger = self.logger, disk_util = self, ongoing_item_config = ongoing_item_config, patching=self.patching, encryption_environment = ongoing_item_config.encryption_environment, pipelined = pipelined, allocation_map = allocation_map, rate_limiter = self.copy_rate_limiter, progress_reporter = self.copy_progress_reporter)
         try:
-            mem_fs_result = copy_task.prepare_mem_fs()
-            if(mem_fs_result != CommonVariables.process_success):
-                return CommonVariables.tmpfs_error
-            else:
-                returnCode = copy_task.begin_copy()
-                return returnCode
+            returnCode = copy_task.begin_copy()
+            return returnCode
         finally:
-            copy_task.clear_mem_fs()
+            copy_task.release_buffers()
 
     def format_disk(self, dev_path, file_system):
         mkfs_command = ""
@@ -65,16 +76,15 @@ class DiskUtil(object):
         mkfs_cmd = "{0} {1}".format(mkfs_command, dev_path)
         self.logger.log("command to execute:{0}".format(mkfs_cmd))
         mkfs_cmd_args = shlex.split(mkfs_cmd)
-        proc = Popen(mkfs_cmd_args)
-        returnCode = proc.wait()
+        returnCode = self.command_executer.Run(mkfs_cmd_args, timeout=CommonVariables.filesystem_command_timeout).return_code
+        self.invalidate_device_inventory()
         return returnCode
 
     def make_sure_path_exists(self,path):
         mkdir_cmd = self.patching.mkdir_path + ' -p ' + path
         self.logger.log("make sure path exists, execute:{0}".format(mkdir_cmd))
         mkdir_cmd_args = shlex.split(mkdir_cmd)
-        proc = Popen(mkdir_cmd_args)
-        returnCode = proc.wait()
+        returnCode = self.command_executer.Run(mkdir_cmd_args, timeout=CommonVariables.mount_command_timeout).return_code
         return returnCode
 
     def get_crypt_items(self):
@@ -109,70 +119,73 @@ class DiskUtil(object):
         format is like this:
         <target name> <source device> <key file> <options>
         """
-        try:
-            mount_content_item = (crypt_item.mapper_name + " " +
-                                  crypt_item.dev_path + " " +
-                                  crypt_item.luks_header_path + " " +
-                                  crypt_item.mount_point + " " +
-                                  crypt_item.file_system + " " +
-                                  str(crypt_item.uses_cleartext_key))
-
-            if os.path.exists(self.encryption_environment.azure_crypt_mount_config_path):
-                with open(self.encryption_environment.azure_crypt_mount_config_path,'r') as f:
-                    existing_content = f.read()
-                    if(existing_content is not None and existing_content.strip() != ""):
-                        new_mount_content = existing_content + "\n" + mount_content_item
-                    else:
-                        new_mount_content = mount_content_item
-            else:
-                new_mount_content = mount_content_item
-
-            with open(self.encryption_environment.azure_crypt_mount_config_path,'w') as wf:
-                wf.write('\n')
-                wf.write(new_mount_content)
-                wf.write('\n')
-            return True
-        except Exception as e:
-            return False
+        with self.config_lock:
+            try:
+                mount_content_item = (crypt_item.mapper_name + " " +
+                                      crypt_item.dev_path + " " +
+                                      crypt_item.luks_header_path + " " +
+                                      crypt_item.mount_point + " " +
+                                      crypt_item.file_system + " " +
+                                      str(crypt_item.uses_cleartext_key))
+
+                if os.path.exists(self.encryption_environment.azure_crypt_mount_config_path):
+                    with open(self.encryption_environment.azure_crypt_mount_config_path,'r') as f:
+                        existing_content = f.read()
+                        if(existing_content is not None and existing_content.strip() != ""):
+                            new_mount_content = existing_content + "\n" + mount_content_item
+                        else:
+                            new_mount_content = mount_content_item
+                else:
+                    new_mount_content = mount_content_item
+
+                with open(self.encryption_environment.azure_crypt_mount_config_path,'w') as wf:
+                    wf.write('\n')
+                    wf.write(new_mount_content)
+                    wf.write('\n')
+                return True
+            except Exception as e:
+                return False
 
     def remove_crypt_item(self, crypt_item):
-        if not os.path.exists(self.encryption_environment.azure_crypt_mount_config_path):
-            return False
+        with self.config_lock:
+            if not os.path.exists(self.encryption_environment.azure_crypt_mount_config_path):
+                return False
 
-        try:
-            mount_lines = []
+            try:
+                mount_lines = []
 
-            with open(self.encryption_environment.azure_crypt_mount_config_path, 'r') as f:
-                mount_lines = f.readlines()
+                with open(self.encryption_environment.azure_crypt_mount_config_path, 'r') as f:
+                    mount_lines = f.readlines()
 
-            filtered_mount_lines = filter(lambda line: not crypt_item.mapper_name in line, mount_lines)
+                filtered_mount_lines = filter(lambda line: not crypt_item.mapper_name in line, mount_lines)
 
-            with open(self.encryption_environment.azure_crypt_mount_config_path, 'w') as wf:
-                wf.write('\n')
-                wf.write('\n'.join(filtered_mount_lines))
-                wf.write('\n')
+                with open(self.encryption_environment.azure_crypt_mount_config_path, 'w') as wf:
+                    wf.write('\n')
+                    wf.write('\n'.join(filtered_mount_lines))
+                    wf.write('\n')
 
-            return True
+                return True
 
-        except Exception as e:
-            return False
+            except Exception as e:
+                return False
 
     def update_crypt_item(self, crypt_item):
-        self.remove_crypt_item(crypt_item)
-        self.add_crypt_item(crypt_item)
+        with self.config_lock:
+            self.remove_crypt_item(crypt_item)
+            self.add_crypt_item(crypt_item)
 
     def create_luks_header(self,mapper_name):
         luks_header_file_path = self.encryption_environment.luks_header_base_path + mapper_name
         if(os.path.exists(luks_header_file_path)):
             return luks_header_file_path
         else:
-            commandToExecute = self.patching.bash_path + ' -c "' + self.patching.dd_path + ' if=/dev/zero bs=33554432 count=1 > ' + luks_header_file_path + '"'
-            proc = Popen(commandToExecute, shell=True)
-            returnCode = proc.wait()
+            dd_args = [self.patching.dd_path, 'if=/dev/zero', 'of=' + luks_header_file_path, 'bs=33554432', 'count=1']
+            returnCode = self.command_executer.Run(dd_args, timeout=CommonVariables.cryptsetup_command_timeout).return_code
             if(returnCode == CommonVariables.process_success):
                 return luks_header_file_path
             else:
                 self.logger.log(msg=("make luks header failed and return code is:{0}".format(returnCode)), level=CommonVariables.ErrorLevel)
+                self.remove_partial_file(luks_header_file_path)
                 return None
 
     def create_cleartext_key(self, mapper_name):
@@ -180,15 +193,22 @@ class DiskUtil(object):
         if(os.path.exists(cleartext_key_file_path)):
             return cleartext_key_file_path
         else:
-            commandToExecute = self.patching.bash_path + ' -c "' + self.patching.dd_path + ' if=/dev/urandom bs=128 count=1 > ' + cleartext_key_file_path + '"'
-            proc = Popen(commandToExecute, shell=True)
-            returnCode = proc.wait()
+            dd_args = [self.patching.dd_path, 'if=/dev/urandom', 'of=' + cleartext_key_file_path, 'bs=128', 'count=1']
+            returnCode = self.command_executer.Run(dd_args, timeout=CommonVariables.cryptsetup_command_timeout).return_code
             if(returnCode == CommonVariables.process_success):
                 return cleartext_key_file_path
             else:
                 self.logger.log(msg=("dd failed with return code: {0}".format(returnCode)), level=CommonVariables.ErrorLevel)
+                self.remove_partial_file(cleartext_key_file_path)
                 return None
 
+    def remove_partial_file(self, file_path):
+        """
+        a file dd did not finish must not be taken as done the next time.
+        """
+        if(os.path.exists(file_path)):
+            os.remove(file_path)
+
     def encrypt_disk(self, dev_path, passphrase_file, mapper_name, header_file):
         returnCode = self.luks_format(passphrase_file=passphrase_file, dev_path=dev_path, header_file=header_file)
         if(returnCode != CommonVariables.process_success):
@@ -209,16 +229,14 @@ class DiskUtil(object):
         check_fs_cmd = self.patching.e2fsck_path + " -f -y " + dev_path
         self.logger.log("check fs command is:{0}".format(check_fs_cmd))
         check_fs_cmd_args = shlex.split(check_fs_cmd)
-        check_fs_cmd_p = Popen(check_fs_cmd_args)
-        returnCode = check_fs_cmd_p.wait()
+        returnCode = self.command_executer.Run(check_fs_cmd_args, timeout=CommonVariables.filesystem_command_timeout).return_code
         return returnCode
 
     def expand_fs(self, dev_path):
         expandfs_cmd = self.patching.resize2fs_path + " " + str(dev_path)
         self.logger.log("expand_fs command is:{0}".format(expandfs_cmd))
         expandfs_cmd_args = shlex.split(expandfs_cmd)
-        expandfs_p = Popen(expandfs_cmd_args)
-        returnCode = expandfs_p.wait()
+        returnCode = self.command_executer.Run(expandfs_cmd_args, timeout=CommonVariables.filesystem_command_timeout).return_code
         return returnCode
 
     def shrink_fs(self,dev_path, size_shrink_to):
@@ -228,8 +246,7 @@ class DiskUtil(object):
         shrinkfs_cmd = self.patching.resize2fs_path + ' ' + str(dev_path) + ' ' + str(size_shrink_to) + 's'
         self.logger.log("shrink_fs command is {0}".format(shrinkfs_cmd))
         shrinkfs_cmd_args = shlex.split(shrinkfs_cmd)
-        shrinkfs_p = Popen(shrinkfs_cmd_args)
-        returnCode = shrinkfs_p.wait()
+        returnCode = self.command_executer.Run(shrinkfs_cmd_args, timeout=CommonVariables.filesystem_command_timeout).return_code
         return returnCode
 
     def check_shrink_fs(self,dev_path, size_shrink_to):
@@ -247,16 +264,14 @@ class DiskUtil(object):
         self.hutil.log("dev path to cryptsetup luksFormat {0}".format(dev_path))
         #walkaround for sles sp3
         if(self.patching.distro_info[0].lower() == 'suse' and self.patching.distro_info[1] == '11'):
-            passphrase_cmd = self.patching.cat_path + ' ' + passphrase_file
-            passphrase_cmd_args = shlex.split(passphrase_cmd)
-            self.logger.log("passphrase_cmd is:{0}".format(passphrase_cmd))
-            passphrase_p = Popen(passphrase_cmd_args,stdout=subprocess.PIPE)
-
+            # the passphrase goes to the stdin of cryptsetup, the file is read as cat would.
+            self.logger.log("passphrase file is:{0}".format(passphrase_file))
             cryptsetup_cmd = "{0} luksFormat {1} -q".format(self.patching.cryptsetup_path , dev_path)
             self.logger.log("cryptsetup_cmd is:{0}".format(cryptsetup_cmd))
             cryptsetup_cmd_args = shlex.split(cryptsetup_cmd)
-            cryptsetup_p = Popen(cryptsetup_cmd_args,stdin=passphrase_p.stdout)
-            returnCode = cryptsetup_p.wait()
+            with open(passphrase_file, 'rb') as passphrase:
+                returnCode = self.command_executer.Run(cryptsetup_cmd_args, timeout=CommonVariables.cryptsetup_command_timeout, stdin=passphrase).return_code
+            self.invalidate_device_inventory()
             return returnCode
         else:
             if(header_file is not None):
@@ -265,8 +280,8 @@ class DiskUtil(object):
                 cryptsetup_cmd = "{0} luksFormat {1} -d {2} -q".format(self.patching.cryptsetup_path ,dev_path , passphrase_file)
             self.logger.log("cryptsetup_cmd is:" + cryptsetup_cmd)
             cryptsetup_cmd_args = shlex.split(cryptsetup_cmd)
-            cryptsetup_p = Popen(cryptsetup_cmd_args)
-            returnCode = cryptsetup_p.wait()
+            returnCode = self.command_executer.Run(cryptsetup_cmd_args, timeout=CommonVariables.cryptsetup_command_timeout).return_code
+            self.invalidate_device_inventory()
             return returnCode
         
     def luks_add_cleartext_key(self, passphrase_file, dev_path, mapper_name, header_file):
@@ -288,8 +303,7 @@ class DiskUtil(object):
 
         self.logger.log("cryptsetup_cmd is: " + cryptsetup_cmd)
         cryptsetup_cmd_args = shlex.split(cryptsetup_cmd)
-        cryptsetup_p = Popen(cryptsetup_cmd_args)
-        returnCode = cryptsetup_p.wait()
+        returnCode = self.command_executer.Run(cryptsetup_cmd_args, timeout=CommonVariables.cryptsetup_command_timeout).return_code
         return returnCode
 
     def luks_open(self, passphrase_file, dev_path, mapper_name, header_file, uses_cleartext_key):
@@ -309,8 +323,8 @@ class DiskUtil(object):
             cryptsetup_cmd = "{0} luksOpen {1} {2} -d {3} -q".format(self.patching.cryptsetup_path , dev_path , mapper_name , passphrase_file)
         self.logger.log("cryptsetup_cmd is:" + cryptsetup_cmd)
         cryptsetup_cmd_args = shlex.split(cryptsetup_cmd)
-        cryptsetup_p = Popen(cryptsetup_cmd_args)
-        returnCode = cryptsetup_p.wait()
+        returnCode = self.command_executer.Run(cryptsetup_cmd_args, timeout=CommonVariables.cryptsetup_command_timeout).return_code
+        self.invalidate_device_inventory()
         return returnCode
 
     def luks_close(self, mapper_name):
@@ -321,92 +335,95 @@ class DiskUtil(object):
         cryptsetup_cmd = "{0} luksClose {1} -q".format(self.patching.cryptsetup_path, mapper_name)
         self.logger.log("cryptsetup_cmd is:" + cryptsetup_cmd)
         cryptsetup_cmd_args = shlex.split(cryptsetup_cmd)
-        cryptsetup_p = Popen(cryptsetup_cmd_args)
-        returnCode = cryptsetup_p.wait()
+        returnCode = self.command_executer.Run(cryptsetup_cmd_args, timeout=CommonVariables.cryptsetup_command_timeout).return_code
+        self.invalidate_device_inventory()
         return returnCode
 
     #TODO error handling.
     def append_mount_info(self, dev_path, mount_point):
-        shutil.copy2('/etc/fstab', '/etc/fstab.backup.' + str(str(uuid.uuid4())))
-        mount_content_item = dev_path + " " + mount_point + "  auto defaults 0 0"
-        new_mount_content = ""
-        with open("/etc/fstab",'r') as f:
-            existing_content = f.read()
-            new_mount_content = existing_content + "\n" + mount_content_item
-        with open("/etc/fstab",'w') as wf:
-            wf.write(new_mount_content)
+        with self.config_lock:
+            shutil.copy2('/etc/fstab', '/etc/fstab.backup.' + str(str(uuid.uuid4())))
+            mount_content_item = dev_path + " " + mount_point + "  auto defaults 0 0"
+            new_mount_content = ""
+            with open("/etc/fstab",'r') as f:
+                existing_content = f.read()
+                new_mount_content = existing_content + "\n" + mount_content_item
+            with open("/etc/fstab",'w') as wf:
+                wf.write(new_mount_content)
 
     def remove_mount_info(self, mount_point):
-        if not mount_point:
-            self.logger.log("remove_mount_info: mount_point is empty")
-            return
+        with self.config_lock:
+            if not mount_point:
+                self.logger.log("remove_mount_info: mount_point is empty")
+                return
 
-        shutil.copy2('/etc/fstab', '/etc/fstab.backup.' + str(str(uuid.uuid4())))
+            shutil.copy2('/etc/fstab', '/etc/fstab.backup.' + str(str(uuid.uuid4())))
 
-        filtered_contents = []
-        removed_lines = []
+            filtered_contents = []
+            removed_lines = []
 
-        with open('/etc/fstab', 'r') as f:
-            for line in f.readlines():
-                line = line.strip()
-                pattern = '\s' + re.escape(mount_point) + '\s'
+            with open('/etc/fstab', 'r') as f:
+                for line in f.readlines():
+                    line = line.strip()
+                    pattern = '\s' + re.escape(mount_point) + '\s'
 
-                if re.search(pattern, line):
-                    self.logger.log("removing fstab line: {0}".format(line))
-                    removed_lines.append(line)
-                    continue
+                    if re.search(pattern, line):
+                        self.logger.log("removing fstab line: {0}".format(line))
+                        removed_lines.append(line)
+                        continue
 
-                filtered_contents.append(line)
+                    filtered_contents.append(line)
 
-        with open('/etc/fstab', 'w') as f:
-            f.write('\n')
-            f.write('\n'.join(filtered_contents))
-            f.write('\n')
+            with open('/etc/fstab', 'w') as f:
+                f.write('\n')
+                f.write('\n'.join(filtered_contents))
+                f.write('\n')
 
-        self.logger.log("fstab updated successfully")
+            self.logger.log("fstab updated successfully")
 
-        with open('/etc/fstab.azure.backup', 'a+') as f:
-            f.write('\n')
-            f.write('\n'.join(removed_lines))
-            f.write('\n')
+            with open('/etc/fstab.azure.backup', 'a+') as f:
+                f.write('\n')
+                f.write('\n'.join(removed_lines))
+                f.write('\n')
 
-        self.logger.log("fstab.azure.backup updated successfully")
+            self.logger.log("fstab.azure.backup updated successfully")
 
     def restore_mount_info(self, mount_point):
-        if not mount_point:
-            self.logger.log("restore_mount_info: mount_point is empty")
-            return
+        with self.config_lock:
+            if not mount_point:
+                self.logger.log("restore_mount_info: mount_point is empty")
+                return
 
-        shutil.copy2('/etc/fstab', '/etc/fstab.backup.' + str(str(uuid.uuid4())))
+            shutil.copy2('/etc/fstab', '/etc/fstab.backup.' + str(str(uuid.uuid4())))
 
-        filtered_contents = []
-        removed_lines = []
+            filtered_contents = []
+            removed_lines = []
 
-        with open('/etc/fstab.azure.backup', 'r') as f:
-            for line in f.readlines():
-                line = line.strip()
-                pattern = '\s' + re.escape(mount_point) + '\s'
+            with open('/etc/fstab.azure.backup', 'r') as f:
+                for line in f.readlines():
+                    line = line.strip()
+                    pattern = '\s' + re.escape(mount_point) + '\s'
 
-                if re.search(pattern, line):
-                    self.logger.log("removing fstab.azure.backup line: {0}".format(line))
-                    removed_lines.append(line)
-                    continue
+                    if re.search(pattern, line):
+                        self.logger.log("removing fstab.azure.backup line: {0}".format(line))
+                        removed_lines.append(line)
+                        continue
 
-                filtered_contents.append(line)
+                    filtered_contents.append(line)
 
-        with open('/etc/fstab.azure.backup', 'w') as f:
-            f.write('\n')
-            f.write('\n'.join(filtered_contents))
-            f.write('\n')
+            with open('/etc/fstab.azure.backup', 'w') as f:
+                f.write('\n')
+                f.write('\n'.join(filtered_contents))
+                f.write('\n')
 
-        self.logger.log("fstab.azure.backup updated successfully")
+            self.logger.log("fstab.azure.backup updated successfully")
 
-        with open('/etc/fstab', 'a+') as f:
-            f.write('\n')
-            f.write('\n'.join(removed_lines))
-            f.write('\n')
+            with open('/etc/fstab', 'a+') as f:
+                f.write('\n')
+                f.write('\n'.join(removed_lines))
+                f.write('\n')
 
-        self.logger.log("fstab updated successfully")
+            self.logger.log("fstab updated successfully")
 
     def mount_filesystem(self,dev_path,mount_point,file_system=None):
         """
@@ -417,14 +434,13 @@ class DiskUtil(object):
             mount_cmd = self.patching.mount_path + ' ' + dev_path + ' ' + mount_point
             self.logger.log("mount file system, execute:{0}".format(mount_cmd))
             mount_cmd_args = shlex.split(mount_cmd)
-            proc = Popen(mount_cmd_args)
-            returnCode = proc.wait()
+            returnCode = self.command_executer.Run(mount_cmd_args, timeout=CommonVariables.mount_command_timeout).return_code
         else: 
             mount_cmd = self.patching.mount_path + ' ' + dev_path + ' ' + mount_point + ' -t ' + file_system
             self.logger.log("mount file system, execute:{0}".format(mount_cmd))
             mount_cmd_args = shlex.split(mount_cmd)
-            proc = Popen(mount_cmd_args)
-            returnCode = proc.wait()
+            returnCode = self.command_executer.Run(mount_cmd_args, timeout=CommonVariables.mount_command_timeout).return_code
+        self.invalidate_device_inventory()
         return returnCode
 
     def mount_crypt_item(self, crypt_item, passphrase):
@@ -436,8 +452,8 @@ class DiskUtil(object):
         umount_cmd = self.patching.umount_path + ' ' + path
         self.logger.log("umount, execute:{0}".format(umount_cmd))
         umount_cmd_args = shlex.split(umount_cmd)
-        proc = Popen(umount_cmd_args)
-        returnCode = proc.wait()
+        returnCode = self.command_executer.Run(umount_cmd_args, timeout=CommonVariables.mount_command_timeout).return_code
+        self.invalidate_device_inventory()
         return returnCode
 
     def umount_all_crypt_items(self):
@@ -449,13 +465,15 @@ class DiskUtil(object):
         mount_all_cmd = self.patching.mount_path + ' -a'
         self.logger.log("command to execute:{0}".format(mount_all_cmd))
         mount_all_cmd_args = shlex.split(mount_all_cmd)
-        proc = Popen(mount_all_cmd_args)
-        returnCode = proc.wait()
+        returnCode = self.command_executer.Run(mount_all_cmd_args, timeout=CommonVariables.mount_command_timeout).return_code
+        self.invalidate_device_inventory()
         return returnCode
 
     def query_dev_sdx_path_by_scsi_id(self,scsi_number): 
-        p = Popen([self.patching.lsscsi_path, scsi_number], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        identity, err = p.communicate()
+        device_item = self.get_device_inventory().get_item_by_scsi_id(scsi_number)
+        if(device_item is not None):
+            return os.path.join('/dev', device_item.name)
+        identity = self.command_executer.Run([self.patching.lsscsi_path, scsi_number], timeout=CommonVariables.mount_command_timeout, capture_output=True).stdout
         # identity sample: [5:0:0:0] disk Msft Virtual Disk 1.0 /dev/sdc
         self.logger.log("lsscsi output is: {0}\n".format(identity))
         vals = identity.split()
@@ -481,8 +499,7 @@ class DiskUtil(object):
         """
         self.logger.log("querying the sdx path of:{0}".format(sdx_path))
         #blkid path
-        p = Popen([self.patching.blkid_path,sdx_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        identity,err = p.communicate()
+        identity = self.command_executer.Run([self.patching.blkid_path,sdx_path], timeout=CommonVariables.mount_command_timeout, capture_output=True).stdout
         identity = identity.lower()
         self.logger.log("blkid output is: \n" + identity)
         uuid_pattern = 'uuid="'
@@ -513,14 +530,12 @@ class DiskUtil(object):
         if property_name == "SIZE":
             get_property_cmd = self.patching.blockdev_path + " --getsize64 " + device_path
             get_property_cmd_args = shlex.split(get_property_cmd)
-            get_property_cmd_p = Popen(get_property_cmd_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            output,err = get_property_cmd_p.communicate()
+            output = self.command_executer.Run(get_property_cmd_args, timeout=CommonVariables.mount_command_timeout, capture_output=True).stdout or ""
             return output.strip()
         else:
             get_property_cmd = self.patching.lsblk_path + " " + device_path + " -b -nl -o NAME," + property_name
             get_property_cmd_args = shlex.split(get_property_cmd)
-            get_property_cmd_p = Popen(get_property_cmd_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            output,err = get_property_cmd_p.communicate()
+            output = self.command_executer.Run(get_property_cmd_args, timeout=CommonVariables.mount_command_timeout, capture_output=True).stdout or ""
             lines = output.splitlines()
             for i in range(0,len(lines)):
                 item_value_str = lines[i].strip()
@@ -541,8 +556,7 @@ class DiskUtil(object):
         else:
             get_device_cmd = "{0} -b -nl -o NAME {1}".format(self.patching.lsblk_path , dev_path)
         get_device_cmd_args = shlex.split(get_device_cmd)
-        p = Popen(get_device_cmd_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out_lsblk_output, err = p.communicate()
+        out_lsblk_output = self.command_executer.Run(get_device_cmd_args, timeout=CommonVariables.mount_command_timeout, capture_output=True).stdout or ""
         lines = out_lsblk_output.splitlines()
         for i in range(0,len(lines)):
             item_value_str = lines[i].strip()
@@ -588,11 +602,12 @@ class DiskUtil(object):
         else:
             self.logger.log(msg=("getting the blk info from " + str(dev_path)))
             device_items = []
-            if(dev_path is None):
-                p = Popen([self.patching.lsblk_path, '-b', '-n','-P','-o','NAME,TYPE,FSTYPE,MOUNTPOINT,LABEL,UUID,MODEL,SIZE'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            else:
-                p = Popen([self.patching.lsblk_path, '-b', '-n','-P','-o','NAME,TYPE,FSTYPE,MOUNTPOINT,LABEL,UUID,MODEL,SIZE',dev_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            out_lsblk_output, err = p.communicate()
+            lsblk_cmd_args = [self.patching.lsblk_path, '-b', '-n','-P','-o','NAME,TYPE,FSTYPE,MOUNTPOINT,LABEL,UUID,MODEL,SIZE']
+            if(dev_path is not None):
+                lsblk_cmd_args.append(dev_path)
+            lsblk_result = self.command_executer.Run(lsblk_cmd_args, timeout=CommonVariables.mount_command_timeout, capture_output=True)
+            out_lsblk_output = lsblk_result.stdout
+            err = lsblk_result.stderr
             out_lsblk_output = str(out_lsblk_output)
             error_msg = str(err)
             if(error_msg is not None and error_msg.strip() != ""):
@@ -634,6 +649,57 @@ class DiskUtil(object):
                     device_items.append(device_item)
             return device_items
     
+    def get_device_inventory(self):
+        """
+        returns the BlockDeviceInventory of the devices, the same snapshot is
+        returned until invalidate_device_inventory is called.
+        """
+        with self.device_inventory_lock:
+            if(self.device_inventory is None):
+                self.device_inventory = BlockDeviceInventory(self.get_device_items(None))
+            return self.device_inventory
+
+    def invalidate_device_inventory(self):
+        """
+        called after everything which changes the devices, the file systems or the mounts.
+        """
+        with self.device_inventory_lock:
+            self.device_inventory = None
+
+    def start_phase(self, name):
+        """
+        starts the phase name in the PhaseTimeline of the calling thread, if it has one.
+        """
+        timeline = self.command_executer.get_timeline()
+        if(timeline is not None):
+            timeline.start_phase(name)
+
+    def get_physical_disks(self, device_name):
+        """
+        returns the kernel names of the whole disks under device_name, a partition
+        maps to its disk and a device mapper device to the disks of its slaves.
+        device_name could also be a path under /dev.
+        """
+        dev_path = os.path.join('/dev', device_name)
+        if(not os.path.exists(dev_path) and not device_name.startswith('/')):
+            dev_path = os.path.join(CommonVariables.dev_mapper_root, device_name)
+        physical_disks = set()
+        kernel_names = [os.path.basename(os.path.realpath(dev_path))]
+        while(len(kernel_names) > 0):
+            kernel_name = kernel_names.pop()
+            sys_block_path = os.path.join('/sys/class/block', kernel_name)
+            if(not os.path.exists(sys_block_path)):
+                physical_disks.add(kernel_name)
+                continue
+            slaves = glob.glob(os.path.join(sys_block_path, 'slaves', '*'))
+            if(len(slaves) > 0):
+                kernel_names.extend([os.path.basename(slave) for slave in slaves])
+            elif(os.path.exists(os.path.join(sys_block_path, 'partition'))):
+                physical_disks.add(os.path.basename(os.path.dirname(os.path.realpath(sys_block_path))))
+            else:
+                physical_disks.add(kernel_name)
+        return physical_disks
+
     def should_skip_for_inplace_encryption(self, device_item):
         """
         TYPE="raid0"
@@ -660,8 +726,8 @@ class DiskUtil(object):
             if(device_item.uuid is None or device_item.uuid == ""):
                 self.logger.log(msg="the device do not have the related uuid, so skip it.",level=CommonVariables.WarningLevel)
                 return True
-            sub_items = self.get_device_items("/dev/" + device_item.name)
-            if(len(sub_items) > 1):
+            device_inventory = self.get_device_inventory()
+            if(len(device_inventory.get_children(device_item.name)) > 0):
                 self.logger.log(msg=("there's sub items for the device:{0} , so skip it.".format(device_item.name)),level=CommonVariables.WarningLevel)
                 return True
 
@@ -680,10 +746,14 @@ class DiskUtil(object):
             return False
 
     def get_azure_devices(self):
-        ide_devices = self.get_ide_devices()
+        with self.device_inventory_lock:
+            if(self.ide_devices is None):
+                self.ide_devices = self.get_ide_devices()
+            ide_devices = self.ide_devices
+        device_inventory = self.get_device_inventory()
         blk_items = []
         for ide_device in ide_devices:
-            current_blk_items = self.get_device_items("/dev/" + ide_device)
+            current_blk_items = device_inventory.get_items("/dev/" + ide_device)
             for current_blk_item in current_blk_items:
                 blk_items.append(current_blk_item)
         return blk_items
@@ -18,15 +18,21 @@
 #
 # Requires Python 2.7+
 #
+import copy
+import glob
 import os
 import os.path
+import re
 import subprocess
 from subprocess import *
+from CommandExecuter import CommandExecuter
+from Common import CommonVariables
 class EncryptionEnvironment(object):
     """description of class"""
     def __init__(self,patching,logger):
         self.patching = patching
         self.logger = logger
+        self.command_executer = CommandExecuter(logger)
         self.encryption_config_path = '/var/lib/azure_disk_encryption_config/'
         self.daemon_lock_file_path = os.path.join(self.encryption_config_path, 'daemon_lock_file.lck')
         self.encryption_config_file_path = os.path.join(self.encryption_config_path,'azure_crypt_config.ini')
@@ -34,25 +40,51 @@ class EncryptionEnvironment(object):
         self.azure_crypt_request_queue_path = os.path.join(self.encryption_config_path,'azure_crypt_request_queue.ini')
         self.azure_decrypt_request_queue_path = os.path.join(self.encryption_config_path,'azure_decrypt_request_queue.ini')
         self.azure_crypt_ongoing_item_config_path = os.path.join(self.encryption_config_path,'azure_crypt_ongoing_item.ini')
+        self.azure_crypt_ongoing_item_journal_path = os.path.join(self.encryption_config_path,'azure_crypt_ongoing_item.journal')
         self.azure_crypt_current_transactional_copy_path = os.path.join(self.encryption_config_path,'azure_crypt_copy_progress.ini')
         self.luks_header_base_path = os.path.join(self.encryption_config_path,'azureluksheader')
         self.cleartext_key_base_path = os.path.join(self.encryption_config_path,'cleartext_key')
         self.copy_header_slice_file_path = os.path.join(self.encryption_config_path,'copy_header_slice_file')
         self.copy_slice_item_backup_file = os.path.join(self.encryption_config_path,'copy_slice_item.bak')
+        self.copy_allocation_map_file_path = os.path.join(self.encryption_config_path,'copy_allocation_map')
+        self.device_key = None
+
+    def get_device_environment(self, device_name):
+        """
+        returns an environment whose ongoing item and copy files belong to
+        device_name only, so several devices could be encrypted at the same time.
+        """
+        device_key = re.sub('[^A-Za-z0-9_.-]', '_', device_name)
+        device_environment = copy.copy(self)
+        device_environment.device_key = device_key
+        device_environment.azure_crypt_ongoing_item_config_path = os.path.join(self.encryption_config_path,'azure_crypt_ongoing_item_{0}.ini'.format(device_key))
+        device_environment.azure_crypt_ongoing_item_journal_path = os.path.join(self.encryption_config_path,'azure_crypt_ongoing_item_{0}.journal'.format(device_key))
+        device_environment.copy_header_slice_file_path = os.path.join(self.encryption_config_path,'copy_header_slice_file_{0}'.format(device_key))
+        device_environment.copy_slice_item_backup_file = os.path.join(self.encryption_config_path,'copy_slice_item_{0}.bak'.format(device_key))
+        device_environment.copy_allocation_map_file_path = os.path.join(self.encryption_config_path,'copy_allocation_map_{0}'.format(device_key))
+        return device_environment
+
+    def get_ongoing_environments(self):
+        """
+        returns the environments which have an ongoing item, the shared one
+        of the older versions first, then the ones of the devices.
+        """
+        environments = []
+        if(os.path.exists(self.azure_crypt_ongoing_item_journal_path) or os.path.exists(self.azure_crypt_ongoing_item_config_path)):
+            environments.append(self)
+        journal_prefix = os.path.join(self.encryption_config_path, 'azure_crypt_ongoing_item_')
+        for journal_path in sorted(glob.glob(journal_prefix + '*.journal')):
+            environments.append(self.get_device_environment(journal_path[len(journal_prefix):-len('.journal')]))
+        return environments
 
     def get_se_linux(self):
-        proc = Popen([self.patching.getenforce_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        identity, err = proc.communicate()
+        identity = self.command_executer.Run([self.patching.getenforce_path], timeout=CommonVariables.mount_command_timeout, capture_output=True).stdout or ""
         return identity.strip().lower()
 
     def disable_se_linux(self):
         self.logger.log("disabling se linux")
-        proc = Popen([self.patching.setenforce_path,'0'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        returnCode = proc.wait()
-        return returnCode
+        return self.command_executer.Run([self.patching.setenforce_path,'0'], timeout=CommonVariables.mount_command_timeout, capture_output=True).return_code
 
     def enable_se_linux(self):
         self.logger.log("enabling se linux")
-        proc = Popen([self.patching.setenforce_path,'1'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        returnCode = proc.wait()
-        return returnCode
\ No newline at end of file
+        return self.command_executer.Run([self.patching.setenforce_path,'1'], timeout=CommonVariables.mount_command_timeout, capture_output=True).return_code
\ No newline at end of file
@@ -31,6 +31,11 @@ class EncryptionMarkConfig(object):
         self.command = None
         self.volume_type = None
         self.diskFormatQuery = None
+        self.skip_unallocated_blocks = None
+        self.copy_bandwidth_limit = None
+        self.copy_iops_limit = None
+        self.adaptive_copy_throttle = None
+        self.max_parallel_devices = None
         self.encryption_mark_config = ConfigUtil(self.encryption_environment.azure_crypt_request_queue_path,'encryption_request_queue',self.logger)
 
     def get_current_command(self):
@@ -39,6 +44,28 @@ class EncryptionMarkConfig(object):
     def get_encryption_disk_format_query(self):
         return self.encryption_mark_config.get_config(CommonVariables.EncryptionDiskFormatQueryKey)
 
+    def get_skip_unallocated_blocks(self):
+        skip_unallocated_blocks_value = self.encryption_mark_config.get_config(CommonVariables.EncryptionSkipUnallocatedBlocksKey)
+        return skip_unallocated_blocks_value is not None and skip_unallocated_blocks_value.lower() == 'true'
+
+    def get_copy_bandwidth_limit(self):
+        return self.encryption_mark_config.get_config(CommonVariables.EncryptionCopyBandwidthLimitKey)
+
+    def get_copy_iops_limit(self):
+        return self.encryption_mark_config.get_config(CommonVariables.EncryptionCopyIopsLimitKey)
+
+    def get_adaptive_copy_throttle(self):
+        return self.encryption_mark_config.get_config(CommonVariables.EncryptionAdaptiveCopyThrottleKey)
+
+    def get_max_parallel_devices(self):
+        max_parallel_devices_value = self.encryption_mark_config.get_config(CommonVariables.EncryptionMaxParallelDevicesKey)
+        try:
+            if(max_parallel_devices_value is not None and max_parallel_devices_value != ""):
+                return max(1, int(max_parallel_devices_value))
+        except ValueError:
+            self.logger.log(msg="ignoring the invalid {0} {1}".format(CommonVariables.EncryptionMaxParallelDevicesKey, max_parallel_devices_value), level=CommonVariables.WarningLevel)
+        return CommonVariables.max_parallel_devices
+
     def config_file_exists(self):
         """
         we should compare the timestamp of the file with the current system time
@@ -54,6 +81,16 @@ class EncryptionMarkConfig(object):
         key_value_pairs.append(volume_type)
         disk_format_query = ConfigKeyValuePair(CommonVariables.EncryptionDiskFormatQueryKey,self.diskFormatQuery)
         key_value_pairs.append(disk_format_query)
+        skip_unallocated_blocks = ConfigKeyValuePair(CommonVariables.EncryptionSkipUnallocatedBlocksKey,self.skip_unallocated_blocks)
+        key_value_pairs.append(skip_unallocated_blocks)
+        copy_bandwidth_limit = ConfigKeyValuePair(CommonVariables.EncryptionCopyBandwidthLimitKey, self.copy_bandwidth_limit)
+        key_value_pairs.append(copy_bandwidth_limit)
+        copy_iops_limit = ConfigKeyValuePair(CommonVariables.EncryptionCopyIopsLimitKey, self.copy_iops_limit)
+        key_value_pairs.append(copy_iops_limit)
+        adaptive_copy_throttle = ConfigKeyValuePair(CommonVariables.EncryptionAdaptiveCopyThrottleKey, self.adaptive_copy_throttle)
+        key_value_pairs.append(adaptive_copy_throttle)
+        max_parallel_devices = ConfigKeyValuePair(CommonVariables.EncryptionMaxParallelDevicesKey, self.max_parallel_devices)
+        key_value_pairs.append(max_parallel_devices)
         self.encryption_mark_config.save_configs(key_value_pairs)
 
     def clear_config(self):
@@ -43,6 +43,11 @@ class ExtensionParameter(object):
             self.KeyEncryptionAlgorithm = 'RSA-OAEP'
         self.VolumeType = public_settings.get(CommonVariables.VolumeTypeKey)
         self.DiskFormatQuery = public_settings.get(CommonVariables.DiskFormatQuerykey)
+        self.SkipUnallocatedBlocks = public_settings.get(CommonVariables.SkipUnallocatedBlocksKey)
+        self.CopyBandwidthLimit = public_settings.get(CommonVariables.CopyBandwidthLimitKey)
+        self.CopyIopsLimit = public_settings.get(CommonVariables.CopyIopsLimitKey)
+        self.AdaptiveCopyThrottle = public_settings.get(CommonVariables.AdaptiveCopyThrottleKey)
+        self.MaxParallelDevices = public_settings.get(CommonVariables.MaxParallelDevicesKey)
 
         """
         private settings
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+import os
+import os.path
+import threading
+import time
+from Common import CommonVariables
+
+class TokenBucket(object):
+    """
+    rate tokens per second, at most burst tokens are saved up while idle.
+    a request bigger than the tokens left goes into debt, the caller sleeps
+    until the debt is paid, so a big slice does not need a big burst.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last_time = time.time()
+
+    def set_rate(self, rate):
+        self.refill()
+        self.rate = rate
+
+    def refill(self):
+        now = time.time()
+        self.tokens = min(self.tokens + (now - self.last_time) * self.rate, self.burst)
+        self.last_time = now
+
+    def consume(self, amount):
+        """
+        returns the seconds to wait before the amount could be used.
+        """
+        self.refill()
+        self.tokens -= amount
+        if(self.tokens >= 0):
+            return 0
+        return -self.tokens / self.rate
+
+class DiskStatsSampler(object):
+    """
+    the average latency of the completed ios of some devices, from /proc/diskstats.
+    """
+    def __init__(self, device_names):
+        self.device_names = device_names
+        self.last_counters = self.read_counters()
+
+    def read_counters(self):
+        """
+        returns (ios, milliseconds) summed over the devices, the reads and writes together.
+        """
+        ios = 0
+        milliseconds = 0
+        try:
+            with open('/proc/diskstats', 'r') as diskstats:
+                for line in diskstats:
+                    fields = line.split()
+                    if(len(fields) < 11 or fields[2] not in self.device_names):
+                        continue
+                    ios += long(fields[3]) + long(fields[7])
+                    milliseconds += long(fields[6]) + long(fields[10])
+        except (IOError, ValueError):
+            return None
+        return (ios, milliseconds)
+
+    def sample(self):
+        """
+        returns the average latency in milliseconds since the last sample, None when nothing completed.
+        """
+        counters = self.read_counters()
+        last_counters = self.last_counters
+        self.last_counters = counters
+        if(counters is None or last_counters is None or counters[0] <= last_counters[0]):
+            return None
+        return float(counters[1] - last_counters[1]) / (counters[0] - last_counters[0])
+
+class IORateLimiter(object):
+    """
+    limits the bandwidth and the iops of the encryption copy, the reads of
+    the source and the writes of the destination both count, so the
+    workloads on the same disks keep running.
+    in adaptive mode the latency of the devices is sampled from /proc/diskstats,
+    the bandwidth is halved when the latency rises over the lowest one we have
+    seen, and grows back slowly once it settles.
+    """
+    def __init__(self, logger, bandwidth=None, iops=None, adaptive=False):
+        """
+        bandwidth is in bytes per second, None means no limit for it.
+        """
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.bandwidth = bandwidth
+        self.current_bandwidth = bandwidth
+        self.bandwidth_bucket = None
+        self.iops_bucket = None
+        if(bandwidth is not None):
+            self.bandwidth_bucket = TokenBucket(bandwidth, bandwidth)
+        if(iops is not None):
+            self.iops_bucket = TokenBucket(iops, iops)
+        self.adaptive = adaptive
+        self.disk_stats_sampler = None
+        self.watched_device_names = set()
+        self.base_latency = None
+        self.sample_time = time.time()
+        self.sample_bytes = 0
+
+    @staticmethod
+    def from_settings(logger, bandwidth_value, iops_value, adaptive_value):
+        """
+        the values are what the public settings gave, bandwidth is in MB/s.
+        returns None when nothing is limited.
+        """
+        def parse(value, name):
+            if(value is None or str(value).strip() == ""):
+                return None
+            try:
+                parsed_value = float(value)
+            except ValueError:
+                logger.log(msg="ignoring the invalid {0} {1}".format(name, value), level=CommonVariables.WarningLevel)
+                return None
+            if(parsed_value <= 0):
+                return None
+            return parsed_value
+
+        bandwidth = parse(bandwidth_value, CommonVariables.CopyBandwidthLimitKey)
+        if(bandwidth is not None):
+            bandwidth = bandwidth * 1024 * 1024
+        iops = parse(iops_value, CommonVariables.CopyIopsLimitKey)
+        adaptive = adaptive_value is not None and str(adaptive_value).lower() == 'true'
+        if(bandwidth is None and iops is None and not adaptive):
+            return None
+        logger.log("copy rate limit: bandwidth {0} B/s, iops {1}, adaptive {2}".format(bandwidth, iops, adaptive))
+        return IORateLimiter(logger, bandwidth, iops, adaptive)
+
+    def watch_devices(self, device_paths):
+        """
+        the latency of these devices drives the adaptive mode, together with
+        the ones of the other copies sharing the limiter.
+        """
+        if(not self.adaptive):
+            return
+        with self.lock:
+            self.watched_device_names |= set([os.path.basename(os.path.realpath(device_path)) for device_path in device_paths])
+            self.disk_stats_sampler = DiskStatsSampler(self.watched_device_names)
+            self.sample_time = time.time()
+            self.sample_bytes = 0
+
+    def set_bandwidth(self, bandwidth):
+        self.current_bandwidth = bandwidth
+        if(bandwidth is None):
+            self.bandwidth_bucket = None
+        elif(self.bandwidth_bucket is None):
+            self.bandwidth_bucket = TokenBucket(bandwidth, bandwidth)
+        else:
+            self.bandwidth_bucket.set_rate(bandwidth)
+            self.bandwidth_bucket.burst = bandwidth
+
+    def adapt(self):
+        """
+        called with the lock held, at most once per sample interval.
+        """
+        now = time.time()
+        elapsed = now - self.sample_time
+        if(self.disk_stats_sampler is None or elapsed < CommonVariables.copy_throttle_sample_interval):
+            return
+        measured_bandwidth = self.sample_bytes / elapsed
+        self.sample_time = now
+        self.sample_bytes = 0
+        latency = self.disk_stats_sampler.sample()
+        if(latency is None):
+            return
+        if(self.base_latency is None or latency < self.base_latency):
+            self.base_latency = latency
+        if(latency > max(self.base_latency * CommonVariables.copy_throttle_latency_ratio, CommonVariables.copy_throttle_min_latency)):
+            bandwidth = self.current_bandwidth
+            if(bandwidth is None):
+                bandwidth = measured_bandwidth
+            bandwidth = max(bandwidth * CommonVariables.copy_throttle_backoff, CommonVariables.copy_throttle_min_bandwidth)
+            self.logger.log("device latency {0:.1f}ms is over the base {1:.1f}ms, lowering the copy bandwidth to {2:.0f} B/s".format(latency, self.base_latency, bandwidth))
+            self.set_bandwidth(bandwidth)
+        elif(self.current_bandwidth is not None and self.current_bandwidth != self.bandwidth):
+            bandwidth = self.current_bandwidth * CommonVariables.copy_throttle_recovery
+            if(self.bandwidth is not None):
+                bandwidth = min(bandwidth, self.bandwidth)
+            elif(bandwidth > measured_bandwidth * 2):
+                # the limit does not hold the copy back any more.
+                bandwidth = None
+            self.set_bandwidth(bandwidth)
+
+    def throttle(self, byte_count):
+        """
+        blocks until byte_count bytes could be transferred, an io is counted
+        for every copy_throttle_io_size bytes.
+        """
+        if(byte_count <= 0):
+            return
+        io_count = (byte_count + CommonVariables.copy_throttle_io_size - 1) / CommonVariables.copy_throttle_io_size
+        with self.lock:
+            self.sample_bytes += byte_count
+            if(self.adaptive):
+                self.adapt()
+            wait_time = 0
+            if(self.bandwidth_bucket is not None):
+                wait_time = max(wait_time, self.bandwidth_bucket.consume(byte_count))
+            if(self.iops_bucket is not None):
+                wait_time = max(wait_time, self.iops_bucket.consume(io_count))
+        if(wait_time > 0):
+            time.sleep(wait_time)
@@ -23,6 +23,8 @@ import os.path
 import uuid
 import time
 import datetime
+import traceback
+from CheckpointJournal import CheckpointJournal
 from Common import CommonVariables
 from ConfigParser import ConfigParser
 from ConfigUtil import ConfigUtil
@@ -47,74 +49,140 @@ class OnGoingItemConfig(object):
         self.current_total_copy_size = None
         self.current_slice_index = None
         self.current_destination = None
+        self.allocation_map_file_path = None
+        self.copied_size = None
+        self.backup_slice_offset = None
+        self.backup_slice_size = None
+        self.adaptive_block_size = None
+        self.backup_slice_checksums = None
+        # the ini file is what the older versions wrote, we only read it to resume their work.
         self.ongoing_item_config = ConfigUtil(encryption_environment.azure_crypt_ongoing_item_config_path, 'azure_crypt_ongoing_item_config', logger)
+        self.ongoing_item_journal = CheckpointJournal(encryption_environment.azure_crypt_ongoing_item_journal_path, logger, fsync = CommonVariables.ongoing_item_journal_fsync)
 
     def config_file_exists(self):
-        return self.ongoing_item_config.config_file_exists()
+        return self.ongoing_item_journal.exists() or self.ongoing_item_config.config_file_exists()
+
+    def load_state(self):
+        """
+        the journal is read once, the getters are served from memory.
+        """
+        state = self.ongoing_item_journal.load()
+        if(len(state) == 0 and self.ongoing_item_config.config_file_exists()):
+            self.logger.log(msg="migrating the ongoing item config {0} to the journal.".format(self.encryption_environment.azure_crypt_ongoing_item_config_path))
+            config = ConfigParser()
+            config.read(self.encryption_environment.azure_crypt_ongoing_item_config_path)
+            if(config.has_section('azure_crypt_ongoing_item_config')):
+                state.update(config.items('azure_crypt_ongoing_item_config'))
+        return state
+
+    def get_config(self, prop_name):
+        # ConfigParser lower cases the option names, keep the same keys in the journal.
+        return self.load_state().get(prop_name.lower())
 
     def get_original_dev_name_path(self):
-        return self.ongoing_item_config.get_config(CommonVariables.OngoingItemOriginalDevNamePathKey)
+        return self.get_config(CommonVariables.OngoingItemOriginalDevNamePathKey)
 
     def get_original_dev_path(self):
-        return self.ongoing_item_config.get_config(CommonVariables.OngoingItemOriginalDevPathKey)
+        return self.get_config(CommonVariables.OngoingItemOriginalDevPathKey)
 
     def get_mapper_name(self):
-        return self.ongoing_item_config.get_config(CommonVariables.OngoingItemMapperNameKey)
+        return self.get_config(CommonVariables.OngoingItemMapperNameKey)
 
     def get_header_file_path(self):
-        return self.ongoing_item_config.get_config(CommonVariables.OngoingItemHeaderFilePathKey)
+        return self.get_config(CommonVariables.OngoingItemHeaderFilePathKey)
 
     def get_phase(self):
-        return self.ongoing_item_config.get_config(CommonVariables.OngoingItemPhaseKey)
+        return self.get_config(CommonVariables.OngoingItemPhaseKey)
 
     def get_header_slice_file_path(self):
-        return self.ongoing_item_config.get_config(CommonVariables.OngoingItemHeaderSliceFilePathKey)
+        return self.get_config(CommonVariables.OngoingItemHeaderSliceFilePathKey)
 
     def get_file_system(self):
-        return self.ongoing_item_config.get_config(CommonVariables.OngoingItemFileSystemKey)
+        return self.get_config(CommonVariables.OngoingItemFileSystemKey)
 
     def get_mount_point(self):
-        return self.ongoing_item_config.get_config(CommonVariables.OngoingItemMountPointKey)
+        return self.get_config(CommonVariables.OngoingItemMountPointKey)
 
     def get_device_size(self):
-        device_size_value = self.ongoing_item_config.get_config(CommonVariables.OngoingItemDeviceSizeKey)
+        device_size_value = self.get_config(CommonVariables.OngoingItemDeviceSizeKey)
         if(device_size_value is None or device_size_value == ""):
             return None
         else:
             return long(device_size_value)
 
     def get_current_slice_index(self):
-        current_slice_index_value = self.ongoing_item_config.get_config(CommonVariables.OngoingItemCurrentSliceIndexKey)
+        current_slice_index_value = self.get_config(CommonVariables.OngoingItemCurrentSliceIndexKey)
         if(current_slice_index_value is None or current_slice_index_value == ""):
             return None
         else:
             return long(current_slice_index_value)
 
     def get_from_end(self):
-        return self.ongoing_item_config.get_config(CommonVariables.OngoingItemFromEndKey)
+        return self.get_config(CommonVariables.OngoingItemFromEndKey)
 
     def get_current_block_size(self):
-        block_size_value = self.ongoing_item_config.get_config(CommonVariables.OngoingItemCurrentBlockSizeKey)
+        block_size_value = self.get_config(CommonVariables.OngoingItemCurrentBlockSizeKey)
         if(block_size_value is None or block_size_value == ""):
             return None
         else:
             return long(block_size_value)
 
     def get_current_source_path(self):
-        return self.ongoing_item_config.get_config(CommonVariables.OngoingItemCurrentSourcePathKey)
+        return self.get_config(CommonVariables.OngoingItemCurrentSourcePathKey)
 
     def get_current_destination(self):
-        return self.ongoing_item_config.get_config(CommonVariables.OngoingItemCurrentDestinationKey)
+        return self.get_config(CommonVariables.OngoingItemCurrentDestinationKey)
     
     def get_current_total_copy_size(self):
-        total_copy_size_value = self.ongoing_item_config.get_config(CommonVariables.OngoingItemCurrentTotalCopySizeKey)
+        total_copy_size_value = self.get_config(CommonVariables.OngoingItemCurrentTotalCopySizeKey)
         if(total_copy_size_value is None or total_copy_size_value == ""):
             return None
         else:
             return long(total_copy_size_value)
 
+    def get_allocation_map_file_path(self):
+        return self.get_config(CommonVariables.OngoingItemAllocationMapFilePathKey)
+
+    def get_copied_size(self):
+        copied_size_value = self.get_config(CommonVariables.OngoingItemCopiedSizeKey)
+        if(copied_size_value is None or copied_size_value == ""):
+            return None
+        else:
+            return long(copied_size_value)
+
+    def get_backup_slice_offset(self):
+        backup_slice_offset_value = self.get_config(CommonVariables.OngoingItemBackupSliceOffsetKey)
+        if(backup_slice_offset_value is None or backup_slice_offset_value == ""):
+            return None
+        else:
+            return long(backup_slice_offset_value)
+
+    def get_backup_slice_size(self):
+        backup_slice_size_value = self.get_config(CommonVariables.OngoingItemBackupSliceSizeKey)
+        if(backup_slice_size_value is None or backup_slice_size_value == ""):
+            return None
+        else:
+            return long(backup_slice_size_value)
+
+    def get_adaptive_block_size(self):
+        adaptive_block_size_value = self.get_config(CommonVariables.OngoingItemAdaptiveBlockSizeKey)
+        if(adaptive_block_size_value is None or adaptive_block_size_value == ""):
+            return None
+        else:
+            return long(adaptive_block_size_value)
+
+    def get_backup_slice_checksums(self):
+        """
+        the checksums are kept as comma separated hex crc32 values, one per sub block of the backup slice.
+        """
+        backup_slice_checksums_value = self.get_config(CommonVariables.OngoingItemBackupSliceChecksumsKey)
+        if(backup_slice_checksums_value is None or backup_slice_checksums_value == ""):
+            return None
+        else:
+            return [int(checksum, 16) for checksum in backup_slice_checksums_value.split(',')]
+
     def get_luks_header_file_path(self):
-        return self.ongoing_item_config.get_config(CommonVariables.OngoingItemCurrentLuksHeaderFilePathKey)
+        return self.get_config(CommonVariables.OngoingItemCurrentLuksHeaderFilePathKey)
 
     def load_value_from_file(self):
         self.original_dev_name_path = self.get_original_dev_name_path()
@@ -132,6 +200,12 @@ class OnGoingItemConfig(object):
         self.current_total_copy_size = self.get_current_total_copy_size()
         self.current_slice_index = self.get_current_slice_index()
         self.current_destination = self.get_current_destination()
+        self.allocation_map_file_path = self.get_allocation_map_file_path()
+        self.copied_size = self.get_copied_size()
+        self.backup_slice_offset = self.get_backup_slice_offset()
+        self.backup_slice_size = self.get_backup_slice_size()
+        self.adaptive_block_size = self.get_adaptive_block_size()
+        self.backup_slice_checksums = self.get_config(CommonVariables.OngoingItemBackupSliceChecksumsKey)
 
     def commit(self):
         key_value_pairs = []
@@ -180,17 +254,45 @@ class OnGoingItemConfig(object):
         current_block_size_pair = ConfigKeyValuePair(CommonVariables.OngoingItemCurrentBlockSizeKey, self.current_block_size)
         key_value_pairs.append(current_block_size_pair)
 
-        self.ongoing_item_config.save_configs(key_value_pairs)
+        allocation_map_file_path_pair = ConfigKeyValuePair(CommonVariables.OngoingItemAllocationMapFilePathKey, self.allocation_map_file_path)
+        key_value_pairs.append(allocation_map_file_path_pair)
+
+        copied_size_pair = ConfigKeyValuePair(CommonVariables.OngoingItemCopiedSizeKey, self.copied_size)
+        key_value_pairs.append(copied_size_pair)
+
+        backup_slice_offset_pair = ConfigKeyValuePair(CommonVariables.OngoingItemBackupSliceOffsetKey, self.backup_slice_offset)
+        key_value_pairs.append(backup_slice_offset_pair)
+
+        backup_slice_size_pair = ConfigKeyValuePair(CommonVariables.OngoingItemBackupSliceSizeKey, self.backup_slice_size)
+        key_value_pairs.append(backup_slice_size_pair)
+
+        adaptive_block_size_pair = ConfigKeyValuePair(CommonVariables.OngoingItemAdaptiveBlockSizeKey, self.adaptive_block_size)
+        key_value_pairs.append(adaptive_block_size_pair)
+
+        backup_slice_checksums_pair = ConfigKeyValuePair(CommonVariables.OngoingItemBackupSliceChecksumsKey, self.backup_slice_checksums)
+        key_value_pairs.append(backup_slice_checksums_pair)
+
+        # the same semantic as ConfigUtil.save_configs, None keeps the committed value.
+        values = {}
+        for key_value_pair in key_value_pairs:
+            if(key_value_pair.prop_value is not None):
+                values[key_value_pair.prop_name.lower()] = str(key_value_pair.prop_value)
+        self.load_state()
+        self.ongoing_item_journal.append(values)
 
     def clear_config(self):
         try:
-            if(os.path.exists(self.encryption_environment.azure_crypt_ongoing_item_config_path)):
-                self.logger.log(msg="archive the config file: {0}".format(self.encryption_environment.azure_crypt_ongoing_item_config_path))
-                time_stamp = datetime.datetime.now()
-                new_name = "{0}_{1}".format(self.encryption_environment.azure_crypt_ongoing_item_config_path, time_stamp)
-                os.rename(self.encryption_environment.azure_crypt_ongoing_item_config_path, new_name)
-            else:
-                self.logger.log(msg=("the config file not exist: {0}".format(self.encryption_environment.azure_crypt_ongoing_item_config_path)), level = CommonVariables.WarningLevel)
+            time_stamp = datetime.datetime.now()
+            config_exists = False
+            for config_path in [self.encryption_environment.azure_crypt_ongoing_item_journal_path, self.encryption_environment.azure_crypt_ongoing_item_config_path]:
+                if(os.path.exists(config_path)):
+                    config_exists = True
+                    self.logger.log(msg="archive the config file: {0}".format(config_path))
+                    new_name = "{0}_{1}".format(config_path, time_stamp)
+                    os.rename(config_path, new_name)
+            if(not config_exists):
+                self.logger.log(msg=("the config file not exist: {0}".format(self.encryption_environment.azure_crypt_ongoing_item_journal_path)), level = CommonVariables.WarningLevel)
+            self.ongoing_item_journal.reset()
             return True
         except OSError as e:
             self.logger.log("Failed to archive_backup_config with error: {0}, stack trace: {1}".format(e, traceback.format_exc()))
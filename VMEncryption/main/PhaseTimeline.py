@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+import time
+
+class PhaseRecord(object):
+    def __init__(self, name):
+        self.name = name
+        self.start_time = time.time()
+        self.end_time = None
+        self.commands = []
+
+    def get_duration(self):
+        end_time = self.end_time
+        if(end_time is None):
+            end_time = time.time()
+        return end_time - self.start_time
+
+    def __str__(self):
+        command_time = sum([command.wall_time for command in self.commands])
+        failed_commands = [command for command in self.commands if command.return_code != 0]
+        description = "{0} {1:.1f}s".format(self.name, self.get_duration())
+        if(len(self.commands) > 0):
+            description += " ({0} commands {1:.1f}s".format(len(self.commands), command_time)
+            if(len(failed_commands) > 0):
+                description += ", {0} failed".format(len(failed_commands))
+            description += ")"
+        return description
+
+class PhaseTimeline(object):
+    """
+    the phases the encryption of one device went through, say shrink,
+    header backup, luksFormat, copy and expand, with their wall clock time
+    and the external commands run in each of them.
+    a command run outside of any phase is put in an "other" phase.
+    """
+    def __init__(self, device):
+        self.device = device
+        self.start_time = time.time()
+        self.phases = []
+        self.current_phase = None
+
+    def start_phase(self, name):
+        self.end_phase()
+        self.current_phase = PhaseRecord(name)
+        self.phases.append(self.current_phase)
+
+    def end_phase(self):
+        if(self.current_phase is not None):
+            self.current_phase.end_time = time.time()
+            self.current_phase = None
+
+    def add_command(self, command_result):
+        if(self.current_phase is None):
+            self.start_phase("other")
+        self.current_phase.commands.append(command_result)
+
+    def __str__(self):
+        return "{0}: {1}, total {2:.1f}s".format(self.device, ", ".join([str(phase) for phase in self.phases]), time.time() - self.start_time)
@@ -0,0 +1,450 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+import errno
+import io
+import mmap
+import os
+import os.path
+import threading
+import zlib
+from Queue import Queue
+from Common import CommonVariables
+
+class SliceBufferPool(object):
+    """
+    hands out at most size buffers at a time, a free buffer of the same length is reused.
+    """
+    def __init__(self, size):
+        self.tokens = threading.Semaphore(size)
+        self.lock = threading.Lock()
+        self.free_buffers = []
+
+    def acquire(self, length):
+        self.tokens.acquire()
+        with self.lock:
+            for buf in self.free_buffers:
+                if(len(buf) == length):
+                    self.free_buffers.remove(buf)
+                    return buf
+            if(len(self.free_buffers) > 0):
+                # only the last slice has a different length, drop a buffer to keep the memory bounded.
+                self.free_buffers.pop().close()
+        return mmap.mmap(-1, length)
+
+    def release(self, buf):
+        with self.lock:
+            self.free_buffers.append(buf)
+        self.tokens.release()
+
+    def close(self):
+        with self.lock:
+            for buf in self.free_buffers:
+                buf.close()
+            self.free_buffers = []
+
+class SliceCopier(object):
+    """
+    copies byte ranges between devices and files inside the process.
+    the data goes through page aligned buffers, so the devices could be
+    opened with O_DIRECT; if the kernel refuses the direct io, we fall
+    back to the page cache.
+    the reads of the source and the writes of the destination go through
+    rate_limiter when there is one.
+    """
+    def __init__(self, logger, use_direct_io=False, rate_limiter=None):
+        self.logger = logger
+        self.rate_limiter = rate_limiter
+        self.use_direct_io = use_direct_io and hasattr(os, 'O_DIRECT')
+        self.buffers = {}
+        # the lengths of the cached buffers, the least recently used first.
+        self.buffer_lengths = []
+        self.zero_chunk = '\0' * CommonVariables.allocation_map_chunk_size
+
+    def get_buffer(self, length):
+        """
+        mmap gives us page aligned memory which O_DIRECT requires.
+        we keep one buffer per length, the copy mostly uses the slice size and
+        the last slice size, a resume could ask for other lengths so only the
+        most recent ones are kept.
+        """
+        if(length not in self.buffers):
+            while(len(self.buffers) >= CommonVariables.slice_copier_cached_buffers):
+                self.buffers.pop(self.buffer_lengths.pop(0)).close()
+            self.buffers[length] = mmap.mmap(-1, length)
+        else:
+            self.buffer_lengths.remove(length)
+        self.buffer_lengths.append(length)
+        return self.buffers[length]
+
+    def throttle(self, byte_count):
+        if(self.rate_limiter is not None):
+            self.rate_limiter.throttle(byte_count)
+
+    def open_device(self, path, flags, direct_io):
+        if(direct_io is None):
+            direct_io = self.use_direct_io
+        if(direct_io):
+            flags |= os.O_DIRECT
+        return os.open(path, flags)
+
+    def read_range(self, fd, offset, length, buf):
+        """
+        read exactly length bytes at offset into buf.
+        """
+        os.lseek(fd, offset, os.SEEK_SET)
+        reader = io.FileIO(fd, 'r', closefd=False)
+        read_size = reader.readinto(buf)
+        if(read_size is None):
+            read_size = 0
+        while(read_size < length):
+            data = os.read(fd, length - read_size)
+            if(not data):
+                raise IOError(errno.EIO, "short read at offset {0}, got {1} of {2} bytes".format(offset, read_size, length))
+            buf.seek(read_size)
+            buf.write(data)
+            read_size += len(data)
+
+    def write_range(self, fd, offset, length, buf, sync, buf_offset=0):
+        os.lseek(fd, offset, os.SEEK_SET)
+        written = 0
+        while(written < length):
+            written += os.write(fd, buffer(buf, buf_offset + written, length - written))
+        if(sync):
+            os.fsync(fd)
+
+    def read_into(self, path, offset, length, buf, direct_io=None):
+        fd = self.open_device(path, os.O_RDONLY, direct_io)
+        try:
+            self.read_range(fd, offset, length, buf)
+        finally:
+            os.close(fd)
+
+    def read(self, path, offset, length, direct_io=None):
+        """
+        returns the buffer holding the length bytes at offset of path.
+        """
+        buf = self.get_buffer(length)
+        self.read_into(path, offset, length, buf, direct_io)
+        return buf
+
+    def write(self, path, offset, length, buf, direct_io=None, sync=True, create=False):
+        flags = os.O_WRONLY
+        if(create):
+            flags |= os.O_CREAT
+        fd = self.open_device(path, flags, direct_io)
+        try:
+            self.write_range(fd, offset, length, buf, sync)
+        finally:
+            os.close(fd)
+
+    def write_extents(self, path, offset, buf, extents, direct_io=None):
+        """
+        extents are (offset, length) relative to the slice start at offset.
+        """
+        fd = self.open_device(path, os.O_WRONLY, direct_io)
+        try:
+            for (extent_offset, extent_length) in extents:
+                self.write_range(fd, offset + extent_offset, extent_length, buf, False, buf_offset=extent_offset)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def read_extents(self, path, offset, length, buf, extents):
+        """
+        only the extents are read from the device, the rest of the slice is
+        unallocated and the buffer is filled with zeroes for it.
+        the extents are not aligned to the buffer, so this always goes through the page cache.
+        """
+        buf.seek(0)
+        while(buf.tell() < length):
+            buf.write(self.zero_chunk[:length - buf.tell()])
+        fd = self.open_device(path, os.O_RDONLY, False)
+        try:
+            for (extent_offset, extent_length) in extents:
+                os.lseek(fd, offset + extent_offset, os.SEEK_SET)
+                buf.seek(extent_offset)
+                read_size = 0
+                while(read_size < extent_length):
+                    data = os.read(fd, min(extent_length - read_size, len(self.zero_chunk)))
+                    if(not data):
+                        raise IOError(errno.EIO, "short read at offset {0}".format(offset + extent_offset + read_size))
+                    buf.write(data)
+                    read_size += len(data)
+        finally:
+            os.close(fd)
+
+    def call_with_fallback(self, func, *args, **kwargs):
+        """
+        O_DIRECT needs the offset and length aligned to the logical block size
+        of the device, EINVAL tells us it is not, so redo it with buffered io.
+        """
+        if(self.use_direct_io):
+            try:
+                return func(*args, direct_io=True, **kwargs)
+            except (OSError, IOError) as e:
+                if(e.errno != errno.EINVAL):
+                    raise
+                self.logger.log(msg="direct io is not supported for this request, falling back to buffered io: {0}".format(e), level=CommonVariables.WarningLevel)
+        return func(*args, direct_io=False, **kwargs)
+
+    def copy_range(self, from_path, from_offset, to_path, to_offset, length, create=False):
+        """
+        copy length bytes and make them durable before returning.
+        returns the process_success or copy_data_error.
+        """
+        if(length <= 0):
+            return CommonVariables.process_success
+        try:
+            self.throttle(length)
+            buf = self.call_with_fallback(self.read, from_path, from_offset, length)
+            self.throttle(length)
+            self.call_with_fallback(self.write, to_path, to_offset, length, buf, create=create)
+            return CommonVariables.process_success
+        except (OSError, IOError) as e:
+            self.logger.log(msg="copy {0}@{1} to {2}@{3} length {4} failed: {5}".format(from_path, from_offset, to_path, to_offset, length, e), level=CommonVariables.ErrorLevel)
+            return CommonVariables.copy_data_error
+
+    @staticmethod
+    def get_extents_size(length, extents):
+        if(extents is None):
+            return length
+        return sum([extent_length for (extent_offset, extent_length) in extents])
+
+    @staticmethod
+    def get_checksums(buf, length, block_size=None):
+        """
+        the crc32 of every block_size block of the first length bytes of buf, the last one could be shorter.
+        """
+        if(block_size is None):
+            block_size = CommonVariables.slice_checksum_block_size
+        return [zlib.crc32(buffer(buf, offset, min(block_size, length - offset))) & 0xffffffff for offset in range(0, length, block_size)]
+
+    def read_checksum(self, fd, offset, length):
+        """
+        the crc32 of length bytes at offset of fd, None when fd is shorter.
+        """
+        os.lseek(fd, offset, os.SEEK_SET)
+        checksum = 0
+        read_size = 0
+        while(read_size < length):
+            data = os.read(fd, min(length - read_size, CommonVariables.allocation_map_chunk_size))
+            if(not data):
+                return None
+            checksum = zlib.crc32(data, checksum)
+            read_size += len(data)
+        return checksum & 0xffffffff
+
+    def get_verified_size(self, path, length, checksums, block_size=None):
+        """
+        returns how many bytes from the start of path match the checksums, a
+        torn write only leaves a valid prefix.
+        """
+        if(block_size is None):
+            block_size = CommonVariables.slice_checksum_block_size
+        if(not os.path.exists(path)):
+            return 0
+        fd = self.open_device(path, os.O_RDONLY, False)
+        try:
+            verified_size = 0
+            for checksum in checksums:
+                block_length = min(block_size, length - verified_size)
+                if(self.read_checksum(fd, verified_size, block_length) != checksum):
+                    break
+                verified_size += block_length
+            return verified_size
+        finally:
+            os.close(fd)
+
+    def replay_verified(self, backup_file_path, to_device, to_offset, length, checksums, block_size=None):
+        """
+        the backup file must be verified already, only the blocks of the
+        destination whose checksum does not match are written from it.
+        returns (return code, bytes written).
+        """
+        if(block_size is None):
+            block_size = CommonVariables.slice_checksum_block_size
+        written_size = 0
+        try:
+            backup_fd = os.open(backup_file_path, os.O_RDONLY)
+            try:
+                to_fd = self.open_device(to_device, os.O_RDWR, False)
+                try:
+                    for (index, checksum) in enumerate(checksums):
+                        block_offset = index * block_size
+                        block_length = min(block_size, length - block_offset)
+                        self.throttle(block_length)
+                        if(self.read_checksum(to_fd, to_offset + block_offset, block_length) == checksum):
+                            continue
+                        buf = self.get_buffer(block_length)
+                        self.read_range(backup_fd, block_offset, block_length, buf)
+                        self.throttle(block_length)
+                        self.write_range(to_fd, to_offset + block_offset, block_length, buf, False)
+                        written_size += block_length
+                    os.fsync(to_fd)
+                finally:
+                    os.close(to_fd)
+            finally:
+                os.close(backup_fd)
+        except (OSError, IOError) as e:
+            self.logger.log(msg="replay {0} to {1}@{2} length {3} failed: {4}".format(backup_file_path, to_device, to_offset, length, e), level=CommonVariables.ErrorLevel)
+            return (CommonVariables.copy_data_error, written_size)
+        return (CommonVariables.process_success, written_size)
+
+    def read_slice(self, from_device, from_offset, length, buf=None, extents=None):
+        """
+        extents limits the read to the allocated parts of the slice, None reads the whole slice.
+        """
+        if(buf is None):
+            buf = self.get_buffer(length)
+        self.throttle(SliceCopier.get_extents_size(length, extents))
+        if(extents is None):
+            self.call_with_fallback(self.read_into, from_device, from_offset, length, buf)
+        else:
+            self.read_extents(from_device, from_offset, length, buf, extents)
+        return buf
+
+    def persist_slice(self, to_device, to_offset, length, buf, backup_file_path, extents=None, slice_start=None, slice_done=None):
+        """
+        the slice is persisted to the backup file first, only after the backup
+        is durable we overwrite the destination.
+        so if we crash in the middle of the destination write, resume could
+        replay the slice from the backup file.
+        slice_start(checksums) is called before the backup is written, with
+        the checksums of the slice, and slice_done once the destination is
+        durable, before the backup is dropped, so the caller could checkpoint
+        which slice the backup file belongs to.
+        """
+        if(slice_start is not None):
+            slice_start(SliceCopier.get_checksums(buf, length))
+        try:
+            if(os.path.exists(backup_file_path)):
+                os.remove(backup_file_path)
+            self.write(backup_file_path, 0, length, buf, direct_io=False, create=True)
+        except (OSError, IOError) as e:
+            self.logger.log(msg="write the backup slice file {0} failed: {1}".format(backup_file_path, e), level=CommonVariables.ErrorLevel)
+            return CommonVariables.backup_slice_file_error
+
+        try:
+            self.throttle(SliceCopier.get_extents_size(length, extents))
+            if(extents is None):
+                self.call_with_fallback(self.write, to_device, to_offset, length, buf)
+            else:
+                self.call_with_fallback(self.write_extents, to_device, to_offset, buf, extents)
+        except (OSError, IOError) as e:
+            self.logger.log(msg="write {0}@{1} length {2} failed: {3}".format(to_device, to_offset, length, e), level=CommonVariables.ErrorLevel)
+            return CommonVariables.copy_data_error
+
+        if(slice_done is not None):
+            slice_done()
+        #the copy done correctly, so clear the backup slice file item.
+        os.remove(backup_file_path)
+        return CommonVariables.process_success
+
+    def copy_slice(self, from_device, to_device, from_offset, to_offset, length, backup_file_path, slice_start=None):
+        try:
+            buf = self.read_slice(from_device, from_offset, length)
+        except (OSError, IOError) as e:
+            self.logger.log(msg="read {0}@{1} length {2} failed: {3}".format(from_device, from_offset, length, e), level=CommonVariables.ErrorLevel)
+            return CommonVariables.copy_data_error
+        return self.persist_slice(to_device, to_offset, length, buf, backup_file_path, slice_start = slice_start)
+
+    def copy_slices_pipelined(self, from_device, to_device, slices, backup_file_path, slice_done, depth=2, slice_start=None):
+        """
+        slices yields (offset, length, extents), the offset is the same on both
+        devices, it is consumed by the reader thread so it could be a generator.
+        extents are the allocated ranges relative to the slice, None means the
+        whole slice and a slice without extents is skipped.
+        a reader thread reads the next slices into the buffer pool while this
+        thread persists the current one, slice_start(offset, length, checksums)
+        is called before the backup of a slice is written and
+        slice_done(offset, length, transferred) only after the slice is durable
+        on the destination.
+        the caller must make sure the write of a slice never overlaps the
+        source range of the slices after it.
+        """
+        pool = SliceBufferPool(depth)
+        ready_slices = Queue()
+        stop_event = threading.Event()
+
+        def reader():
+            try:
+                for (offset, length, extents) in slices:
+                    if(stop_event.is_set()):
+                        break
+                    if(extents is not None and len(extents) == 0):
+                        ready_slices.put((offset, length, extents, None))
+                        continue
+                    buf = pool.acquire(length)
+                    if(stop_event.is_set()):
+                        pool.release(buf)
+                        break
+                    self.read_slice(from_device, offset, length, buf, extents)
+                    ready_slices.put((offset, length, extents, buf))
+                ready_slices.put(None)
+            except Exception as e:
+                self.logger.log(msg="read {0} failed: {1}".format(from_device, e), level=CommonVariables.ErrorLevel)
+                ready_slices.put(e)
+
+        reader_thread = threading.Thread(target=reader)
+        reader_thread.daemon = True
+        reader_thread.start()
+        returnCode = CommonVariables.process_success
+        try:
+            while(True):
+                item = ready_slices.get()
+                if(item is None):
+                    break
+                if(not isinstance(item, tuple)):
+                    returnCode = CommonVariables.copy_data_error
+                    break
+                (offset, length, extents, buf) = item
+                transferred = SliceCopier.get_extents_size(length, extents)
+                if(buf is None):
+                    slice_done(offset, length, transferred)
+                    continue
+                start_callback = None
+                if(slice_start is not None):
+                    start_callback = lambda checksums: slice_start(offset, length, checksums)
+                try:
+                    returnCode = self.persist_slice(to_device, offset, length, buf, backup_file_path, extents, \
+                                                   slice_start = start_callback, slice_done = lambda: slice_done(offset, length, transferred))
+                finally:
+                    pool.release(buf)
+                if(returnCode != CommonVariables.process_success):
+                    break
+        finally:
+            stop_event.set()
+            # drain what the reader already read so it is never blocked on the pool.
+            while(reader_thread.is_alive() or not ready_slices.empty()):
+                if(ready_slices.empty()):
+                    reader_thread.join(0.1)
+                    continue
+                item = ready_slices.get()
+                if(isinstance(item, tuple) and item[3] is not None):
+                    pool.release(item[3])
+            pool.close()
+        return returnCode
+
+    def release(self):
+        for buf in self.buffers.values():
+            buf.close()
+        self.buffers = {}
+        self.buffer_lengths = []
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+from Common import CommonVariables
+
+class SliceSizeTuner(object):
+    """
+    picks the slice size of the copy by hill climbing on the measured throughput.
+    every step measures a few slices, when the throughput got better we keep
+    doubling (or halving) the size, when it got worse we go back to the best
+    size, turn around and hold there for a while before probing again.
+    """
+    def __init__(self, logger, initial_size, min_size, max_size,
+                 samples_per_step=CommonVariables.adaptive_slice_samples_per_step,
+                 improvement=CommonVariables.adaptive_slice_improvement,
+                 hold_steps=CommonVariables.adaptive_slice_hold_steps):
+        self.logger = logger
+        self.unit = CommonVariables.allocation_map_chunk_size
+        self.min_size = max(self.align(min_size), self.unit)
+        self.max_size = max(self.align(max_size), self.min_size)
+        self.size = self.clamp(initial_size)
+        self.samples_per_step = samples_per_step
+        self.improvement = improvement
+        self.hold_steps = hold_steps
+        self.samples = []
+        self.best_size = None
+        self.best_throughput = None
+        self.grow = True
+        self.hold = 0
+
+    def align(self, size):
+        return (size / self.unit) * self.unit
+
+    def clamp(self, size):
+        return min(max(self.align(size), self.min_size), self.max_size)
+
+    def get_slice_size(self):
+        return self.size
+
+    def record(self, slice_size, transferred, elapsed):
+        """
+        transferred is the bytes really read and written for the slice,
+        slices which were mostly skipped say nothing about the disks.
+        """
+        if(slice_size != self.size or elapsed <= 0 or transferred * 2 < slice_size):
+            return
+        self.samples.append(transferred / elapsed)
+        if(len(self.samples) < self.samples_per_step):
+            return
+        self.samples.sort()
+        throughput = self.samples[len(self.samples) / 2]
+        self.samples = []
+        self.step(throughput)
+
+    def step(self, throughput):
+        if(self.best_throughput is None or throughput >= self.best_throughput * (1 + self.improvement)):
+            self.best_size = self.size
+            self.best_throughput = throughput
+            self.probe()
+        elif(self.size != self.best_size):
+            self.logger.log("slice size {0} gives {1:.0f} B/s, going back to {2} with {3:.0f} B/s".format(self.size, throughput, self.best_size, self.best_throughput))
+            self.size = self.best_size
+            self.grow = not self.grow
+            self.hold = self.hold_steps
+        else:
+            # the disks may have changed their mind, keep the measurement fresh.
+            self.best_throughput = throughput
+            if(self.hold > 0):
+                self.hold -= 1
+            else:
+                self.probe()
+
+    def probe(self):
+        if(self.grow):
+            next_size = self.clamp(self.size * 2)
+        else:
+            next_size = self.clamp(self.size / 2)
+        if(next_size == self.size):
+            self.grow = not self.grow
+            return
+        self.logger.log("slice size {0} gives {1:.0f} B/s, trying {2}".format(self.size, self.best_throughput, next_size))
+        self.size = next_size
+
+    @staticmethod
+    def get_max_size(buffer_count):
+        """
+        the pipelined copy holds buffer_count slices in memory, keep them in a
+        fraction of the available memory.
+        """
+        max_size = CommonVariables.adaptive_slice_max_size
+        try:
+            with open('/proc/meminfo', 'r') as meminfo:
+                memory_info = dict((line.split(':')[0], line.split(':')[1].split()) for line in meminfo if ':' in line)
+            available = memory_info.get('MemAvailable') or memory_info.get('MemFree')
+            if(available is not None):
+                available_bytes = long(available[0]) * 1024
+                max_size = min(max_size, available_bytes / CommonVariables.adaptive_slice_memory_fraction / buffer_count)
+        except (IOError, ValueError, IndexError):
+            pass
+        return max_size
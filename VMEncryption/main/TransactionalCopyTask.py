@@ -23,22 +23,31 @@ import os
 import os.path
 import sys
 import shlex
+import time
 from subprocess import *
-from CommandExecuter import CommandExecuter
 from Common import CommonVariables
 from ConfigUtil import ConfigUtil
+from CopyProgress import CopyProgress
 from OnGoingItemConfig import *
+from SliceCopier import SliceCopier
+from SliceSizeTuner import SliceSizeTuner
 
 class TransactionalCopyTask(object):
     """
     copy_total_size is in byte, skip_target_size is also in byte
     slice_size is in byte 50M
     """
-    def __init__(self, logger, disk_util, ongoing_item_config, patching, encryption_environment):
+    def __init__(self, logger, disk_util, ongoing_item_config, patching, encryption_environment, pipelined=False, allocation_map=None, rate_limiter=None, progress_reporter=None):
         """
         copy_total_size is in bytes.
+        pipelined reads the next slice while the current one is written, it is
+        only safe when writing a slice never touches the source of the next slices.
+        allocation_map is used by the pipelined copy to skip the unallocated chunks.
+        the pipelined copy also tunes its slice size on the measured throughput,
+        block_size is only where it starts.
+        rate_limiter throttles the reads of the source and the writes of the destination.
+        progress_reporter gets the progress of the copy after every slice.
         """
-        self.command_executer = CommandExecuter(logger)
         self.ongoing_item_config = ongoing_item_config
         self.total_size = self.ongoing_item_config.get_current_total_copy_size()
         self.block_size = self.ongoing_item_config.get_current_block_size()
@@ -55,33 +64,74 @@ class TransactionalCopyTask(object):
         self.logger = logger
         self.patching = patching
         self.disk_util = disk_util
-        self.tmpfs_mount_point = "/mnt/azure_encrypt_tmpfs"
-        self.slice_file_path = self.tmpfs_mount_point + "/slice_file"
-        self.copy_command = self.patching.dd_path
+        if(rate_limiter is not None):
+            rate_limiter.watch_devices([self.source_dev_full_path, self.destination])
+        self.slice_copier = SliceCopier(logger = logger, use_direct_io = CommonVariables.copy_use_direct_io, rate_limiter = rate_limiter)
+        self.pipelined = pipelined
+        self.allocation_map = allocation_map
+        self.slice_size_tuner = None
+        self.progress_reporter = progress_reporter
+        self.copy_progress = None
+
+    def record_backup_slice(self, device_offset, slice_size, checksums):
+        self.ongoing_item_config.backup_slice_offset = device_offset
+        self.ongoing_item_config.backup_slice_size = slice_size
+        self.ongoing_item_config.backup_slice_checksums = ",".join(["{0:08x}".format(checksum) for checksum in checksums])
+        self.ongoing_item_config.commit()
+
+    def get_backup_slice_checksums(self, device_offset, slice_size):
+        """
+        the checksums only belong to the backup file when they were recorded for the same slice.
+        """
+        checksums = self.ongoing_item_config.get_backup_slice_checksums()
+        if(checksums is None or self.ongoing_item_config.get_backup_slice_offset() != device_offset or self.ongoing_item_config.get_backup_slice_size() != slice_size):
+            return None
+        checksum_block_size = CommonVariables.slice_checksum_block_size
+        if(len(checksums) != (slice_size + checksum_block_size - 1) / checksum_block_size):
+            return None
+        return checksums
+
+    def replay_backup_slice(self, copy_slice_item_backup_file_size, device_offset, slice_size, checksums=None):
+        """
+        complete the backup of the slice at device_offset and write it to the destination.
+        with the checksums of the slice, a complete backup is verified first and
+        only the blocks of the destination which do not match are written again.
+        """
+        backup_file_path = self.encryption_environment.copy_slice_item_backup_file
+        if(checksums is not None):
+            verified_size = self.slice_copier.get_verified_size(backup_file_path, slice_size, checksums)
+            if(verified_size == slice_size):
+                (returnCode, written_size) = self.slice_copier.replay_verified(backup_file_path, self.destination, device_offset, slice_size, checksums)
+                self.logger.log("replayed the backup slice at {0}, {1} of {2} bytes were already on the destination".format(device_offset, slice_size - written_size, slice_size))
+                return returnCode
+            # the destination is only written once the whole backup is durable, so the source is still intact.
+            self.logger.log(msg="the backup slice at {0} is only valid for {1} of {2} bytes, completing it from the source".format(device_offset, verified_size, slice_size), level = CommonVariables.WarningLevel)
+            copy_slice_item_backup_file_size = verified_size
+        left_size = slice_size - copy_slice_item_backup_file_size
+        if(left_size != 0):
+            # the destination is not touched until the backup is complete, so the source is still intact.
+            returnCode = self.slice_copier.copy_range(from_path = self.source_dev_full_path, from_offset = device_offset + copy_slice_item_backup_file_size, \
+                                                      to_path = self.encryption_environment.copy_slice_item_backup_file, to_offset = copy_slice_item_backup_file_size, \
+                                                      length = left_size)
+            if(returnCode != CommonVariables.process_success):
+                return returnCode
+        return self.slice_copier.copy_range(from_path = self.encryption_environment.copy_slice_item_backup_file, from_offset = 0, \
+                                            to_path = self.destination, to_offset = device_offset, \
+                                            length = slice_size)
 
     def resume_copy_internal(self, copy_slice_item_backup_file_size, skip_block, original_total_copy_size):
-        block_size_of_slice_item_backup = 512
         #copy the left slice
         if(copy_slice_item_backup_file_size <= original_total_copy_size):
-            skip_of_slice_item_backup_file = copy_slice_item_backup_file_size / block_size_of_slice_item_backup
-            left_count = ((original_total_copy_size - copy_slice_item_backup_file_size) / block_size_of_slice_item_backup)
-            total_count = original_total_copy_size / block_size_of_slice_item_backup
-            original_device_skip_count = (self.block_size * skip_block) / block_size_of_slice_item_backup 
-            if(left_count != 0):
-                dd_cmd = str(self.copy_command) + ' if=' + self.source_dev_full_path + ' of=' + self.encryption_environment.copy_slice_item_backup_file \
-                                 + ' bs=' + str(block_size_of_slice_item_backup) + ' skip=' + str(original_device_skip_count + skip_of_slice_item_backup_file) + ' seek=' + str(skip_of_slice_item_backup_file) + ' count=' + str(left_count)
-                returnCode = self.command_executer.Execute(dd_cmd)
-                if(returnCode != CommonVariables.process_success):
-                    return returnCode
-            dd_cmd = str(self.copy_command) + ' if=' + self.encryption_environment.copy_slice_item_backup_file + ' of=' + self.destination \
-                        + ' bs=' + str(block_size_of_slice_item_backup) + ' seek=' + str(original_device_skip_count) + ' count=' + str(total_count)
-            returnCode = self.command_executer.Execute(dd_cmd)
+            device_offset = self.block_size * skip_block
+            returnCode = self.replay_backup_slice(copy_slice_item_backup_file_size, device_offset, original_total_copy_size, \
+                                                  self.get_backup_slice_checksums(device_offset, original_total_copy_size))
             if(returnCode != CommonVariables.process_success):
                 return returnCode
             else:
                 self.current_slice_index += 1
                 self.ongoing_item_config.current_slice_index = self.current_slice_index
                 self.ongoing_item_config.commit()
+                self.report_progress(self.get_copied_size_by_index())
                 if(os.path.exists(self.encryption_environment.copy_slice_item_backup_file)):
                     os.remove(self.encryption_environment.copy_slice_item_backup_file)
                 return returnCode
@@ -130,7 +180,10 @@ class TransactionalCopyTask(object):
         check the device_item size first, cut it
         """
         returnCode = CommonVariables.success
+        if(self.pipelined and self.from_end.lower() == 'true'):
+            return self.begin_copy_pipelined()
         self.resume_copy()
+        self.start_progress(self.get_copied_size_by_index())
         if(self.from_end.lower() == 'true'):
             while(self.current_slice_index < self.total_slice_size):
                 skip_block = (self.total_slice_size - self.current_slice_index - 1)
@@ -151,6 +204,7 @@ class TransactionalCopyTask(object):
                 self.current_slice_index += 1
                 self.ongoing_item_config.current_slice_index = self.current_slice_index
                 self.ongoing_item_config.commit()
+                self.report_progress(self.get_copied_size_by_index())
 
             return CommonVariables.process_success
         else:
@@ -173,57 +227,158 @@ class TransactionalCopyTask(object):
                 self.current_slice_index += 1
                 self.ongoing_item_config.current_slice_index = self.current_slice_index
                 self.ongoing_item_config.commit()
+                self.report_progress(self.get_copied_size_by_index())
             return CommonVariables.process_success
 
-    """
-    TODO: if the copy failed?
-    """
-    def copy_internal(self, from_device, to_device,  block_size, skip=0, seek=0, count=1):
+    def get_copied_size_by_index(self):
+        if(self.current_slice_index == 0):
+            return 0
+        if(self.from_end.lower() == 'true'):
+            # the slice 0 is the last slice.
+            return self.last_slice_size + (self.current_slice_index - 1) * self.block_size
+        return min(self.current_slice_index * self.block_size, self.total_size)
+
+    def get_copied_size(self):
+        """
+        the bytes already copied from the end, the versions before the
+        adaptive slice size only kept the slice index.
+        """
+        if(self.current_slice_index == 0):
+            return 0
+        copied_size = self.ongoing_item_config.get_copied_size()
+        if(copied_size is None):
+            copied_size = self.get_copied_size_by_index()
+        return copied_size
+
+    def start_progress(self, copied_size):
+        if(self.progress_reporter is None):
+            return
+        device = self.ongoing_item_config.get_original_dev_path()
+        if(device is None or device == ""):
+            device = self.destination
+        self.copy_progress = CopyProgress(device, self.total_size, copied_size)
+
+    def report_progress(self, copied_size):
+        if(self.copy_progress is None):
+            return
+        self.progress_reporter.update(self.copy_progress.update(copied_size))
+
+    def slice_copied(self, slice_size):
+        self.copied_size += slice_size
+        self.current_slice_index += 1
+        self.ongoing_item_config.copied_size = self.copied_size
+        self.ongoing_item_config.current_slice_index = self.current_slice_index
+        self.ongoing_item_config.backup_slice_size = 0
+        self.ongoing_item_config.backup_slice_checksums = ""
+        self.ongoing_item_config.adaptive_block_size = self.slice_size_tuner.get_slice_size()
+        self.ongoing_item_config.commit()
+        self.report_progress(self.copied_size)
+
+    def resume_backup_slice(self):
         """
-        first, copy the data to the middle cache
+        the pipelined copy records the range of the slice in the backup file
+        before writing it, so the slice could be replayed whatever its size was.
         """
-        dd_cmd = str(self.copy_command) + ' if=' + from_device + ' of=' + self.slice_file_path + ' bs=' + str(block_size) + ' skip=' + str(skip) + ' count=' + str(count)
-        returnCode = self.command_executer.Execute(dd_cmd)
+        backup_file_path = self.encryption_environment.copy_slice_item_backup_file
+        backup_slice_size = self.ongoing_item_config.get_backup_slice_size()
+        if(backup_slice_size is None):
+            # the backup was written by a version which did not record its range.
+            returnCode = self.resume_copy()
+            self.copied_size = self.get_copied_size()
+            return returnCode
+        if(not os.path.exists(backup_file_path)):
+            return CommonVariables.process_success
+        backup_slice_offset = self.ongoing_item_config.get_backup_slice_offset()
+        if(backup_slice_size == 0 or backup_slice_offset + backup_slice_size != self.total_size - self.copied_size):
+            self.logger.log(msg="the slice item backup file is stale, removing it.", level = CommonVariables.WarningLevel)
+            os.remove(backup_file_path)
+            return CommonVariables.process_success
+        copy_slice_item_backup_file_size = os.path.getsize(backup_file_path)
+        if(copy_slice_item_backup_file_size > backup_slice_size):
+            self.logger.log(msg="copy_slice_item_backup_file_size is bigger than the backup slice size", level = CommonVariables.ErrorLevel)
+            return CommonVariables.backup_slice_file_error
+        returnCode = self.replay_backup_slice(copy_slice_item_backup_file_size, backup_slice_offset, backup_slice_size, \
+                                              self.get_backup_slice_checksums(backup_slice_offset, backup_slice_size))
         if(returnCode != CommonVariables.process_success):
-            self.logger.log(msg=("{0} is {1}".format(dd_cmd,returnCode)), level = CommonVariables.ErrorLevel)
             return returnCode
-        else:
-            slice_file_size = os.path.getsize(self.slice_file_path)
-            self.logger.log(msg=("slice_file_size is: {0}".format(slice_file_size)))
-            """
-            second, copy the data in the middle cache to the backup slice.
-            """
-            backup_slice_item_cmd = str(self.copy_command) + ' if=' + self.slice_file_path + ' of=' + self.encryption_environment.copy_slice_item_backup_file + ' bs=' + str(block_size) + ' count=' + str(count)
-            backup_slice_args = shlex.split(backup_slice_item_cmd)
-            backup_process = Popen(backup_slice_args)
-            self.logger.log("backup_slice_item_cmd is:{0}".format(backup_slice_item_cmd))
-
-            """
-            third, copy the data in the middle cache to the target device.
-            """
-            dd_cmd = str(self.copy_command) + ' if=' + self.slice_file_path + ' of=' + to_device + ' bs=' + str(block_size) + ' seek=' + str(seek) + ' count=' + str(count)
-            returnCode = self.command_executer.Execute(dd_cmd)
-            if(returnCode != CommonVariables.process_success):
-                self.logger.log(msg=("{0} is: {1}".format(dd_cmd, returnCode)), level = CommonVariables.ErrorLevel)
-            else:
-                #the copy done correctly, so clear the backup slice file item.
-                backup_process.kill()
-                if(os.path.exists(self.encryption_environment.copy_slice_item_backup_file)):
-                    self.logger.log(msg = "clean up the backup file")
-                    os.remove(self.encryption_environment.copy_slice_item_backup_file)
-                if(os.path.exists(self.slice_file_path)):
-                    self.logger.log(msg = "clean up the slice file")
-                    os.remove(self.slice_file_path)
+        self.slice_copied(backup_slice_size)
+        os.remove(backup_file_path)
+        return CommonVariables.process_success
+
+    def get_remaining_slices(self):
+        """
+        yields (offset, length, extents) from the end, the length is asked from
+        the tuner for every slice, so the slices follow its last decision.
+        """
+        remaining_size = self.total_size - self.copied_size
+        while(remaining_size > 0):
+            slice_size = self.slice_size_tuner.get_slice_size()
+            length = remaining_size % slice_size
+            if(length == 0):
+                length = slice_size
+            offset = remaining_size - length
+            extents = None
+            if(self.allocation_map is not None):
+                extents = [(extent_offset - offset, extent_length) for (extent_offset, extent_length) in self.allocation_map.get_allocated_extents(offset, length)]
+            yield (offset, length, extents)
+            remaining_size = offset
+
+    def begin_copy_pipelined(self):
+        """
+        only the copy from the end is pipelined, the slice size could change
+        between the slices so the progress is kept in bytes.
+        """
+        initial_block_size = self.ongoing_item_config.get_adaptive_block_size()
+        if(initial_block_size is None):
+            initial_block_size = self.block_size
+        buffer_count = CommonVariables.copy_pipeline_depth + 1
+        self.slice_size_tuner = SliceSizeTuner(logger = self.logger, initial_size = initial_block_size, \
+                                               min_size = min(CommonVariables.adaptive_slice_min_size, self.block_size), \
+                                               max_size = SliceSizeTuner.get_max_size(buffer_count))
+        self.copied_size = self.get_copied_size()
+        self.start_progress(self.copied_size)
+        returnCode = self.resume_backup_slice()
+        if(returnCode != CommonVariables.process_success):
             return returnCode
 
-    def prepare_mem_fs(self):
-        self.disk_util.make_sure_path_exists(self.tmpfs_mount_point)
-        commandToExecute = self.patching.mount_path + " -t tmpfs -o size=" + str(self.block_size + 1024) + " tmpfs " + self.tmpfs_mount_point
-        self.logger.log("prepare mem fs script is: {0}".format(commandToExecute))
-        returnCode = self.command_executer.Execute(commandToExecute)
-        return returnCode
+        last_done_time = [time.time()]
+
+        def slice_start(offset, length, checksums):
+            self.record_backup_slice(offset, length, checksums)
 
-    def clear_mem_fs(self):
-        commandToExecute = self.patching.umount_path + " " + self.tmpfs_mount_point
-        returnCode = self.command_executer.Execute(commandToExecute)
+        def slice_done(offset, length, transferred):
+            self.slice_copied(length)
+            now = time.time()
+            self.slice_size_tuner.record(length, transferred, now - last_done_time[0])
+            last_done_time[0] = now
+
+        copy_result = self.slice_copier.copy_slices_pipelined(from_device = self.source_dev_full_path, to_device = self.destination, \
+                                                              slices = self.get_remaining_slices(), \
+                                                              backup_file_path = self.encryption_environment.copy_slice_item_backup_file, \
+                                                              slice_done = slice_done, depth = CommonVariables.copy_pipeline_depth, slice_start = slice_start)
+        if(copy_result != CommonVariables.process_success):
+            self.logger.log(msg=("pipelined copy from {0} to {1} failed with {3}, {2} bytes left".format(self.source_dev_full_path, self.destination, self.total_size - self.copied_size, copy_result)), level = CommonVariables.ErrorLevel)
+            return copy_result
+        return CommonVariables.process_success
+
+    def copy_internal(self, from_device, to_device,  block_size, skip=0, seek=0, count=1):
+        """
+        skip, seek and count are in units of block_size, same as dd.
+        the slice is staged in memory and persisted to the backup slice file
+        before the destination is overwritten.
+        """
+        length = block_size * count
+        returnCode = self.slice_copier.copy_slice(from_device = from_device, to_device = to_device, \
+                                                  from_offset = block_size * skip, to_offset = block_size * seek, \
+                                                  length = length, backup_file_path = self.encryption_environment.copy_slice_item_backup_file, \
+                                                  slice_start = lambda checksums: self.record_backup_slice(block_size * skip, length, checksums))
+        if(returnCode != CommonVariables.process_success):
+            self.logger.log(msg=("copy {0} bytes from {1} to {2} at slice {3} failed with {4}".format(length, from_device, to_device, skip, returnCode)), level = CommonVariables.ErrorLevel)
         return returnCode
+
+    def release_buffers(self):
+        """
+        the slices are staged in the memory buffers of the slice copier, only
+        the backup slice file goes to the disk, so there is no tmpfs to clean up.
+        """
+        self.slice_copier.release()
@@ -29,9 +29,12 @@ import os.path
 import re
 import shlex
 import string
+import struct
 import subprocess
 import sys
 import datetime
+import functools
+import threading
 import time
 import tempfile
 import traceback
@@ -41,6 +44,7 @@ import uuid
 
 from Utils import HandlerUtil
 from Common import *
+from AllocationMap import AllocationMap
 from ExtensionParameter import ExtensionParameter
 from DiskUtil import DiskUtil
 from BackupLogger import BackupLogger
@@ -48,11 +52,15 @@ from KeyVaultUtil import KeyVaultUtil
 from EncryptionConfig import *
 from patch import *
 from BekUtil import *
+from CopyProgress import ProgressReporter
 from DecryptionMarkConfig import DecryptionMarkConfig
+from DeviceTaskScheduler import DeviceTaskScheduler
 from EncryptionMarkConfig import EncryptionMarkConfig
 from EncryptionEnvironment import EncryptionEnvironment
+from IORateLimiter import IORateLimiter
 from MachineIdentity import MachineIdentity
 from OnGoingItemConfig import OnGoingItemConfig
+from PhaseTimeline import PhaseTimeline
 from ProcessLock import ProcessLock
 from __builtin__ import int
 #Main function is the only entrence to this extension handler
@@ -135,6 +143,9 @@ def disable_encryption():
 
         decryption_marker.command = extension_parameter.command
         decryption_marker.volume_type = extension_parameter.VolumeType
+        decryption_marker.copy_bandwidth_limit = extension_parameter.CopyBandwidthLimit
+        decryption_marker.copy_iops_limit = extension_parameter.CopyIopsLimit
+        decryption_marker.adaptive_copy_throttle = extension_parameter.AdaptiveCopyThrottle
         decryption_marker.commit()
 
         hutil.do_exit(exit_code=0,
@@ -175,15 +186,23 @@ def none_or_empty(obj):
     else:
         return False
 
+# the devices could be encrypted in parallel, se linux is enabled again when the last one is done with it.
+se_linux_lock = threading.Lock()
+se_linux_users = [0]
+
 def toggle_se_linux_for_centos7(disable):
     if(MyPatching.distro_info[0].lower() == 'centos' and MyPatching.distro_info[1].startswith('7.0')):
-        if(disable):
-            se_linux_status = encryption_environment.get_se_linux()
-            if(se_linux_status.lower() == 'enforcing'):
-                encryption_environment.disable_se_linux()
-                return True
-        else:
-            encryption_environment.enable_se_linux()
+        with se_linux_lock:
+            if(disable):
+                se_linux_users[0] += 1
+                se_linux_status = encryption_environment.get_se_linux()
+                if(se_linux_status.lower() == 'enforcing'):
+                    encryption_environment.disable_se_linux()
+                    return True
+            else:
+                se_linux_users[0] = max(se_linux_users[0] - 1, 0)
+                if(se_linux_users[0] == 0):
+                    encryption_environment.enable_se_linux()
     return False
 
 def mount_encrypted_disks(disk_util, bek_util, passphrase_file, encryption_config):
@@ -247,14 +266,26 @@ def main():
         elif re.match("^([-/]*)(daemon)", a):
             daemon()
 
-def mark_encryption(command,volume_type,disk_format_query):
+def mark_encryption(command,volume_type,disk_format_query,skip_unallocated_blocks=None,extension_parameter=None):
     encryption_marker = EncryptionMarkConfig(logger, encryption_environment)
     encryption_marker.command = command
     encryption_marker.volume_type = volume_type
     encryption_marker.diskFormatQuery = disk_format_query
+    encryption_marker.skip_unallocated_blocks = skip_unallocated_blocks
+    if(extension_parameter is not None):
+        encryption_marker.copy_bandwidth_limit = extension_parameter.CopyBandwidthLimit
+        encryption_marker.copy_iops_limit = extension_parameter.CopyIopsLimit
+        encryption_marker.adaptive_copy_throttle = extension_parameter.AdaptiveCopyThrottle
+        encryption_marker.max_parallel_devices = extension_parameter.MaxParallelDevices
     encryption_marker.commit()
     return encryption_marker
 
+def create_copy_rate_limiter(marker):
+    """
+    marker is the encryption or the decryption mark, they keep the limits the enable call was given.
+    """
+    return IORateLimiter.from_settings(logger, marker.get_copy_bandwidth_limit(), marker.get_copy_iops_limit(), marker.get_adaptive_copy_throttle())
+
 def enable():
     hutil.do_parse_context('Enable')
     logger.log('Enabling extension')
@@ -354,7 +385,9 @@ def enable_encryption():
                 logger.log(msg="config file exists and passphrase file exists.", level=CommonVariables.WarningLevel)
                 encryption_marker = mark_encryption(command=extension_parameter.command, \
                                                   volume_type=extension_parameter.VolumeType, \
-                                                  disk_format_query=extension_parameter.DiskFormatQuery)
+                                                  disk_format_query=extension_parameter.DiskFormatQuery, \
+                                                  skip_unallocated_blocks=extension_parameter.SkipUnallocatedBlocks, \
+                                                  extension_parameter=extension_parameter)
                 start_daemon('EnableEncryption')
             else:
                 """
@@ -412,7 +445,9 @@ def enable_encryption():
    
                 encryption_marker = mark_encryption(command=extension_parameter.command, \
                                                   volume_type=extension_parameter.VolumeType, \
-                                                  disk_format_query=extension_parameter.DiskFormatQuery)
+                                                  disk_format_query=extension_parameter.DiskFormatQuery, \
+                                                  skip_unallocated_blocks=extension_parameter.SkipUnallocatedBlocks, \
+                                                  extension_parameter=extension_parameter)
 
                 if(kek_secret_id_created != None):
                     hutil.do_exit(exit_code=0,
@@ -512,15 +547,49 @@ def enable_encryption_format(passphrase, encryption_marker, disk_util):
             else:
                 logger.log(msg=("the item fstype is not empty {0}".format(device_item.file_system)))
 
-def encrypt_inplace_without_seperate_header_file(passphrase_file, device_item, disk_util, bek_util, ongoing_item_config=None):
+def get_allocation_map(ongoing_item_config, skip_unallocated_blocks, header_slice_file_path=None):
+    """
+    returns the allocation map of the current copy source, or None to copy all the blocks.
+    the map is built before the first slice is copied and kept for resuming,
+    because the copy overwrites the block bitmaps it is built from.
+    """
+    allocation_map_file_path = ongoing_item_config.get_allocation_map_file_path()
+    if(not none_or_empty(allocation_map_file_path) and os.path.exists(allocation_map_file_path)):
+        logger.log(msg="loading the allocation map {0}".format(allocation_map_file_path))
+        return AllocationMap.load(allocation_map_file_path)
+    if(not skip_unallocated_blocks):
+        return None
+    device_environment = ongoing_item_config.encryption_environment
+    if(ongoing_item_config.get_current_slice_index() != 0 or os.path.exists(device_environment.copy_slice_item_backup_file)):
+        logger.log(msg="the copy already started without allocation map, copy all the blocks.", level=CommonVariables.WarningLevel)
+        return None
+    try:
+        read_at = AllocationMap.create_reader(ongoing_item_config.get_current_source_path(), header_slice_file_path)
+        allocation_map = AllocationMap.from_ext_file_system(read_at, ongoing_item_config.get_current_total_copy_size(), logger)
+    except (IOError, OSError, struct.error) as e:
+        logger.log(msg="reading the allocation map failed, copy all the blocks: {0}".format(e), level=CommonVariables.WarningLevel)
+        return None
+    if(allocation_map is not None):
+        allocation_map.save(device_environment.copy_allocation_map_file_path)
+        ongoing_item_config.allocation_map_file_path = device_environment.copy_allocation_map_file_path
+        ongoing_item_config.commit()
+    return allocation_map
+
+def clear_allocation_map(ongoing_item_config):
+    allocation_map_file_path = ongoing_item_config.encryption_environment.copy_allocation_map_file_path
+    if(os.path.exists(allocation_map_file_path)):
+        os.remove(allocation_map_file_path)
+
+def encrypt_inplace_without_seperate_header_file(passphrase_file, device_item, disk_util, bek_util, ongoing_item_config=None, skip_unallocated_blocks=False):
     """
     if ongoing_item_config is not None, then this is a resume case.
     this function will return the phase 
+    skip_unallocated_blocks copies only the blocks the ext file system uses.
     """
     logger.log("encrypt_inplace_without_seperate_header_file")
     current_phase = CommonVariables.EncryptionPhaseBackupHeader
     if(ongoing_item_config is None):
-        ongoing_item_config = OnGoingItemConfig(encryption_environment = encryption_environment, logger = logger)
+        ongoing_item_config = OnGoingItemConfig(encryption_environment = encryption_environment.get_device_environment(device_item.name), logger = logger)
         ongoing_item_config.current_block_size = CommonVariables.default_block_size
         ongoing_item_config.current_slice_index = 0
         ongoing_item_config.device_size = device_item.size
@@ -540,6 +609,7 @@ def encrypt_inplace_without_seperate_header_file(passphrase_file, device_item, d
         logger.log(msg = "ongoing item config is not none, this is resuming, info: {0}".format(ongoing_item_config), level = CommonVariables.WarningLevel)
 
     logger.log(msg=("encrypting device item: {0}".format(ongoing_item_config.get_original_dev_path())))
+    device_environment = ongoing_item_config.encryption_environment
     # we only support ext file systems.
     current_phase = ongoing_item_config.get_phase()
 
@@ -558,6 +628,7 @@ def encrypt_inplace_without_seperate_header_file(passphrase_file, device_item, d
                 ongoing_item_config.clear_config()
                 return current_phase
 
+            disk_util.start_phase("shrink")
             chk_shrink_result = disk_util.check_shrink_fs(dev_path = original_dev_path, size_shrink_to = size_shrink_to)
             if(chk_shrink_result != CommonVariables.process_success):
                 logger.log(msg = ("check shrink fs failed with code {0} for {1}".format(chk_shrink_result, original_dev_path)), level = CommonVariables.ErrorLevel)
@@ -568,16 +639,17 @@ def encrypt_inplace_without_seperate_header_file(passphrase_file, device_item, d
             else:
                 ongoing_item_config.current_slice_index = 0
                 ongoing_item_config.current_source_path = original_dev_path
-                ongoing_item_config.current_destination = encryption_environment.copy_header_slice_file_path
+                ongoing_item_config.current_destination = device_environment.copy_header_slice_file_path
                 ongoing_item_config.current_total_copy_size = CommonVariables.default_block_size
                 ongoing_item_config.from_end = False
-                ongoing_item_config.header_slice_file_path = encryption_environment.copy_header_slice_file_path
+                ongoing_item_config.header_slice_file_path = device_environment.copy_header_slice_file_path
                 ongoing_item_config.original_dev_path = original_dev_path
                 ongoing_item_config.commit()
-                if(os.path.exists(encryption_environment.copy_header_slice_file_path)):
+                if(os.path.exists(device_environment.copy_header_slice_file_path)):
                     logger.log(msg="the header slice file is there, remove it.", level = CommonVariables.WarningLevel)
-                    os.remove(encryption_environment.copy_header_slice_file_path)
+                    os.remove(device_environment.copy_header_slice_file_path)
 
+                disk_util.start_phase("header backup")
                 copy_result = disk_util.copy(ongoing_item_config = ongoing_item_config)
 
                 if(copy_result != CommonVariables.process_success):
@@ -590,6 +662,7 @@ def encrypt_inplace_without_seperate_header_file(passphrase_file, device_item, d
                     current_phase = CommonVariables.EncryptionPhaseEncryptDevice
         elif(current_phase == CommonVariables.EncryptionPhaseEncryptDevice):
             logger.log(msg=("the current phase is {0}".format(CommonVariables.EncryptionPhaseEncryptDevice)),level = CommonVariables.InfoLevel)
+            disk_util.start_phase("luksFormat")
             encrypt_result = disk_util.encrypt_disk(dev_path = original_dev_path, passphrase_file = passphrase_file, mapper_name = mapper_name, header_file = None)
             # after the encrypt_disk without seperate header, then the uuid
             # would change.
@@ -612,11 +685,17 @@ def encrypt_inplace_without_seperate_header_file(passphrase_file, device_item, d
             ongoing_item_config.phase = CommonVariables.EncryptionPhaseCopyData
             ongoing_item_config.commit()
 
-            copy_result = disk_util.copy(ongoing_item_config = ongoing_item_config)
+            # the luks header overwrote the beginning of the device, the header slice file keeps it.
+            disk_util.start_phase("copy")
+            allocation_map = get_allocation_map(ongoing_item_config, skip_unallocated_blocks, ongoing_item_config.get_header_slice_file_path())
+            # the data moves towards the end of the device and we copy from the end,
+            # so reading the next slice ahead never sees a region being written.
+            copy_result = disk_util.copy(ongoing_item_config = ongoing_item_config, pipelined = True, allocation_map = allocation_map)
             if(copy_result != CommonVariables.process_success):
                 logger.log(msg = ("copy the main content block failed, return code is: {0}".format(copy_result)),level = CommonVariables.ErrorLevel)
                 return current_phase
             else:
+                clear_allocation_map(ongoing_item_config)
                 ongoing_item_config.phase = CommonVariables.EncryptionPhaseRecoverHeader
                 ongoing_item_config.commit()
                 current_phase = CommonVariables.EncryptionPhaseRecoverHeader
@@ -632,6 +711,7 @@ def encrypt_inplace_without_seperate_header_file(passphrase_file, device_item, d
             ongoing_item_config.current_total_copy_size = CommonVariables.default_block_size
             ongoing_item_config.commit()
 
+            disk_util.start_phase("header restore")
             copy_result = disk_util.copy(ongoing_item_config = ongoing_item_config)
             if(copy_result == CommonVariables.process_success):
                 crypt_item_to_update = CryptItem()
@@ -659,15 +739,17 @@ def encrypt_inplace_without_seperate_header_file(passphrase_file, device_item, d
                     logger.log(msg=original_dev_name_path + " is not defined in fstab, no need to update",
                                level=CommonVariables.InfoLevel)
 
-                if(os.path.exists(encryption_environment.copy_header_slice_file_path)):
-                    os.remove(encryption_environment.copy_header_slice_file_path)
+                if(os.path.exists(device_environment.copy_header_slice_file_path)):
+                    os.remove(device_environment.copy_header_slice_file_path)
 
                 current_phase = CommonVariables.EncryptionPhaseDone
                 ongoing_item_config.phase = current_phase
                 ongoing_item_config.commit()
+                disk_util.start_phase("expand")
                 expand_fs_result = disk_util.expand_fs(dev_path=device_mapper_path)
 
                 if(crypt_item_to_update.mount_point != "None"):
+                    disk_util.start_phase("mount")
                     disk_util.mount_filesystem(device_mapper_path, ongoing_item_config.get_mount_point())
                 else:
                     logger.log("the crypt_item_to_update.mount_point is None, so we do not mount it.")
@@ -680,14 +762,15 @@ def encrypt_inplace_without_seperate_header_file(passphrase_file, device_item, d
                 logger.log(msg=("recover header failed result is: {0}".format(copy_result)),level = CommonVariables.ErrorLevel)
                 return current_phase
 
-def encrypt_inplace_with_seperate_header_file(passphrase_file, device_item, disk_util, bek_util, ongoing_item_config=None):
+def encrypt_inplace_with_seperate_header_file(passphrase_file, device_item, disk_util, bek_util, ongoing_item_config=None, skip_unallocated_blocks=False):
     """
     if ongoing_item_config is not None, then this is a resume case.
+    skip_unallocated_blocks copies only the blocks the ext file system uses.
     """
     logger.log("encrypt_inplace_with_seperate_header_file")
     current_phase = CommonVariables.EncryptionPhaseEncryptDevice
     if(ongoing_item_config is None):
-        ongoing_item_config = OnGoingItemConfig(encryption_environment=encryption_environment,logger=logger)
+        ongoing_item_config = OnGoingItemConfig(encryption_environment=encryption_environment.get_device_environment(device_item.name),logger=logger)
         mapper_name = str(uuid.uuid4())
         ongoing_item_config.current_block_size = CommonVariables.default_block_size
         ongoing_item_config.current_slice_index = 0
@@ -721,6 +804,7 @@ def encrypt_inplace_with_seperate_header_file(passphrase_file, device_item, disk
                 original_dev_path = ongoing_item_config.get_original_dev_path()
                 luks_header_file_path = ongoing_item_config.get_header_file_path()
                 disabled = toggle_se_linux_for_centos7(True)
+                disk_util.start_phase("luksFormat")
                 encrypt_result = disk_util.encrypt_disk(dev_path = original_dev_path, passphrase_file = passphrase_file, \
                                                         mapper_name = mapper_name, header_file = luks_header_file_path)
                 if(encrypt_result != CommonVariables.process_success):
@@ -742,6 +826,7 @@ def encrypt_inplace_with_seperate_header_file(passphrase_file, device_item, disk
                 disabled = toggle_se_linux_for_centos7(True)
                 device_mapper_path = os.path.join("/dev/mapper", mapper_name)
                 if(not os.path.exists(device_mapper_path)):
+                    disk_util.start_phase("luksOpen")
                     open_result = disk_util.luks_open(passphrase_file=passphrase_file,
                                                       dev_path=original_dev_path,
                                                       mapper_name=mapper_name,
@@ -765,12 +850,15 @@ def encrypt_inplace_with_seperate_header_file(passphrase_file, device_item, disk
                 ongoing_item_config.from_end = True
                 ongoing_item_config.commit()
 
-                copy_result = disk_util.copy(ongoing_item_config = ongoing_item_config)
+                disk_util.start_phase("copy")
+                allocation_map = get_allocation_map(ongoing_item_config, skip_unallocated_blocks)
+                copy_result = disk_util.copy(ongoing_item_config = ongoing_item_config, pipelined = True, allocation_map = allocation_map)
                 if(copy_result != CommonVariables.success):
                     error_message = "the copying result is {0} so skip the mounting".format(copy_result)
                     logger.log(msg = (error_message), level = CommonVariables.ErrorLevel)
                     return current_phase
                 else:
+                    clear_allocation_map(ongoing_item_config)
                     crypt_item_to_update = CryptItem()
                     crypt_item_to_update.mapper_name = mapper_name
                     original_dev_name_path = ongoing_item_config.get_original_dev_name_path()
@@ -789,6 +877,7 @@ def encrypt_inplace_with_seperate_header_file(passphrase_file, device_item, disk
                     if(not update_crypt_item_result):
                         logger.log(msg="update crypt item failed", level = CommonVariables.ErrorLevel)
                     if(crypt_item_to_update.mount_point != "None"):
+                        disk_util.start_phase("mount")
                         disk_util.mount_filesystem(device_mapper_path, mount_point)
                     else:
                         logger.log("the crypt_item_to_update.mount_point is None, so we do not mount it.")
@@ -917,9 +1006,14 @@ def enable_encryption_all_in_place(passphrase_file, encryption_marker, disk_util
     if return None for the success case, or return the device item which failed.
     """
     logger.log(msg="executing the enableencryption_all_inplace command.")
-    device_items = disk_util.get_device_items(None)
+    # one snapshot of the devices serves the listing and all the skip checks.
+    device_items = disk_util.get_device_inventory().get_items()
     encrypted_items = []
     error_message = ""
+    skip_unallocated_blocks = encryption_marker.get_skip_unallocated_blocks()
+    # the devices on different disks are encrypted at the same time, the ones sharing a disk one by one.
+    scheduler = DeviceTaskScheduler(logger, encryption_marker.get_max_parallel_devices())
+    scheduled_items = {}
     for device_item in device_items:
         logger.log("device_item == " + str(device_item))
 
@@ -932,29 +1026,88 @@ def enable_encryption_all_in_place(passphrase_file, encryption_marker, disk_util
                 logger.log("already did a operation {0} so skip it".format(device_item))
                 should_skip = True
         if(not should_skip):
-            umount_status_code = CommonVariables.success
-            if(device_item.mount_point is not None and device_item.mount_point != ""):
-                umount_status_code = disk_util.umount(device_item.mount_point)
-            if(umount_status_code != CommonVariables.success):
-                logger.log("error occured when do the umount for: {0} with code: {1}".format(device_item.mount_point, umount_status_code))
-            else:
-                encrypted_items.append(device_item.uuid)
-                logger.log(msg=("encrypting:{0}".format(device_item)))
-                no_header_file_support = not_support_header_option_distro(MyPatching)
-                #TODO check the file system before encrypting it.
-                if(no_header_file_support):
-                    logger.log(msg="this is the centos 6 or redhat 6 or sles 11 series , need special handling.", level=CommonVariables.WarningLevel)
-                    encryption_result_phase = encrypt_inplace_without_seperate_header_file(passphrase_file = passphrase_file, device_item = device_item,disk_util = disk_util, bek_util = bek_util)
-                else:
-                    encryption_result_phase = encrypt_inplace_with_seperate_header_file(passphrase_file = passphrase_file, device_item = device_item,disk_util = disk_util, bek_util = bek_util)
-                
-                if(encryption_result_phase == CommonVariables.EncryptionPhaseDone):
-                    continue
-                else:
-                    # do exit to exit from this round
-                    return device_item
+            encrypted_items.append(device_item.uuid)
+            scheduled_items[device_item.name] = device_item
+            scheduler.add_task(device_item.name, disk_util.get_physical_disks(device_item.name), \
+                               functools.partial(run_with_phase_timeline, device_item.name, disk_util, \
+                                                 functools.partial(encrypt_device_item, passphrase_file, device_item, disk_util, bek_util, skip_unallocated_blocks)))
+
+    # a skipped device returns None.
+    scheduler.run(succeeded = lambda phase: phase is None or phase == CommonVariables.EncryptionPhaseDone)
+    for task in scheduler.tasks:
+        if(not task.started or (task.result is not None and task.result != CommonVariables.EncryptionPhaseDone)):
+            # do exit to exit from this round
+            return scheduled_items[task.name]
     return None
 
+def run_with_phase_timeline(device, disk_util, func):
+    """
+    runs func with a PhaseTimeline of device recording the phases and the
+    commands of this thread, the timeline goes to the log and the status once func returns.
+    """
+    timeline = PhaseTimeline(device)
+    disk_util.command_executer.set_timeline(timeline)
+    try:
+        return func()
+    finally:
+        timeline.end_phase()
+        disk_util.command_executer.set_timeline(None)
+        logger.log("phase timeline of {0}".format(timeline))
+        if(disk_util.copy_progress_reporter is not None):
+            disk_util.copy_progress_reporter.add_timeline(timeline)
+
+def with_phase_timelines(message, disk_util):
+    if(disk_util.copy_progress_reporter is None):
+        return message
+    timelines_message = disk_util.copy_progress_reporter.get_timelines_message()
+    if(timelines_message == ""):
+        return message
+    return "{0}, phase timelines: {1}".format(message, timelines_message)
+
+def encrypt_device_item(passphrase_file, device_item, disk_util, bek_util, skip_unallocated_blocks):
+    """
+    returns the phase the encryption of device_item stopped in, None when it is skipped.
+    """
+    umount_status_code = CommonVariables.success
+    if(device_item.mount_point is not None and device_item.mount_point != ""):
+        disk_util.start_phase("umount")
+        umount_status_code = disk_util.umount(device_item.mount_point)
+    if(umount_status_code != CommonVariables.success):
+        logger.log("error occured when do the umount for: {0} with code: {1}".format(device_item.mount_point, umount_status_code))
+        return None
+    logger.log(msg=("encrypting:{0}".format(device_item)))
+    no_header_file_support = not_support_header_option_distro(MyPatching)
+    #TODO check the file system before encrypting it.
+    if(no_header_file_support):
+        logger.log(msg="this is the centos 6 or redhat 6 or sles 11 series , need special handling.", level=CommonVariables.WarningLevel)
+        return encrypt_inplace_without_seperate_header_file(passphrase_file = passphrase_file, device_item = device_item,disk_util = disk_util, bek_util = bek_util, \
+                                                            skip_unallocated_blocks = skip_unallocated_blocks)
+    else:
+        return encrypt_inplace_with_seperate_header_file(passphrase_file = passphrase_file, device_item = device_item,disk_util = disk_util, bek_util = bek_util, \
+                                                         skip_unallocated_blocks = skip_unallocated_blocks)
+
+def resume_encryption(passphrase_file, ongoing_item_config, disk_util, bek_util, skip_unallocated_blocks):
+    """
+    returns the phase the resumed encryption stopped in.
+    """
+    header_file_path = ongoing_item_config.get_header_file_path()
+    mount_point = ongoing_item_config.get_mount_point()
+    if(not none_or_empty(mount_point)):
+        logger.log("mount point is not empty {0}, trying to unmount it first.".format(mount_point))
+        disk_util.start_phase("umount")
+        umount_status_code = disk_util.umount(mount_point)
+        logger.log("unmount return code is {0}".format(umount_status_code))
+    if(none_or_empty(header_file_path)):
+        encryption_result_phase = encrypt_inplace_without_seperate_header_file(passphrase_file = passphrase_file, device_item = None,\
+            disk_util = disk_util, bek_util = bek_util, ongoing_item_config = ongoing_item_config, skip_unallocated_blocks = skip_unallocated_blocks)
+        #TODO mount it back when shrink failed
+    else:
+        encryption_result_phase = encrypt_inplace_with_seperate_header_file(passphrase_file = passphrase_file, device_item = None,\
+            disk_util = disk_util, bek_util = bek_util, ongoing_item_config = ongoing_item_config, skip_unallocated_blocks = skip_unallocated_blocks)
+    if(encryption_result_phase == CommonVariables.EncryptionPhaseDone):
+        ongoing_item_config.clear_config()
+    return encryption_result_phase
+
 
 def disable_encryption_all_in_place(passphrase_file, decryption_marker, disk_util):
     """
@@ -1030,6 +1183,8 @@ def daemon_encrypt():
     search for the bek volume, then mount it:)
     """
     disk_util = DiskUtil(hutil, MyPatching, logger, encryption_environment)
+    disk_util.copy_rate_limiter = create_copy_rate_limiter(encryption_marker)
+    disk_util.copy_progress_reporter = ProgressReporter(hutil, logger, 'Enable')
 
     encryption_config = EncryptionConfig(encryption_environment,logger)
     bek_passphrase_file = None
@@ -1063,35 +1218,29 @@ def daemon_encrypt():
         we need the special handling is because the half done device can be a error state: say, the file system header missing.so it could be 
         identified.
         """
-        ongoing_item_config = OnGoingItemConfig(encryption_environment=encryption_environment, logger=logger)
-        if(ongoing_item_config.config_file_exists()):
-            logger.log("ongoing item config exists.")
-            ongoing_item_config.load_value_from_file()
-            header_file_path = ongoing_item_config.get_header_file_path()
-            mount_point = ongoing_item_config.get_mount_point()
-            if(not none_or_empty(mount_point)):
-                logger.log("mount point is not empty {0}, trying to unmount it first.".format(mount_point))
-                umount_status_code = disk_util.umount(mount_point)
-                logger.log("unmount return code is {0}".format(umount_status_code))
-            if(none_or_empty(header_file_path)):
-                encryption_result_phase = encrypt_inplace_without_seperate_header_file(passphrase_file = bek_passphrase_file, device_item = None,\
-                    disk_util = disk_util, bek_util = bek_util, ongoing_item_config = ongoing_item_config)
-                #TODO mount it back when shrink failed
-            else:
-                encryption_result_phase = encrypt_inplace_with_seperate_header_file(passphrase_file = bek_passphrase_file, device_item = None,\
-                    disk_util = disk_util, bek_util = bek_util, ongoing_item_config = ongoing_item_config)
+        ongoing_environments = encryption_environment.get_ongoing_environments()
+        if(len(ongoing_environments) > 0):
+            logger.log("ongoing item config exists for {0} devices.".format(len(ongoing_environments)))
+            skip_unallocated_blocks = encryption_marker.get_skip_unallocated_blocks()
+            scheduler = DeviceTaskScheduler(logger, encryption_marker.get_max_parallel_devices())
+            for ongoing_environment in ongoing_environments:
+                ongoing_item_config = OnGoingItemConfig(encryption_environment=ongoing_environment, logger=logger)
+                ongoing_item_config.load_value_from_file()
+                original_dev_path = ongoing_item_config.get_original_dev_path()
+                scheduler.add_task(original_dev_path, disk_util.get_physical_disks(original_dev_path), \
+                                   functools.partial(run_with_phase_timeline, original_dev_path, disk_util, \
+                                                     functools.partial(resume_encryption, bek_passphrase_file, ongoing_item_config, disk_util, bek_util, skip_unallocated_blocks)))
+            scheduler.run(succeeded = lambda phase: phase == CommonVariables.EncryptionPhaseDone)
             """
             if the resuming failed, we should fail.
             """
-            if(encryption_result_phase != CommonVariables.EncryptionPhaseDone):
-                original_dev_path = ongoing_item_config.get_original_dev_path()
+            failed_devices = [task.name for task in scheduler.tasks if task.result != CommonVariables.EncryptionPhaseDone]
+            if(len(failed_devices) > 0):
                 hutil.do_exit(exit_code=0,
                               operation='Enable',
                               status=CommonVariables.extension_error_status,
                               code=CommonVariables.encryption_failed,
-                              message='resuming encryption for {0} failed'.format(original_dev_path))
-            else:
-                ongoing_item_config.clear_config()
+                              message=with_phase_timelines('resuming encryption for {0} failed'.format(", ".join(failed_devices)), disk_util))
         else:
             logger.log("ongoing item config not exists.")
             failed_item = None
@@ -1107,14 +1256,14 @@ def daemon_encrypt():
                               operation='Enable',
                               status=CommonVariables.extension_error_status,
                               code=CommonVariables.encryption_failed,
-                              message='encryption failed for {0}'.format(failed_item))
+                              message=with_phase_timelines('encryption failed for {0}'.format(failed_item), disk_util))
             else:
                 bek_util.umount_azure_passhprase(encryption_config)
                 hutil.do_exit(exit_code=0,
                               operation='Enable',
                               status=CommonVariables.extension_success_status,
                               code=str(CommonVariables.success),
-                              message='encryption succeeded')
+                              message=with_phase_timelines('encryption succeeded', disk_util))
 
 def daemon_decrypt():
     decryption_marker = DecryptionMarkConfig(logger, encryption_environment)
@@ -1130,6 +1279,8 @@ def daemon_decrypt():
     # we don't need the BEK since all the drives that need decryption were made cleartext-key unlockable by first call to disable
 
     disk_util = DiskUtil(hutil, MyPatching, logger, encryption_environment)
+    disk_util.copy_rate_limiter = create_copy_rate_limiter(decryption_marker)
+    disk_util.copy_progress_reporter = ProgressReporter(hutil, logger, 'Disable')
     encryption_config = EncryptionConfig(encryption_environment, logger)
     mount_encrypted_disks(disk_util=disk_util,
                           bek_util=None,
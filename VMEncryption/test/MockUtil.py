@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+import os
+import os.path
+import subprocess
+
+class MockLogger(object):
+    def __init__(self, verbose = False):
+        self.verbose = verbose
+        self.messages = []
+
+    def log(self, msg, level = 'Info'):
+        self.messages.append(msg)
+        if(self.verbose):
+            print msg
+
+class MockEncryptionEnvironment(object):
+    """
+    the files of the ongoing item are kept in work_dir instead of /var/lib/azure_disk_encryption_config.
+    """
+    def __init__(self, work_dir):
+        self.azure_crypt_ongoing_item_config_path = os.path.join(work_dir, 'azure_crypt_ongoing_item.ini')
+        self.azure_crypt_ongoing_item_journal_path = os.path.join(work_dir, 'azure_crypt_ongoing_item.journal')
+        self.copy_slice_item_backup_file = os.path.join(work_dir, 'copy_slice_item.bak')
+        self.copy_allocation_map_file_path = os.path.join(work_dir, 'copy_allocation_map')
+
+class MockPatching(object):
+    dd_path = 'dd'
+
+def e2fsprogs_available():
+    for tool in ['mkfs.ext4', 'debugfs', 'e2fsck']:
+        if(not any([os.path.exists(os.path.join(path, tool)) for path in os.environ.get('PATH', '').split(os.pathsep) + ['/sbin', '/usr/sbin']])):
+            return False
+    return True
+
+def run_e2fsprogs(args):
+    env = dict(os.environ)
+    env['PATH'] = env.get('PATH', '') + os.pathsep + '/sbin' + os.pathsep + '/usr/sbin'
+    proc = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.PIPE, env = env)
+    (stdout, stderr) = proc.communicate()
+    return (proc.returncode, stdout, stderr)
+
+def make_ext_image(image_path, size, mkfs_args):
+    with open(image_path, 'wb') as image_file:
+        image_file.truncate(size)
+    (return_code, stdout, stderr) = run_e2fsprogs(['mkfs.ext4', '-q', '-F'] + mkfs_args + [image_path])
+    if(return_code != 0):
+        raise Exception("mkfs.ext4 failed: {0}".format(stderr))
+
+def write_ext_file(image_path, source_path, name):
+    (return_code, stdout, stderr) = run_e2fsprogs(['debugfs', '-w', '-R', 'write {0} {1}'.format(source_path, name), image_path])
+    if(return_code != 0):
+        raise Exception("debugfs write failed: {0}".format(stderr))
+
+def read_ext_file(image_path, name, target_path):
+    (return_code, stdout, stderr) = run_e2fsprogs(['debugfs', '-R', 'dump /{0} {1}'.format(name, target_path), image_path])
+    if(return_code != 0 or not os.path.exists(target_path)):
+        raise Exception("debugfs dump failed: {0}".format(stderr))
+    with open(target_path, 'rb') as target_file:
+        return target_file.read()
+
+def get_ext_file_blocks(image_path, name):
+    """
+    the physical block numbers of the data of the file.
+    """
+    (return_code, stdout, stderr) = run_e2fsprogs(['debugfs', '-R', 'blocks /{0}'.format(name), image_path])
+    if(return_code != 0):
+        raise Exception("debugfs blocks failed: {0}".format(stderr))
+    return [int(block) for block in stdout.split()]
+
+def check_ext_image(image_path):
+    (return_code, stdout, stderr) = run_e2fsprogs(['e2fsck', '-fn', image_path])
+    return return_code == 0
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+import unittest
+import env
+import os
+import os.path
+import shutil
+import struct
+import tempfile
+from MockUtil import MockLogger
+from MockUtil import e2fsprogs_available, make_ext_image, write_ext_file, get_ext_file_blocks
+from AllocationMap import AllocationMap
+
+MB = 1024 * 1024
+
+class TestAllocationMap(unittest.TestCase):
+    def setUp(self):
+        if(not e2fsprogs_available()):
+            self.skipTest('mkfs.ext4 and debugfs are needed for the file system images')
+        self.work_dir = tempfile.mkdtemp()
+        self.image_path = os.path.join(self.work_dir, 'image')
+        self.file_path = os.path.join(self.work_dir, 'file')
+        with open(self.file_path, 'wb') as data_file:
+            data_file.write(os.urandom(8 * MB + 12345))
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def build_map(self, image_size, mkfs_args):
+        make_ext_image(self.image_path, image_size, mkfs_args)
+        write_ext_file(self.image_path, self.file_path, 'file')
+        read_at = AllocationMap.create_reader(self.image_path)
+        return AllocationMap.from_ext_file_system(read_at, image_size, MockLogger())
+
+    def assert_file_covered(self, allocation_map, block_size):
+        blocks = get_ext_file_blocks(self.image_path, 'file')
+        self.assertEqual((8 * MB + 12345 + block_size - 1) / block_size, len(blocks))
+        for block in blocks:
+            self.assertEqual([(block * block_size, block_size)], allocation_map.get_allocated_extents(block * block_size, block_size))
+
+    def test_ext4_map_covers_the_file(self):
+        image_size = 512 * MB
+        allocation_map = self.build_map(image_size, ['-b', '4096'])
+        self.assertNotEqual(None, allocation_map)
+        self.assert_file_covered(allocation_map, 4096)
+        self.assertTrue(allocation_map.get_allocated_size() < image_size / 2)
+
+    def test_ext4_1k_blocks_map_covers_the_file(self):
+        image_size = 256 * MB
+        allocation_map = self.build_map(image_size, ['-b', '1024'])
+        self.assertNotEqual(None, allocation_map)
+        self.assert_file_covered(allocation_map, 1024)
+        self.assertTrue(allocation_map.get_allocated_size() < image_size / 2)
+
+    def test_bigalloc_is_not_mapped(self):
+        # a bitmap bit is a cluster of 16 blocks here.
+        allocation_map = self.build_map(1024 * MB, ['-b', '4096', '-O', 'bigalloc', '-C', '65536'])
+        self.assertEqual(None, allocation_map)
+
+    def test_bigalloc_1k_blocks_is_not_mapped(self):
+        allocation_map = self.build_map(256 * MB, ['-b', '1024', '-O', 'bigalloc', '-C', '16384'])
+        self.assertEqual(None, allocation_map)
+
+    def test_unknown_incompat_feature_is_not_mapped(self):
+        image_size = 256 * MB
+        make_ext_image(self.image_path, image_size, ['-b', '4096'])
+        with open(self.image_path, 'r+b') as image_file:
+            image_file.seek(1024 + 0x60)
+            (feature_incompat,) = struct.unpack('<I', image_file.read(4))
+            image_file.seek(1024 + 0x60)
+            image_file.write(struct.pack('<I', feature_incompat | 0x80000000))
+        read_at = AllocationMap.create_reader(self.image_path)
+        self.assertEqual(None, AllocationMap.from_ext_file_system(read_at, image_size, MockLogger()))
+
+if __name__ == '__main__':
+    unittest.main()
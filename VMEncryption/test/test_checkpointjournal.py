@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+import unittest
+import env
+import os
+import os.path
+import shutil
+import tempfile
+from MockUtil import MockLogger
+from MockUtil import MockEncryptionEnvironment
+from CheckpointJournal import CheckpointJournal
+from OnGoingItemConfig import OnGoingItemConfig
+
+class TestCheckpointJournal(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.journal_path = os.path.join(self.work_dir, 'journal')
+        self.logger = MockLogger()
+        self.fsync = os.fsync
+        self.fsync_count = 0
+
+    def tearDown(self):
+        os.fsync = self.fsync
+        shutil.rmtree(self.work_dir)
+
+    def open_journal(self, fsync=False, compact_threshold=1024):
+        return CheckpointJournal(self.journal_path, self.logger, fsync=fsync, compact_threshold=compact_threshold)
+
+    def read_journal_file(self):
+        with open(self.journal_path, 'rb') as journal_file:
+            return journal_file.read()
+
+    def write_journal_file(self, content):
+        with open(self.journal_path, 'wb') as journal_file:
+            journal_file.write(content)
+
+    def count_fsync(self, fd):
+        self.fsync_count += 1
+
+    def test_replay(self):
+        journal = self.open_journal()
+        journal.append({'a': '1', 'b': '2'})
+        journal.append({'b': '3'})
+        journal.append({'c': '4'})
+        self.assertEqual(3, len(self.read_journal_file().splitlines()))
+        self.assertEqual({'a': '1', 'b': '3', 'c': '4'}, self.open_journal().load())
+
+    def test_replay_stops_at_torn_record(self):
+        journal = self.open_journal()
+        journal.append({'a': '1'})
+        journal.append({'a': '2'})
+        record = CheckpointJournal.encode_record({'a': '3'})
+        self.write_journal_file(self.read_journal_file() + record[:-5])
+        self.assertEqual({'a': '2'}, self.open_journal().load())
+
+    def test_replay_stops_at_bad_crc(self):
+        journal = self.open_journal()
+        journal.append({'a': '1'})
+        journal.append({'a': '2'})
+        journal.append({'a': '3'})
+        lines = self.read_journal_file().splitlines(True)
+        lines[1] = lines[1].replace('"2"', '"9"')
+        self.write_journal_file(''.join(lines))
+        # the records after the bad one are dropped too.
+        self.assertEqual({'a': '1'}, self.open_journal().load())
+
+    def test_append_truncates_torn_tail(self):
+        journal = self.open_journal()
+        journal.append({'a': '1'})
+        journal.append({'a': '2'})
+        self.write_journal_file(self.read_journal_file() + '0123abcd {"a":')
+        journal = self.open_journal()
+        self.assertEqual({'a': '2'}, journal.load())
+        journal.append({'a': '3'})
+        self.assertEqual(3, len(self.read_journal_file().splitlines()))
+        self.assertEqual({'a': '3'}, self.open_journal().load())
+
+    def test_compaction(self):
+        journal = self.open_journal(compact_threshold=4)
+        for i in range(0, 4):
+            journal.append({'index': str(i), 'fixed': 'x'})
+        self.assertEqual(4, len(self.read_journal_file().splitlines()))
+        journal.append({'index': '4'})
+        self.assertEqual([CheckpointJournal.encode_record({'index': '4', 'fixed': 'x'})], self.read_journal_file().splitlines(True))
+        self.assertFalse(os.path.exists(self.journal_path + '.tmp'))
+        journal.append({'index': '5'})
+        self.assertEqual(2, len(self.read_journal_file().splitlines()))
+        self.assertEqual({'index': '5', 'fixed': 'x'}, self.open_journal().load())
+
+    def test_unchanged_values_are_not_written(self):
+        journal = self.open_journal()
+        journal.append({'a': '1'})
+        journal.append({'a': '1'})
+        self.assertEqual(1, len(self.read_journal_file().splitlines()))
+
+    def test_no_fsync(self):
+        os.fsync = self.count_fsync
+        journal = self.open_journal(fsync=False, compact_threshold=2)
+        for i in range(0, 5):
+            journal.append({'index': str(i)})
+        self.assertEqual(0, self.fsync_count)
+        journal = self.open_journal(fsync=True, compact_threshold=2)
+        journal.append({'index': 'x'})
+        self.assertNotEqual(0, self.fsync_count)
+
+    def test_migration_from_ini(self):
+        environment = MockEncryptionEnvironment(self.work_dir)
+        with open(environment.azure_crypt_ongoing_item_config_path, 'w') as config_file:
+            config_file.write("[azure_crypt_ongoing_item_config]\nPhase = copy\nCurrentSliceIndex = 7\nMapperName = mapper\n")
+        ongoing_item_config = OnGoingItemConfig(environment, self.logger)
+        self.assertTrue(ongoing_item_config.config_file_exists())
+        ongoing_item_config.load_value_from_file()
+        self.assertEqual('copy', ongoing_item_config.phase)
+        self.assertEqual(7, ongoing_item_config.get_current_slice_index())
+        self.assertFalse(os.path.exists(environment.azure_crypt_ongoing_item_journal_path))
+        ongoing_item_config.current_slice_index = 8
+        ongoing_item_config.commit()
+        # the first record holds the migrated values with the change.
+        ongoing_item_config = OnGoingItemConfig(environment, self.logger)
+        os.remove(environment.azure_crypt_ongoing_item_config_path)
+        ongoing_item_config.load_value_from_file()
+        self.assertEqual('copy', ongoing_item_config.phase)
+        self.assertEqual('mapper', ongoing_item_config.mapper_name)
+        self.assertEqual(8, ongoing_item_config.get_current_slice_index())
+
+if __name__ == '__main__':
+    unittest.main()
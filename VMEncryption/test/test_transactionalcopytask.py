@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+#
+# VMEncryption extension
+#
+# Copyright 2015 Microsoft Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# Requires Python 2.7+
+#
+import unittest
+import env
+import mmap
+import os
+import os.path
+import shutil
+import tempfile
+from MockUtil import MockLogger
+from MockUtil import MockEncryptionEnvironment
+from MockUtil import MockPatching
+from MockUtil import e2fsprogs_available, make_ext_image, write_ext_file, read_ext_file, check_ext_image
+from AllocationMap import AllocationMap
+from Common import CommonVariables
+from OnGoingItemConfig import OnGoingItemConfig
+from SliceCopier import SliceCopier
+from TransactionalCopyTask import TransactionalCopyTask
+
+MB = 1024 * 1024
+
+class TestTransactionalCopyTask(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.environment = MockEncryptionEnvironment(self.work_dir)
+        self.source_path = os.path.join(self.work_dir, 'source')
+        self.destination_path = os.path.join(self.work_dir, 'destination')
+        self.logger = MockLogger()
+        self.adaptive_slice_min_size = CommonVariables.adaptive_slice_min_size
+        self.slice_checksum_block_size = CommonVariables.slice_checksum_block_size
+        # small slices, so a few MB go through many of them.
+        CommonVariables.adaptive_slice_min_size = MB
+        CommonVariables.slice_checksum_block_size = MB
+
+    def tearDown(self):
+        CommonVariables.adaptive_slice_min_size = self.adaptive_slice_min_size
+        CommonVariables.slice_checksum_block_size = self.slice_checksum_block_size
+        shutil.rmtree(self.work_dir)
+
+    def create_devices(self, total_size, source_data=None):
+        if(source_data is None):
+            source_data = os.urandom(total_size)
+        with open(self.source_path, 'wb') as source_file:
+            source_file.write(source_data)
+        with open(self.destination_path, 'wb') as destination_file:
+            destination_file.truncate(total_size)
+        ongoing_item_config = OnGoingItemConfig(self.environment, self.logger)
+        ongoing_item_config.current_total_copy_size = total_size
+        ongoing_item_config.current_block_size = 4 * MB
+        ongoing_item_config.current_source_path = self.source_path
+        ongoing_item_config.current_destination = self.destination_path
+        ongoing_item_config.current_slice_index = 0
+        ongoing_item_config.from_end = 'True'
+        ongoing_item_config.commit()
+        return source_data
+
+    def load_config(self):
+        ongoing_item_config = OnGoingItemConfig(self.environment, self.logger)
+        ongoing_item_config.load_value_from_file()
+        return ongoing_item_config
+
+    def copy(self, pipelined=True, allocation_map=None):
+        copy_task = TransactionalCopyTask(self.logger, None, self.load_config(), MockPatching(), self.environment, pipelined=pipelined, allocation_map=allocation_map)
+        try:
+            return copy_task.begin_copy()
+        finally:
+            copy_task.release_buffers()
+
+    def read_destination(self):
+        with open(self.destination_path, 'rb') as destination_file:
+            return destination_file.read()
+
+    def write_destination(self, offset, data):
+        with open(self.destination_path, 'r+b') as destination_file:
+            destination_file.seek(offset)
+            destination_file.write(data)
+
+    def get_checksums(self, data):
+        buf = mmap.mmap(-1, len(data))
+        buf.write(data)
+        return ",".join(["{0:08x}".format(checksum) for checksum in SliceCopier.get_checksums(buf, len(data))])
+
+    def test_pipelined_copy(self):
+        source_data = self.create_devices(37 * MB + 4096)
+        self.assertEqual(CommonVariables.process_success, self.copy())
+        self.assertEqual(source_data, self.read_destination())
+
+    def test_copy(self):
+        source_data = self.create_devices(37 * MB + 4096)
+        self.assertEqual(CommonVariables.process_success, self.copy(pipelined=False))
+        self.assertEqual(source_data, self.read_destination())
+
+    def test_copy_with_allocation_map(self):
+        total_size = 37 * MB + 4096
+        source_data = self.create_devices(total_size)
+        allocation_map = AllocationMap(total_size, MB)
+        for chunk_index in [0, 3, 4, 17, 36, 37]:
+            allocation_map.mark_allocated(chunk_index * MB, 1)
+        self.assertEqual(CommonVariables.process_success, self.copy(allocation_map=allocation_map))
+        destination_data = self.read_destination()
+        for chunk_index in range(0, 38):
+            chunk = slice(chunk_index * MB, (chunk_index + 1) * MB)
+            if(allocation_map.chunks[chunk_index]):
+                self.assertEqual(source_data[chunk], destination_data[chunk])
+            else:
+                self.assertEqual('\0' * MB, destination_data[chunk])
+
+    def test_copy_ext_file_system_with_allocation_map(self):
+        if(not e2fsprogs_available()):
+            self.skipTest('mkfs.ext4 and debugfs are needed for the file system images')
+        total_size = 128 * MB
+        file_path = os.path.join(self.work_dir, 'file')
+        file_data = os.urandom(20 * MB + 4321)
+        with open(file_path, 'wb') as data_file:
+            data_file.write(file_data)
+        image_path = os.path.join(self.work_dir, 'image')
+        make_ext_image(image_path, total_size, ['-b', '4096'])
+        write_ext_file(image_path, file_path, 'file')
+        with open(image_path, 'rb') as image_file:
+            self.create_devices(total_size, image_file.read())
+        allocation_map = AllocationMap.from_ext_file_system(AllocationMap.create_reader(self.source_path), total_size, self.logger)
+        self.assertNotEqual(None, allocation_map)
+        self.assertEqual(CommonVariables.process_success, self.copy(allocation_map=allocation_map))
+        self.assertTrue(check_ext_image(self.destination_path))
+        self.assertEqual(file_data, read_ext_file(self.destination_path, 'file', os.path.join(self.work_dir, 'copied_file')))
+
+    def test_resume_from_verified_backup(self):
+        total_size = 37 * MB + 4096
+        source_data = self.create_devices(total_size)
+        ongoing_item_config = self.load_config()
+        ongoing_item_config.copied_size = 4096 + 8 * MB
+        ongoing_item_config.current_slice_index = 3
+        backup_offset = total_size - ongoing_item_config.copied_size - 3 * MB
+        ongoing_item_config.backup_slice_offset = backup_offset
+        ongoing_item_config.backup_slice_size = 3 * MB
+        ongoing_item_config.backup_slice_checksums = self.get_checksums(source_data[backup_offset:backup_offset + 3 * MB])
+        ongoing_item_config.commit()
+        # the copy died writing the slice, the destination has a torn write.
+        self.write_destination(total_size - ongoing_item_config.copied_size, source_data[total_size - ongoing_item_config.copied_size:])
+        self.write_destination(backup_offset, source_data[backup_offset:backup_offset + MB] + 'x' * 100)
+        with open(self.environment.copy_slice_item_backup_file, 'wb') as backup_file:
+            backup_file.write(source_data[backup_offset:backup_offset + 3 * MB])
+        self.assertEqual(CommonVariables.process_success, self.copy())
+        self.assertEqual(source_data, self.read_destination())
+        self.assertFalse(os.path.exists(self.environment.copy_slice_item_backup_file))
+
+    def test_resume_from_torn_backup(self):
+        total_size = 37 * MB + 4096
+        source_data = self.create_devices(total_size)
+        ongoing_item_config = self.load_config()
+        ongoing_item_config.copied_size = 4096
+        ongoing_item_config.current_slice_index = 1
+        backup_offset = total_size - 4096 - 3 * MB
+        ongoing_item_config.backup_slice_offset = backup_offset
+        ongoing_item_config.backup_slice_size = 3 * MB
+        ongoing_item_config.backup_slice_checksums = self.get_checksums(source_data[backup_offset:backup_offset + 3 * MB])
+        ongoing_item_config.commit()
+        self.write_destination(total_size - 4096, source_data[-4096:])
+        # the backup was not completely written, its last block is garbage.
+        with open(self.environment.copy_slice_item_backup_file, 'wb') as backup_file:
+            backup_file.write(source_data[backup_offset:backup_offset + 2 * MB] + 'y' * MB)
+        self.assertEqual(CommonVariables.process_success, self.copy())
+        self.assertEqual(source_data, self.read_destination())
+        self.assertFalse(os.path.exists(self.environment.copy_slice_item_backup_file))
+
+if __name__ == '__main__':
+    unittest.main()